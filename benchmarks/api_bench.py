@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+import httpx
+from sqlalchemy import text
+from src.config import settings
+from src.database import async_engine
+from src.jobs import job_queue
+from src.rate_limit import rate_limiter
+from src.main import app
+from src.password_hashing import password_hasher
+from src.rebuild_ratings import rebuild_ratings
+from benchmarks.common import latency_summary
+
+
+# Нагрузочный бенчмарк основных ручек API.
+#
+#   python -m benchmarks.api_bench --seed-users 1000 --catalogue 5000 --movies-per-user 20 --reviews-per-movie 5
+#   python -m benchmarks.api_bench --requests 2000 --concurrency 32 --output bench/run.json
+#   python -m benchmarks.api_bench --compare bench/run.json         # сравнить с прошлым прогоном
+#
+# По умолчанию запросы идут прямо в src.main.app через ASGI-транспорт httpx — без сети
+# и без uvicorn, замеряется только приложение и база. С --base-url запросы идут
+# в запущенный сервер; он должен смотреть в ту же базу, что и настройки бенчмарка
+# и быть запущен с RATE_LIMIT_ENABLED=false — иначе замеряются ответы 429.
+#
+# Запускать на отдельной базе: --seed-users добавляет пользователей bench-<n>@movieshelf.local,
+# общий каталог фильмов, полки пользователей и отзывы (повторный запуск досоздаёт только недостающее).
+# Результат — JSON в stdout (и в --output), пригодный для сравнения прогонов.
+
+BENCH_EMAIL_LIKE = "bench-%@movieshelf.local"
+BENCH_PASSWORD = "bench-password"
+GENRES = ["Drama", "Comedy", "Action", "Horror", "Sci-Fi", "Thriller", "Romance", "Documentary"]
+
+
+# ------------------- Наполнение базы -------------------
+
+SEED_USERS_SQL = text("""
+    INSERT INTO users (email, password_hash)
+    SELECT 'bench-' || g || '@movieshelf.local', :password_hash
+    FROM generate_series(1, :users) AS g
+    ON CONFLICT (email) DO NOTHING
+""")
+
+BENCH_DESCRIPTION = "seeded by benchmarks.api_bench"
+
+# общий каталог: пользователи кладут на полки одни и те же фильмы
+SEED_MOVIES_SQL = text("""
+    INSERT INTO movies (title, genre, description)
+    SELECT 'Bench movie ' || g, (CAST(:genres AS text[]))[1 + g % :ng], :description
+    FROM generate_series(1, :catalogue) AS g
+    ON CONFLICT (canonical_key) WHERE deleted_at IS NULL AND tmdb_id IS NULL DO NOTHING
+""")
+
+SEED_SHELVES_SQL = text("""
+    WITH catalogue AS (
+        SELECT id, row_number() OVER (ORDER BY id) - 1 AS n, count(*) OVER () AS total
+        FROM movies WHERE description = :description
+    )
+    INSERT INTO shelf_entries (user_id, movie_id, rating)
+    SELECT u.id, c.id, (u.id + g) % 6
+    FROM users AS u
+    CROSS JOIN generate_series(1, :per_user) AS g
+    JOIN catalogue AS c ON c.n = (u.id * 7919 + g * 104729) % c.total
+    WHERE u.email LIKE :like
+      AND NOT EXISTS (SELECT 1 FROM shelf_entries AS s WHERE s.user_id = u.id)
+    ON CONFLICT DO NOTHING
+""")
+
+SEED_REVIEWS_SQL = text("""
+    INSERT INTO reviews (user_id, movie_id, score, text)
+    SELECT s.user_id, s.movie_id, (s.movie_id + s.user_id) % 6, 'bench review'
+    FROM (SELECT s.user_id, s.movie_id,
+                 row_number() OVER (PARTITION BY s.movie_id ORDER BY s.user_id) AS k
+          FROM shelf_entries AS s
+          JOIN users AS u ON u.id = s.user_id
+          WHERE u.email LIKE :like) AS s
+    WHERE s.k <= :per_movie
+      AND NOT EXISTS (SELECT 1 FROM reviews AS r WHERE r.movie_id = s.movie_id)
+""")
+
+DATASET_SQL = text("""
+    SELECT
+        (SELECT count(*) FROM users WHERE email LIKE :like) AS users,
+        (SELECT count(*) FROM movies WHERE description = :description) AS movies,
+        (SELECT count(*) FROM shelf_entries AS s JOIN users AS u ON u.id = s.user_id
+          WHERE u.email LIKE :like) AS shelf_entries,
+        (SELECT count(*) FROM reviews AS r JOIN users AS u ON u.id = r.user_id
+          WHERE u.email LIKE :like) AS reviews
+""")
+
+
+async def seed(users: int, catalogue: int, movies_per_user: int, reviews_per_movie: int):
+    # один хеш на всех: bcrypt на каждого пользователя занял бы минуты
+    password_hash = await password_hasher.hash(BENCH_PASSWORD)
+
+    async with async_engine.begin() as conn:
+        await conn.execute(SEED_USERS_SQL, {"users": users, "password_hash": password_hash})
+        print("seeded users", file=sys.stderr, flush=True)
+        await conn.execute(SEED_MOVIES_SQL, {"catalogue": catalogue, "genres": GENRES, "ng": len(GENRES),
+                                             "description": BENCH_DESCRIPTION})
+        print("seeded movies", file=sys.stderr, flush=True)
+        await conn.execute(SEED_SHELVES_SQL, {"per_user": movies_per_user, "like": BENCH_EMAIL_LIKE,
+                                              "description": BENCH_DESCRIPTION})
+        print("seeded shelves", file=sys.stderr, flush=True)
+        await conn.execute(SEED_REVIEWS_SQL, {"per_movie": reviews_per_movie, "like": BENCH_EMAIL_LIKE})
+        print("seeded reviews", file=sys.stderr, flush=True)
+
+    # отзывы вставлены в обход ручек — агрегаты рейтинга пересобираем штатным ремонтом;
+    # его сообщения уводим в stderr, чтобы stdout остался чистым JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        await rebuild_ratings()
+
+    async with async_engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("ANALYZE users, movies, shelf_entries, reviews"))
+
+
+# ------------------- Сценарии -------------------
+
+class Context:
+    """Данные для запросов: почты для логина, токены и id фильмов из засеянной базы"""
+
+    def __init__(self, emails: list[str], movie_ids: list[int]):
+        self.emails = emails
+        self.movie_ids = movie_ids
+        self.tokens: list[str] = []
+
+    def auth(self) -> dict:
+        return {"Authorization": f"Bearer {random.choice(self.tokens)}"}
+
+
+async def login(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    return await client.post("/auth/login", json={"username": random.choice(ctx.emails),
+                                                  "password": BENCH_PASSWORD})
+
+
+async def me(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    return await client.get("/auth/me", headers=ctx.auth())
+
+
+async def my_movies(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    return await client.get("/movies/my", headers=ctx.auth())
+
+
+async def add_review(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    return await client.post("/reviews/add", headers=ctx.auth(), json={
+        "movie_id": random.choice(ctx.movie_ids),
+        "score": random.randint(0, 5),
+        "text": "bench review",
+    })
+
+
+async def get_reviews(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    return await client.get(f"/reviews/get/{random.choice(ctx.movie_ids)}")
+
+
+SCENARIOS = {
+    "POST /auth/login": login,
+    "GET /auth/me": me,
+    "GET /movies/my": my_movies,
+    "POST /reviews/add": add_review,
+    "GET /reviews/get/{id}": get_reviews,
+}
+
+
+# ------------------- Прогон -------------------
+
+async def load_context(users: int) -> Context:
+    async with async_engine.connect() as conn:
+        emails = list((await conn.execute(
+            text("SELECT email FROM users WHERE email LIKE :like ORDER BY id LIMIT :n"),
+            {"like": BENCH_EMAIL_LIKE, "n": users},
+        )).scalars())
+        movie_ids = list((await conn.execute(
+            text("SELECT id FROM movies WHERE description = :description ORDER BY id LIMIT 10000"),
+            {"description": BENCH_DESCRIPTION},
+        )).scalars())
+
+    if not emails or not movie_ids:
+        raise SystemExit("В базе нет данных бенчмарка — запустите с --seed-users")
+    return Context(emails, movie_ids)
+
+
+async def obtain_tokens(client: httpx.AsyncClient, ctx: Context):
+    for email in ctx.emails:
+        response = await client.post("/auth/login", json={"username": email, "password": BENCH_PASSWORD})
+        response.raise_for_status()
+        ctx.tokens.append(response.json()["access_token"])
+
+
+async def run_scenario(client: httpx.AsyncClient, ctx: Context, scenario, total: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    statuses: Counter[str] = Counter()
+    queue = iter(range(total))
+
+    async def worker():
+        for _ in queue:
+            start = time.perf_counter()
+            try:
+                status = str((await scenario(client, ctx)).status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "errors": total - sum(count for status, count in statuses.items() if status.startswith("2")),
+        "status_codes": dict(sorted(statuses.items())),
+        "throughput_rps": round(total / elapsed, 1),
+        **latency_summary(latencies),
+    }
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    """Изменение в процентах относительно прошлого прогона (по общим ручкам)"""
+
+    def change(new, old):
+        if new is None or not old:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    result = {}
+    for name, stats in current.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        result[name] = {
+            "throughput_rps_change_pct": change(stats["throughput_rps"], old["throughput_rps"]),
+            "p50_ms_change_pct": change(stats["p50_ms"], old["p50_ms"]),
+            "p95_ms_change_pct": change(stats["p95_ms"], old["p95_ms"]),
+            "p99_ms_change_pct": change(stats["p99_ms"], old["p99_ms"]),
+        }
+    return result
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed-users", type=int, default=0, help="сколько пользователей засеять перед замером")
+    parser.add_argument("--catalogue", type=int, default=5000, help="сколько разных фильмов в каталоге")
+    parser.add_argument("--movies-per-user", type=int, default=20, help="фильмов на полке пользователя")
+    parser.add_argument("--reviews-per-movie", type=int, default=5)
+    parser.add_argument("--users", type=int, default=50, help="сколько засеянных пользователей логинится в прогоне")
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на каждую ручку")
+    parser.add_argument("--login-requests", type=int, default=200, help="запросов на /auth/login (bcrypt дорогой)")
+    parser.add_argument("--warmup", type=int, default=20, help="незамеряемых запросов на ручку перед замером")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--endpoints", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--base-url", help="адрес запущенного сервера; по умолчанию — приложение в процессе")
+    parser.add_argument("--output", help="куда дополнительно записать JSON с результатом")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    if args.seed_users:
+        await seed(args.seed_users, args.catalogue, args.movies_per_user, args.reviews_per_movie)
+
+    ctx = await load_context(args.users)
+    async with async_engine.connect() as conn:
+        dataset = dict((await conn.execute(DATASET_SQL, {"like": BENCH_EMAIL_LIKE,
+                                                               "description": BENCH_DESCRIPTION})).one()._mapping)
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=30,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=30)
+
+    endpoints = {}
+    if not args.base_url:
+        job_queue.start()  # ASGI-транспорт не запускает lifespan приложения
+        rate_limiter.enabled = False  # все запросы идут от нескольких пользователей с одного IP
+    async with client:
+        await obtain_tokens(client, ctx)
+        for name in args.endpoints:
+            scenario = SCENARIOS[name]
+            total = args.login_requests if scenario is login else args.requests
+            if args.warmup:
+                await run_scenario(client, ctx, scenario, args.warmup, args.concurrency)
+            endpoints[name] = await run_scenario(client, ctx, scenario, total, args.concurrency)
+            print(f"{name}: {endpoints[name]['throughput_rps']} rps, p95 {endpoints[name]['p95_ms']} ms",
+                  file=sys.stderr, flush=True)
+
+    report = {
+        "benchmark": "api",
+        "started_at": datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "target": args.base_url or "asgi",
+        "concurrency": args.concurrency,
+        "dataset": dataset,
+        "settings": {
+            "FAST_JSON_RESPONSES": settings.FAST_JSON_RESPONSES,
+            "DB_POOL_SIZE": settings.DB_POOL_SIZE,
+            "DB_MAX_OVERFLOW": settings.DB_MAX_OVERFLOW,
+            "BCRYPT_ROUNDS": settings.BCRYPT_ROUNDS,
+            "BCRYPT_WORKERS": settings.BCRYPT_WORKERS,
+        },
+        "endpoints": endpoints,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            report["baseline"] = {"file": args.compare, "endpoints": compare(endpoints, json.load(f)["endpoints"])}
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    await job_queue.stop()
+    await async_engine.dispose()
+    password_hasher.shutdown()
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+from collections import Counter
+from fastapi import FastAPI, HTTPException, Request
+
+
+# Локальная подмена TMDB API: без сети и без ключа, для тестов и бенчмарков импорта.
+#
+#   python -m benchmarks.fake_tmdb --port 8100 --latency-ms 50
+#   TMDB_BASE_URL=http://127.0.0.1:8100/3 python -m src.server
+#
+# В одном процессе с приложением — через транспорт httpx (см. benchmarks/tmdb_import.py):
+#
+#   from benchmarks.fake_tmdb import fake_tmdb
+#   use_transport(httpx.ASGITransport(app=fake_tmdb))
+#
+# Фильм выдумывается детерминированно по id: одинаковый id — одинаковый ответ.
+# id, кратные NOT_FOUND_EVERY, отвечают 404, как несуществующие фильмы TMDB,
+# у id, кратных NO_GENRES_EVERY, список жанров пуст — такие в TMDB тоже есть.
+# GET /stats — сколько запросов пришло по каждому id (тёплый импорт не должен
+# добавлять ни одного).
+
+GENRES = ["Драма", "Комедия", "Боевик", "Триллер", "Фантастика", "Ужасы", "Мелодрама", "Мультфильм"]
+NOT_FOUND_EVERY = 97
+NO_GENRES_EVERY = 13
+
+fake_tmdb = FastAPI(title="Fake TMDB")
+fake_tmdb.state.latency = 0.0
+fake_tmdb.state.requests = Counter()
+
+
+def fake_movie(tmdb_id: int) -> dict:
+    genre = GENRES[tmdb_id % len(GENRES)]
+    return {
+        "id": tmdb_id,
+        "title": f"Фильм TMDB {tmdb_id}",
+        "original_title": f"TMDB movie {tmdb_id}",
+        "overview": f"Описание фильма {tmdb_id}: {genre.lower()} из локальной подмены TMDB.",
+        "release_date": f"{1970 + tmdb_id % 55}-{1 + tmdb_id % 12:02d}-{1 + tmdb_id % 28:02d}",
+        "genres": [] if tmdb_id % NO_GENRES_EVERY == 0 else [{"id": 1000 + tmdb_id % len(GENRES), "name": genre}],
+        "vote_average": round(tmdb_id % 100 / 10, 1),
+    }
+
+
+@fake_tmdb.get("/3/movie/{tmdb_id}")
+async def get_movie(tmdb_id: int, request: Request):
+    if "authorization" not in request.headers and "api_key" not in request.query_params:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+    fake_tmdb.state.requests[tmdb_id] += 1
+    if fake_tmdb.state.latency:
+        await asyncio.sleep(fake_tmdb.state.latency)
+    if tmdb_id % NOT_FOUND_EVERY == 0:
+        raise HTTPException(status_code=404, detail="The resource you requested could not be found.")
+    return fake_movie(tmdb_id)
+
+
+@fake_tmdb.get("/stats")
+async def stats():
+    requests = fake_tmdb.state.requests
+    return {"requests": sum(requests.values()), "ids": len(requests)}
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Локальная подмена TMDB API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка ответа, как у настоящего TMDB")
+    args = parser.parse_args()
+
+    fake_tmdb.state.latency = args.latency_ms / 1000
+    uvicorn.run(fake_tmdb, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
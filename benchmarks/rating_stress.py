@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+import httpx
+from sqlalchemy import text
+from src.config import settings
+from src.database import async_engine
+from src.main import app
+from src.password_hashing import password_hasher
+from src.jobs import job_queue
+from src.rate_limit import rate_limiter
+from src.ratings import RATING_JOB
+
+
+# Стресс-проверка агрегатов рейтинга при параллельных отзывах к одним и тем же фильмам.
+#
+#   python -m benchmarks.rating_stress --movies 3 --operations 5000 --concurrency 64
+#   JOBS_DURABLE=true python -m benchmarks.rating_stress   # отложенный режим (по умолчанию с JOBS_DURABLE)
+#
+# Через src.main.app (ASGI-транспорт httpx) создаёт пользователя и несколько «горячих»
+# фильмов, затем параллельно добавляет (по одному и пачками), меняет и удаляет отзывы —
+# в том числе одни и те же отзывы из разных задач. Всё это время работает воркер
+# фоновых задач (src/jobs.py). После нагрузки задачи выполняются до конца, и агрегаты
+# каждого фильма сверяются с пересчётом по таблице reviews.
+#
+#   JOBS_DURABLE=true python -m benchmarks.rating_stress           # задачи через таблицу jobs
+#
+# Запускать на отдельной базе: созданные данные не удаляются.
+# Результат — JSON в stdout; код выхода 1, если хоть один фильм разошёлся.
+
+OPERATIONS = {"add": 0.55, "batch": 0.1, "edit": 0.2, "delete": 0.15}
+
+VERIFY_SQL = text("""
+    SELECT m.id, m.review_count, m.score_sum, m.rating,
+           coalesce(t.cnt, 0) AS expected_count,
+           coalesce(t.total, 0) AS expected_sum
+    FROM movies AS m
+    LEFT JOIN (SELECT movie_id, count(*) AS cnt, sum(score) AS total
+               FROM reviews GROUP BY movie_id) AS t ON t.movie_id = m.id
+    WHERE m.id = ANY(:movie_ids)
+    ORDER BY m.id
+""")
+
+
+class Stress:
+
+    def __init__(self, client: httpx.AsyncClient, headers: dict, movie_ids: list[int]):
+        self.client = client
+        self.headers = headers
+        self.movie_ids = movie_ids
+        self.review_ids: list[int] = []
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+
+    def review_body(self) -> dict:
+        return {"movie_id": random.choice(self.movie_ids),
+                "score": random.choice([0, 0.5, 1, 2, 2.5, 3, 4, 4.5, 5]),
+                "text": "stress"}
+
+    async def add(self):
+        response = await self.client.post("/reviews/add", headers=self.headers, json=self.review_body())
+        if response.status_code == 200:
+            self.review_ids.append(response.json()["id"])
+        return response
+
+    async def batch(self):
+        items = [self.review_body() for _ in range(random.randint(2, 10))]
+        response = await self.client.post("/reviews/batch", headers=self.headers, json={"items": items})
+        if response.status_code == 200:
+            self.review_ids.extend(review["id"] for review in response.json())
+        return response
+
+    async def edit(self):
+        if not self.review_ids:
+            return await self.add()
+        # id не убирается из списка: одни и те же отзывы специально правят разные задачи
+        review_id = random.choice(self.review_ids)
+        return await self.client.patch(f"/reviews/edit/{review_id}", headers=self.headers,
+                                       json=self.review_body())
+
+    async def delete(self):
+        if not self.review_ids:
+            return await self.add()
+        review_id = random.choice(self.review_ids)
+        response = await self.client.delete(f"/reviews/delete/{review_id}", headers=self.headers)
+        if response.status_code == 200 and review_id in self.review_ids:
+            self.review_ids.remove(review_id)
+        return response
+
+    async def run(self, total: int, concurrency: int):
+        names = list(OPERATIONS)
+        weights = list(OPERATIONS.values())
+        queue = iter(range(total))
+
+        async def worker():
+            for _ in queue:
+                name = random.choices(names, weights)[0]
+                response = await getattr(self, name)()
+                self.statuses[name][str(response.status_code)] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def setup(client: httpx.AsyncClient, movies: int) -> tuple[dict, list[int]]:
+    run_id = uuid.uuid4().hex[:12]
+    email = f"stress-{run_id}@movieshelf.local"
+    password = "stress-password"
+    (await client.post("/auth/register", json={"email": email, "password": password})).raise_for_status()
+    response = await client.post("/auth/login", json={"username": email, "password": password})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    movie_ids = []
+    for i in range(movies):
+        response = await client.post("/movies/add-custom", headers=headers,
+                                     json={"title": f"Stress movie {run_id} {i + 1}", "genre": "Drama"})
+        response.raise_for_status()
+        movie_ids.append(response.json()["id"])
+    return headers, movie_ids
+
+
+async def drain_jobs(movie_ids: list[int], timeout: float = 60.0):
+    """Выполнить оставшиеся в таблице jobs задачи рейтинга этих фильмов (очередь в памяти
+    уже пуста после job_queue.stop()); ждём и чужие воркеры, если они держат строки"""
+    if not settings.JOBS_DURABLE:
+        return
+
+    deadline = time.monotonic() + timeout
+    while True:
+        async with async_engine.connect() as conn:
+            pending = (await conn.execute(
+                text("SELECT count(*) FROM jobs WHERE kind = :kind AND key = ANY(:ids)"),
+                {"kind": RATING_JOB, "ids": movie_ids},
+            )).scalar_one()
+        if not pending:
+            return
+        if time.monotonic() > deadline:
+            raise SystemExit(f"Задачи рейтинга не выполнились за {timeout} с: осталось {pending}")
+        if not await job_queue.run_once():
+            await asyncio.sleep(0.1)
+
+
+async def verify(movie_ids: list[int]) -> list[dict]:
+    async with async_engine.connect() as conn:
+        rows = (await conn.execute(VERIFY_SQL, {"movie_ids": movie_ids})).all()
+
+    mismatches = []
+    for row in rows:
+        expected_rating = min(max(row.expected_sum / row.expected_count, 0.0), 5.0) if row.expected_count else 0.0
+        if (row.review_count != row.expected_count
+                or abs(row.score_sum - row.expected_sum) > 1e-6
+                or abs(row.rating - expected_rating) > 1e-6):
+            mismatches.append({
+                "movie_id": row.id,
+                "review_count": row.review_count, "expected_count": row.expected_count,
+                "score_sum": row.score_sum, "expected_sum": row.expected_sum,
+                "rating": row.rating, "expected_rating": expected_rating,
+            })
+    return mismatches
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=3, help="сколько «горячих» фильмов")
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    rate_limiter.enabled = False  # тысячи записей от одного пользователя — это и есть нагрузка
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress", timeout=60) as client:
+        headers, movie_ids = await setup(client, args.movies)
+
+        # ASGI-транспорт не запускает lifespan — воркер поднимаем сами
+        job_queue.start()
+
+        stress = Stress(client, headers, movie_ids)
+        started = time.perf_counter()
+        await stress.run(args.operations, args.concurrency)
+        elapsed = time.perf_counter() - started
+
+        await job_queue.stop()
+
+    await drain_jobs(movie_ids)
+    mismatches = await verify(movie_ids)
+    server_errors = sum(count for statuses in stress.statuses.values()
+                        for status, count in statuses.items() if status.startswith("5"))
+
+    print(json.dumps({
+        "benchmark": "rating_stress",
+        "mode": "deferred" if settings.RATING_UPDATES_DEFERRED else "immediate",
+        "jobs": "postgres" if settings.JOBS_DURABLE else "memory",
+        "movies": movie_ids,
+        "operations": args.operations,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "ops_per_sec": round(args.operations / elapsed, 1),
+        # 404 на edit/delete ожидаемы: отзыв успела удалить параллельная задача
+        "status_codes": {name: dict(sorted(statuses.items())) for name, statuses in stress.statuses.items()},
+        "server_errors": server_errors,
+        "mismatches": mismatches,
+        "ok": not mismatches and not server_errors,
+    }, ensure_ascii=False, indent=2))
+
+    await async_engine.dispose()
+    password_hasher.shutdown()
+    return 0 if not mismatches and not server_errors else 1
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from sqlalchemy import text
+from src.database import async_engine, new_async_session
+from src.models import Movie
+from src.search import build_search_query
+from benchmarks.common import latency_summary
+
+
+# Бенчмарк поиска /movies/search на большой таблице movies.
+#
+#   python -m benchmarks.search_bench --seed 1000000      # наполнить базу и замерить
+#   python -m benchmarks.search_bench --queries 2000      # только замер
+#
+# Запускать на отдельной базе: --seed добавляет фильмы в каталог movies
+# (номер в названии делает их все разными). Результат — JSON в stdout.
+
+WORDS = ["matrix", "star", "war", "night", "love", "dark", "king", "lost", "city", "dream",
+         "space", "river", "ghost", "storm", "last", "first", "blood", "summer", "winter", "road",
+         "война", "ночь", "любовь", "город", "брат", "море", "зима", "лето", "дорога", "тень"]
+GENRES = ["Drama", "Comedy", "Action", "Horror", "Sci-Fi", "Thriller", "Romance", "Documentary"]
+
+SEED_SQL = text("""
+    INSERT INTO movies (title, genre, description, rating)
+    SELECT
+        initcap(w[1 + (g * 7) % :nw] || ' ' || w[1 + (g * 13) % :nw] || ' ' || g),
+        gn[1 + g % :ng],
+        w[1 + (g * 17) % :nw] || ' ' || w[1 + (g * 19) % :nw] || ' ' || w[1 + (g * 23) % :nw],
+        round((random() * 5)::numeric, 1)
+    FROM generate_series(:start, :stop) AS g,
+         (SELECT CAST(:words AS text[]) AS w, CAST(:genres AS text[]) AS gn) AS dict
+    ON CONFLICT (canonical_key) WHERE deleted_at IS NULL AND tmdb_id IS NULL DO NOTHING
+""")
+
+
+async def seed(total: int, batch: int = 100_000):
+    for start in range(1, total + 1, batch):
+        async with async_engine.begin() as conn:
+            await conn.execute(SEED_SQL, {
+                "start": start, "stop": min(start + batch - 1, total),
+                "words": WORDS, "genres": GENRES, "nw": len(WORDS), "ng": len(GENRES),
+            })
+        print(f"seeded {min(start + batch - 1, total)}/{total}", flush=True)
+
+    async with async_engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("ANALYZE movies"))
+
+
+def random_query() -> dict:
+    kind = random.random()
+    if kind < 0.5:
+        q = " ".join(random.sample(WORDS, 2))
+    elif kind < 0.8:
+        # опечатка — проверяем нечёткий поиск по триграммам
+        word = random.choice(WORDS)
+        q = word[:-1] + random.choice("aeiou")
+    else:
+        q = random.choice(WORDS)
+
+    return {
+        "q": q,
+        "genre": random.choice(GENRES) if random.random() < 0.3 else None,
+        "min_rating": 3.0 if random.random() < 0.2 else None,
+        "max_rating": None,
+    }
+
+
+async def run_queries(total: int, concurrency: int, limit: int) -> list[float]:
+    latencies: list[float] = []
+    queue = iter(range(total))
+
+    async def worker():
+        async with new_async_session() as session:
+            for _ in queue:
+                params = random_query()
+                query = build_search_query((Movie.id, Movie.title), user_id=None, mine=False, cursor=None,
+                                           limit=limit, **params)
+                start = time.perf_counter()
+                (await session.execute(query)).all()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0, help="сколько фильмов добавить перед замером")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.seed:
+        await seed(args.seed)
+
+    async with async_engine.connect() as conn:
+        movies_total = (await conn.execute(text("SELECT count(*) FROM movies"))).scalar_one()
+
+    await run_queries(min(50, args.queries), args.concurrency, args.limit)  # прогрев кэшей
+    latencies = await run_queries(args.queries, args.concurrency, args.limit)
+
+    print(json.dumps({
+        "benchmark": "movies_search",
+        "movies": movies_total,
+        "queries": len(latencies),
+        "concurrency": args.concurrency,
+        **latency_summary(latencies),
+    }))
+
+    await async_engine.dispose()
+
+if __name__ == '__main__':
+    asyncio.run(main())
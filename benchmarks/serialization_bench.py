@@ -0,0 +1,79 @@
+import argparse
+import datetime
+import json
+import time
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.engine import result_tuple
+from src.models import Review
+from src.schemas import ReviewPageSchema
+from src.routers.reviews_router import READ_COLUMNS
+
+
+# Микробенчмарк сериализации списка отзывов: старый путь против быстрого режима.
+#
+#   old  — ORM-объекты Review -> ReviewPageSchema (from_attributes) -> jsonable_encoder -> json.dumps
+#   fast — строки column-only select() -> dict -> orjson.dumps  (FAST_JSON_RESPONSES=true)
+#
+#   python -m benchmarks.serialization_bench --rows 5000 --repeat 50
+#
+# Выборка из базы не участвует: строки создаются в памяти, поэтому замер показывает
+# чистую стоимость гидратации и сериализации. Результат — JSON в stdout.
+
+def make_orm_rows(count: int) -> list[Review]:
+    now = datetime.datetime(2025, 1, 1)
+    return [Review(id=i, user_id=i % 97, movie_id=1, score=float(i % 6), text=f"review #{i}", created_at=now)
+            for i in range(1, count + 1)]
+
+
+def make_column_rows(count: int) -> list:
+    # Row из column-only select() — именованный кортеж; его _asdict() и использует быстрый путь
+    now = datetime.datetime(2025, 1, 1)
+    columns = select(*READ_COLUMNS).selected_columns.keys()
+    make_row = result_tuple(list(columns))
+    return [make_row((i, i % 97, 1, float(i % 6), f"review #{i}", now)) for i in range(1, count + 1)]
+
+
+def old_path(rows) -> bytes:
+    page = ReviewPageSchema.model_validate({"items": rows, "next_cursor": None})
+    return json.dumps(jsonable_encoder(page)).encode()
+
+
+def fast_path(rows) -> bytes:
+    return orjson.dumps({"items": [row._asdict() for row in rows], "next_cursor": None})
+
+
+def measure(func, rows, repeat: int) -> float:
+    func(rows)  # прогрев
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(rows)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    orm_rows = make_orm_rows(args.rows)
+    column_rows = make_column_rows(args.rows)
+    assert json.loads(old_path(orm_rows)) == json.loads(fast_path(column_rows))
+
+    old_seconds = measure(old_path, orm_rows, args.repeat)
+    fast_seconds = measure(fast_path, column_rows, args.repeat)
+    total_rows = args.rows * args.repeat
+
+    print(json.dumps({
+        "benchmark": "reviews_serialization",
+        "rows_per_response": args.rows,
+        "repeat": args.repeat,
+        "old_rows_per_sec": round(total_rows / old_seconds),
+        "fast_rows_per_sec": round(total_rows / fast_seconds),
+        "speedup": round(old_seconds / fast_seconds, 2),
+    }))
+
+if __name__ == '__main__':
+    main()
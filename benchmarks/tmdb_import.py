@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+import httpx
+from src.config import settings
+from src.database import async_engine
+from src.main import app
+from src.rate_limit import rate_limiter
+from src.tmdb import tmdb_client, use_transport, MetadataCache
+from benchmarks.fake_tmdb import fake_tmdb, NOT_FOUND_EVERY
+
+
+# Импорт из TMDB против локальной подмены (benchmarks/fake_tmdb.py) — без сети.
+#
+#   python -m benchmarks.tmdb_import --movies 1000 --latency-ms 50
+#
+# Через src.main.app (ASGI-транспорт httpx):
+#   1. cold    — первый пользователь импортирует --movies фильмов пачками POST /movies/add-tmdb,
+#                всё идёт в подмену TMDB с задержкой --latency-ms;
+#   2. coalesce — --concurrency одновременных POST /movies/add-tmdb/{id} одного нового фильма
+#                должны дать один запрос в TMDB;
+#   3. warm    — второй пользователь импортирует те же фильмы: ни одного запроса в TMDB;
+#   4. restart — клиент TMDB закрыт и открыт заново на том же файле кэша: тоже ни одного.
+#
+# Кэш — во временном файле, база — из настроек (нужен Postgres с миграциями).
+# Результат — JSON в stdout; код выхода 1, если тёплый импорт ходил в TMDB.
+
+BATCH = 200
+
+
+async def register(client: httpx.AsyncClient) -> dict:
+    email = f"tmdb-{uuid.uuid4().hex[:12]}@movieshelf.local"
+    password = "tmdb-password"
+    (await client.post("/auth/register", json={"email": email, "password": password})).raise_for_status()
+    response = await client.post("/auth/login", json={"username": email, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def fake_requests() -> int:
+    return sum(fake_tmdb.state.requests.values())
+
+
+async def import_all(client: httpx.AsyncClient, headers: dict, ids: list[int]) -> dict:
+    before = fake_requests()
+    started = time.perf_counter()
+    inserted = failed = 0
+    for i in range(0, len(ids), BATCH):
+        response = await client.post("/movies/add-tmdb", headers=headers, json={"ids": ids[i:i + BATCH]})
+        response.raise_for_status()
+        inserted += response.json()["inserted"]
+        failed += response.json()["failed"]
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": round(elapsed, 3),
+        "movies_per_second": round(len(ids) / elapsed, 1),
+        "inserted": inserted,
+        "not_found": failed,
+        "tmdb_requests": fake_requests() - before,
+    }
+
+
+async def coalesce(client: httpx.AsyncClient, headers: dict, tmdb_id: int, concurrency: int) -> dict:
+    before = fake_requests()
+    responses = await asyncio.gather(*(client.post(f"/movies/add-tmdb/{tmdb_id}", headers=headers)
+                                       for _ in range(concurrency)))
+    return {
+        "requests": concurrency,
+        "ok": sum(response.status_code == 200 for response in responses),
+        "tmdb_requests": fake_requests() - before,
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="задержка ответа подмены TMDB")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных импортов одного фильма")
+    args = parser.parse_args()
+
+    # свои id на каждый запуск: фильмы прошлых запусков уже в каталоге
+    start = random.randrange(1, 10_000_000)
+    ids = list(range(start, start + args.movies))
+
+    rate_limiter.enabled = False
+    fake_tmdb.state.latency = args.latency_ms / 1000
+    use_transport(httpx.ASGITransport(app=fake_tmdb))
+    tmdb_client.access_token = tmdb_client.access_token or "fake-token"
+
+    cache_path = str(Path(tempfile.mkdtemp()) / "tmdb_cache.sqlite3")
+    tmdb_client.cache = MetadataCache(cache_path, settings.TMDB_CACHE_TTL_SECONDS, settings.TMDB_CACHE_MAX_ENTRIES)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://tmdb-bench", timeout=120) as client:
+        first, second = await register(client), await register(client)
+        cold = await import_all(client, first, ids)
+        coalesced = await coalesce(client, first, start + args.movies, args.concurrency)
+        warm = await import_all(client, second, ids)
+
+        await tmdb_client.aclose()
+        tmdb_client.cache = MetadataCache(cache_path, settings.TMDB_CACHE_TTL_SECONDS,
+                                          settings.TMDB_CACHE_MAX_ENTRIES)
+        restart = await import_all(client, second, ids)
+
+    await tmdb_client.aclose()
+    await async_engine.dispose()
+
+    result = {
+        "movies": args.movies,
+        "latency_ms": args.latency_ms,
+        "tmdb_concurrency": settings.TMDB_CONCURRENCY,
+        "expected_not_found": sum(tmdb_id % NOT_FOUND_EVERY == 0 for tmdb_id in ids),
+        "cold": cold,
+        "coalesce": coalesced,
+        "warm": warm,
+        "restart": restart,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    ok = warm["tmdb_requests"] == 0 and restart["tmdb_requests"] == 0 and coalesced["tmdb_requests"] == 1
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,55 @@
+"""initial schema
+
+Схема, которую создавал create_tables.py до перехода на миграции.
+Для уже существующей базы: alembic stamp 0001
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-11-20 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("email", sa.String(100), nullable=False, unique=True),
+        sa.Column("password_hash", sa.String(250), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False,
+                  server_default=sa.text("TIMEZONE('utc', now())")),
+    )
+    op.create_table(
+        "movies",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String(100), nullable=False),
+        sa.Column("genre", sa.String(100), nullable=False),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("rating", sa.Float(), nullable=False, server_default="0.0"),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.CheckConstraint("rating >= 0.0 AND rating <= 5.0", name="rating_range"),
+    )
+    op.create_table(
+        "reviews",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("text", sa.String(), nullable=True),
+        sa.Column("score", sa.Float(), nullable=False),
+        sa.Column("movie_id", sa.Integer(), sa.ForeignKey("movies.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("reviews")
+    op.drop_table("movies")
+    op.drop_table("users")
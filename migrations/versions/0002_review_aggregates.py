@@ -0,0 +1,42 @@
+"""review aggregates and created_at
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-11-20 12:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UTC_NOW = sa.text("TIMEZONE('utc', now())")
+
+
+def upgrade() -> None:
+    op.add_column("movies", sa.Column("review_count", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("movies", sa.Column("score_sum", sa.Float(), nullable=False, server_default="0.0"))
+    op.add_column("movies", sa.Column("created_at", sa.DateTime(), nullable=False, server_default=UTC_NOW))
+    op.add_column("reviews", sa.Column("created_at", sa.DateTime(), nullable=False, server_default=UTC_NOW))
+
+    # заполняем агрегаты по уже существующим отзывам
+    op.execute("""
+        UPDATE movies m
+        SET review_count = t.cnt, score_sum = t.total
+        FROM (SELECT movie_id, count(*) AS cnt, sum(score) AS total
+              FROM reviews GROUP BY movie_id) t
+        WHERE m.id = t.movie_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column("reviews", "created_at")
+    op.drop_column("movies", "created_at")
+    op.drop_column("movies", "score_sum")
+    op.drop_column("movies", "review_count")
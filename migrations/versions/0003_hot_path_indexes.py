@@ -0,0 +1,38 @@
+"""indexes for hot lookup paths
+
+Индексы строятся CONCURRENTLY, чтобы не блокировать запись в таблицы,
+поэтому миграция выполняется вне транзакции.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-11-20 12:20:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_movies_owner_id_id", "movies", ["owner_id", "id"]),
+    ("ix_movies_owner_id_created_at_id", "movies", ["owner_id", "created_at", "id"]),
+    ("ix_reviews_movie_id_id", "reviews", ["movie_id", "id"]),
+    ("ix_reviews_user_id_id", "reviews", ["user_id", "id"]),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
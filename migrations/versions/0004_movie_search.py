@@ -0,0 +1,47 @@
+"""movie search: tsvector column, GIN and trigram indexes
+
+Добавление STORED-колонки переписывает таблицу movies под эксклюзивной
+блокировкой; индексы затем строятся CONCURRENTLY вне транзакции.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-11-21 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(genre, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'C')"
+)
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column("movies", sa.Column("search_vector", TSVECTOR(),
+                                      sa.Computed(SEARCH_VECTOR_SQL, persisted=True)))
+
+    with op.get_context().autocommit_block():
+        op.create_index("ix_movies_search_vector", "movies", ["search_vector"],
+                        postgresql_using="gin", postgresql_concurrently=True)
+        op.create_index("ix_movies_title_trgm", "movies", ["title"],
+                        postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"},
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_movies_title_trgm", table_name="movies", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_movies_search_vector", table_name="movies", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("movies", "search_vector")
@@ -0,0 +1,31 @@
+"""deferred rating deltas
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-11-22 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "movie_rating_deltas",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("movie_id", sa.Integer(), nullable=False),
+        sa.Column("count_delta", sa.Integer(), nullable=False),
+        sa.Column("score_delta", sa.Float(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("movie_rating_deltas")
@@ -0,0 +1,62 @@
+"""background jobs table replaces movie_rating_deltas
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-11-23 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UTC_NOW = sa.text("TIMEZONE('utc', now())")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "jobs",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("kind", sa.String(50), nullable=False),
+        sa.Column("key", sa.BigInteger(), nullable=False),
+        sa.Column("payload", postgresql.JSONB()),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=UTC_NOW),
+    )
+
+    # дельты, не успевшие свернуться, применяем сразу — их таблица больше не нужна
+    op.execute("""
+        UPDATE movies m
+        SET review_count = m.review_count + d.cnt,
+            score_sum = CASE WHEN m.review_count + d.cnt > 0 THEN m.score_sum + d.total ELSE 0 END,
+            rating = CASE WHEN m.review_count + d.cnt > 0
+                          THEN least(greatest((m.score_sum + d.total) / (m.review_count + d.cnt), 0), 5)
+                          ELSE 0 END
+        FROM (SELECT movie_id, sum(count_delta) AS cnt, sum(score_delta) AS total
+              FROM movie_rating_deltas GROUP BY movie_id) d
+        WHERE m.id = d.movie_id
+    """)
+    op.drop_table("movie_rating_deltas")
+
+
+def downgrade() -> None:
+    op.create_table(
+        "movie_rating_deltas",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("movie_id", sa.Integer(), nullable=False),
+        sa.Column("count_delta", sa.Integer(), nullable=False),
+        sa.Column("score_delta", sa.Float(), nullable=False),
+    )
+    # невыполненные задачи рейтинга переносим обратно в дельты
+    op.execute("""
+        INSERT INTO movie_rating_deltas (movie_id, count_delta, score_delta)
+        SELECT key, (payload->>'count')::int, (payload->>'score')::float
+        FROM jobs WHERE kind = 'movie_rating'
+    """)
+    op.drop_table("jobs")
@@ -0,0 +1,161 @@
+"""canonical movie catalogue with per-user shelf entries
+
+Копии одного фильма у разных пользователей (то же название и жанр без учёта
+регистра и пробелов) сливаются в одну строку movies с наименьшим id. Отзывы
+копий переносятся на неё, агрегаты рейтинга слитых фильмов пересчитываются
+по отзывам, а владельцы копий получают строку shelf_entries.
+
+Личная оценка переносится на полку, только если у фильма не было отзывов:
+иначе movies.rating уже был средней оценкой отзывов, а не оценкой владельца.
+
+Запускать при остановленном приложении: очередь задач в памяти процесса
+могла бы применить дельты рейтинга к уже удалённым копиям. Добавление
+STORED-колонки переписывает movies под эксклюзивной блокировкой.
+
+Downgrade возвращает по копии фильма каждому пользователю с полки; отзывы
+остаются у копии первого добавившего.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-11-24 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UTC_NOW = sa.text("TIMEZONE('utc', now())")
+
+CANONICAL_KEY_SQL = (
+    "lower(regexp_replace(btrim(title), '[[:space:]]+', ' ', 'g')) || '|' || "
+    "lower(coalesce(btrim(genre), ''))"
+)
+
+SHELF_INDEXES = [
+    ("ix_shelf_entries_user_id_created_at_movie_id", ["user_id", "created_at", "movie_id"]),
+    ("ix_shelf_entries_user_id_rating_movie_id", ["user_id", "rating", "movie_id"]),
+    ("ix_shelf_entries_movie_id", ["movie_id"]),
+]
+
+
+def upgrade() -> None:
+    op.add_column("movies", sa.Column("canonical_key", sa.Text(), sa.Computed(CANONICAL_KEY_SQL, persisted=True)))
+
+    op.create_table(
+        "shelf_entries",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("movie_id", sa.Integer(), sa.ForeignKey("movies.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("rating", sa.Float()),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=UTC_NOW),
+        sa.CheckConstraint("rating >= 0.0 AND rating <= 5.0", name="shelf_rating_range"),
+    )
+
+    # каждой строке movies — id фильма, который останется в каталоге
+    op.execute("""
+        CREATE TEMPORARY TABLE movie_merge ON COMMIT DROP AS
+        SELECT id, min(id) OVER (PARTITION BY canonical_key) AS canonical_id
+        FROM movies
+    """)
+    op.execute("""
+        CREATE TEMPORARY TABLE merged_movies ON COMMIT DROP AS
+        SELECT canonical_id FROM movie_merge GROUP BY canonical_id HAVING count(*) > 1
+    """)
+
+    # при двух копиях у одного пользователя на полке остаётся более ранняя
+    op.execute("""
+        INSERT INTO shelf_entries (user_id, movie_id, rating, created_at)
+        SELECT m.owner_id, mm.canonical_id,
+               CASE WHEN m.review_count = 0 THEN m.rating END,
+               m.created_at
+        FROM movies AS m
+        JOIN movie_merge AS mm ON mm.id = m.id
+        ORDER BY m.id
+        ON CONFLICT (user_id, movie_id) DO NOTHING
+    """)
+
+    op.execute("""
+        UPDATE reviews AS r SET movie_id = mm.canonical_id
+        FROM movie_merge AS mm
+        WHERE r.movie_id = mm.id AND mm.id <> mm.canonical_id
+    """)
+
+    # задачи рейтинга слитых фильмов заменяет пересчёт по отзывам
+    op.execute("""
+        DELETE FROM jobs
+        WHERE kind = 'movie_rating'
+          AND key IN (SELECT id FROM movie_merge
+                      WHERE canonical_id IN (SELECT canonical_id FROM merged_movies))
+    """)
+    op.execute("""
+        UPDATE movies AS m
+        SET review_count = coalesce(t.cnt, 0),
+            score_sum = coalesce(t.total, 0),
+            rating = CASE WHEN t.cnt > 0 THEN least(greatest(t.total / t.cnt, 0), 5) ELSE 0 END
+        FROM merged_movies AS g
+        LEFT JOIN (SELECT movie_id, count(*) AS cnt, sum(score) AS total
+                   FROM reviews GROUP BY movie_id) AS t ON t.movie_id = g.canonical_id
+        WHERE m.id = g.canonical_id
+    """)
+
+    # без отзывов в rating лежала личная оценка — она уже на полке
+    op.execute("UPDATE movies SET rating = 0 WHERE review_count = 0 AND rating <> 0")
+
+    op.execute("DELETE FROM movies WHERE id IN (SELECT id FROM movie_merge WHERE id <> canonical_id)")
+
+    op.drop_index("ix_movies_owner_id_created_at_id", table_name="movies", if_exists=True)
+    op.drop_index("ix_movies_owner_id_id", table_name="movies", if_exists=True)
+    op.drop_column("movies", "owner_id")
+
+    op.create_index("uq_movies_canonical_key", "movies", ["canonical_key"], unique=True)
+    for name, columns in SHELF_INDEXES:
+        op.create_index(name, "shelf_entries", columns)
+
+
+def downgrade() -> None:
+    op.add_column("movies", sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")))
+    op.drop_index("uq_movies_canonical_key", table_name="movies")
+
+    # фильм с отзывами достаётся первому, кто положил его на полку
+    op.execute("""
+        CREATE TEMPORARY TABLE first_shelf ON COMMIT DROP AS
+        SELECT DISTINCT ON (movie_id) movie_id, user_id, rating
+        FROM shelf_entries
+        ORDER BY movie_id, created_at, user_id
+    """)
+    op.execute("""
+        UPDATE movies AS m
+        SET owner_id = f.user_id,
+            rating = CASE WHEN m.review_count = 0 THEN coalesce(f.rating, 0) ELSE m.rating END
+        FROM first_shelf AS f
+        WHERE m.id = f.movie_id
+    """)
+    op.execute("""
+        INSERT INTO movies (title, genre, description, rating, owner_id, created_at)
+        SELECT m.title, m.genre, m.description, coalesce(s.rating, 0), s.user_id, s.created_at
+        FROM shelf_entries AS s
+        JOIN movies AS m ON m.id = s.movie_id
+        JOIN first_shelf AS f ON f.movie_id = s.movie_id
+        WHERE s.user_id <> f.user_id
+    """)
+
+    # фильмы ни на чьей полке: с отзывами — автору первого отзыва, остальные не восстановить
+    op.execute("""
+        UPDATE movies AS m
+        SET owner_id = (SELECT r.user_id FROM reviews AS r WHERE r.movie_id = m.id ORDER BY r.id LIMIT 1)
+        WHERE m.owner_id IS NULL
+    """)
+    op.execute("DELETE FROM movies WHERE owner_id IS NULL")
+    op.alter_column("movies", "owner_id", nullable=False)
+
+    op.create_index("ix_movies_owner_id_id", "movies", ["owner_id", "id"])
+    op.create_index("ix_movies_owner_id_created_at_id", "movies", ["owner_id", "created_at", "id"])
+
+    op.drop_table("shelf_entries")
+    op.drop_column("movies", "canonical_key")
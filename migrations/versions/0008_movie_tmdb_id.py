@@ -0,0 +1,32 @@
+"""tmdb id of imported movies
+
+Колонка без значения по умолчанию добавляется без перезаписи таблицы,
+уникальный индекс строится CONCURRENTLY — миграция вне транзакции.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-11-25 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("movies", sa.Column("tmdb_id", sa.Integer()))
+    with op.get_context().autocommit_block():
+        op.create_index("uq_movies_tmdb_id", "movies", ["tmdb_id"], unique=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("uq_movies_tmdb_id", table_name="movies", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("movies", "tmdb_id")
@@ -0,0 +1,64 @@
+"""movie leaderboard materialized view
+
+Байесовская оценка фильма по отзывам:
+
+    score = (n * avg + C * mean) / (n + C)
+
+n и avg — число и средняя оценка отзывов фильма, mean — средняя оценка всех
+отзывов, C — PRIOR_WEIGHT «воображаемых» отзывов со средней оценкой. Фильм с одним
+отзывом 5.0 остаётся рядом со средним, пока не наберёт отзывов.
+
+Уникальный индекс по movie_id нужен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+(см. src/leaderboard.py), остальные — для выдачи по убыванию score.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-11-26 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PRIOR_WEIGHT = 10
+
+INDEXES = [
+    ("uq_movie_leaderboard_movie_id", ["movie_id"], True),
+    ("ix_movie_leaderboard_score_movie_id", ["score", "movie_id"], False),
+    ("ix_movie_leaderboard_genre_key_score_movie_id", ["genre_key", "score", "movie_id"], False),
+]
+
+
+def upgrade() -> None:
+    op.execute(f"""
+        CREATE MATERIALIZED VIEW movie_leaderboard AS
+        WITH per_movie AS (
+            SELECT movie_id, count(*) AS review_count, avg(score) AS avg_score
+            FROM reviews
+            GROUP BY movie_id
+        ),
+        prior AS (
+            SELECT coalesce(avg(score), 0) AS mean FROM reviews
+        )
+        SELECT m.id AS movie_id,
+               lower(m.genre) AS genre_key,
+               p.review_count,
+               p.avg_score,
+               (p.review_count * p.avg_score + {PRIOR_WEIGHT} * prior.mean)
+                   / (p.review_count + {PRIOR_WEIGHT}) AS score
+        FROM per_movie AS p
+        JOIN movies AS m ON m.id = p.movie_id
+        CROSS JOIN prior
+    """)
+    for name, columns, unique in INDEXES:
+        op.create_index(name, "movie_leaderboard", columns, unique=unique)
+
+
+def downgrade() -> None:
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS movie_leaderboard")
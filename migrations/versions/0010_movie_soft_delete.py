@@ -0,0 +1,56 @@
+"""movie soft delete
+
+movies.deleted_at: фильм, снятый с последней полки, помечается удалённым и
+убирается из всех чтений, а строку и отзывы пачками удаляет MoviePurger
+(см. src/movie_purge.py).
+
+Уникальные индексы canonical_key и tmdb_id становятся частичными — по живым
+фильмам: тот же фильм можно добавить снова, пока старая строка ждёт очистки.
+Новый индекс строится рядом со старым и подменяет его, все индексы — CONCURRENTLY,
+миграция вне транзакции.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2025-11-28 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UNIQUE_INDEXES = [
+    ("uq_movies_canonical_key", "canonical_key"),
+    ("uq_movies_tmdb_id", "tmdb_id"),
+]
+
+
+def _swap_unique_index(name: str, column: str, where: str | None):
+    op.create_index(f"{name}_new", "movies", [column], unique=True, postgresql_concurrently=True,
+                    postgresql_where=sa.text(where) if where else None)
+    op.drop_index(name, table_name="movies", postgresql_concurrently=True)
+    op.execute(f"ALTER INDEX {name}_new RENAME TO {name}")
+
+
+def upgrade() -> None:
+    op.add_column("movies", sa.Column("deleted_at", sa.DateTime()))
+    with op.get_context().autocommit_block():
+        op.create_index("ix_movies_deleted_at", "movies", ["deleted_at"], postgresql_concurrently=True,
+                        postgresql_where=sa.text("deleted_at IS NOT NULL"))
+        for name, column in UNIQUE_INDEXES:
+            _swap_unique_index(name, column, "deleted_at IS NULL")
+
+
+def downgrade() -> None:
+    # удалённые фильмы должны быть очищены: иначе полный уникальный индекс не построится
+    with op.get_context().autocommit_block():
+        for name, column in UNIQUE_INDEXES:
+            _swap_unique_index(name, column, None)
+        op.drop_index("ix_movies_deleted_at", table_name="movies", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("movies", "deleted_at")
@@ -0,0 +1,40 @@
+"""shelf rating sort index over coalesce(rating, -1.0)
+
+Личная оценка на полке может быть NULL (импорт из TMDB, перенос в 0007).
+/movies/my?sort=rating сортирует и пагинирует по coalesce(rating, -1.0) —
+иначе курсор (NULL, id) не совпадает ни с одной строкой. Индекс перестраивается
+по тому же выражению, CONCURRENTLY — миграция вне транзакции.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2025-11-29 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0011"
+down_revision: Union[str, None] = "0010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NAME = "ix_shelf_entries_user_id_rating_movie_id"
+
+
+def _swap_index(columns: list):
+    op.create_index(f"{NAME}_new", "shelf_entries", columns, postgresql_concurrently=True)
+    op.drop_index(NAME, table_name="shelf_entries", postgresql_concurrently=True)
+    op.execute(f"ALTER INDEX {NAME}_new RENAME TO {NAME}")
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        _swap_index(["user_id", sa.text("coalesce(rating, -1.0)"), "movie_id"])
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        _swap_index(["user_id", "rating", "movie_id"])
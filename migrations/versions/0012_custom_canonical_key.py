@@ -0,0 +1,42 @@
+"""canonical key deduplicates custom movies only
+
+Фильмы TMDB находятся и дедуплицируются по tmdb_id: фильм TMDB с теми же
+названием и жанром, что и чей-то свой фильм (или ремейк), — другая строка
+каталога. Уникальный индекс canonical_key перестраивается по живым фильмам
+без tmdb_id, CONCURRENTLY — миграция вне транзакции.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2025-11-30 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0012"
+down_revision: Union[str, None] = "0011"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NAME = "uq_movies_canonical_key"
+
+
+def _swap_index(where: str):
+    op.create_index(f"{NAME}_new", "movies", ["canonical_key"], unique=True, postgresql_concurrently=True,
+                    postgresql_where=sa.text(where))
+    op.drop_index(NAME, table_name="movies", postgresql_concurrently=True)
+    op.execute(f"ALTER INDEX {NAME}_new RENAME TO {NAME}")
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        _swap_index("deleted_at IS NULL AND tmdb_id IS NULL")
+
+
+def downgrade() -> None:
+    # фильмы TMDB с названием и жанром своих фильмов не дадут построить индекс — их сначала нужно слить
+    with op.get_context().autocommit_block():
+        _swap_index("deleted_at IS NULL")
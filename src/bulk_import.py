@@ -0,0 +1,247 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.catalogue import add_to_shelf
+from src.jobs import job_queue
+from src.user_stats import invalidate_user_stats
+from src.schemas import MovieAddCustomSchema
+
+
+# ------------------- Массовый импорт фильмов -------------------
+#
+# Тело запроса читается потоком и разбирается по одной записи, поэтому в памяти
+# никогда не лежит весь файл. Каждая запись проверяется MovieAddCustomSchema;
+# невалидные попадают в список ошибок и не прерывают импорт. Валидные копятся
+# пачками и ложатся на полку пользователя одним add_to_shelf на пачку:
+# фильмы, уже известные каталогу, не копируются (см. src/catalogue.py).
+
+MAX_RECORD_CHARS = 1_000_000  # защита от бесконечного буфера на сломанном JSON
+
+ParsedRow = tuple[int, dict | None, str | None]  # (номер строки, данные, ошибка)
+
+
+async def decode_utf8(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_lines(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    buffer = ""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+# ------------------- Форматы -------------------
+
+async def parse_ndjson(chunks: AsyncIterator[str]) -> AsyncIterator[ParsedRow]:
+    row = 0
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            yield row, json.loads(line), None
+        except ValueError as e:
+            yield row, None, f"некорректный JSON: {e}"
+
+
+async def parse_csv(chunks: AsyncIterator[str]) -> AsyncIterator[ParsedRow]:
+    header = None
+    record = ""
+    row = 0
+
+    async for line in iter_lines(chunks):
+        # запись в CSV может занимать несколько строк, пока не закрыты кавычки
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+
+        values = next(csv.reader([record.rstrip("\r")]), [])
+        record = ""
+        if not values:
+            continue
+
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+
+        row += 1
+        if len(values) != len(header):
+            yield row, None, f"ожидалось {len(header)} колонок, получено {len(values)}"
+            continue
+
+        # пустая ячейка в CSV означает отсутствие значения
+        yield row, {key: value if value != "" else None for key, value in zip(header, values)}, None
+
+    if record:
+        yield row + 1, None, "незакрытые кавычки в конце файла"
+
+
+async def parse_json_array(chunks: AsyncIterator[str]) -> AsyncIterator[ParsedRow]:
+    decoder = json.JSONDecoder()
+    stream = chunks.__aiter__()
+    buffer, pos, eof = "", 0, False
+    row = 0
+
+    async def fill() -> bool:
+        nonlocal buffer, pos, eof
+        try:
+            buffer = buffer[pos:] + await stream.__anext__()
+            pos = 0
+            return True
+        except StopAsyncIteration:
+            eof = True
+            return False
+
+    async def next_char() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not await fill():
+                return ""
+
+    if await next_char() != "[":
+        yield 1, None, "ожидался JSON-массив"
+        return
+    pos += 1
+
+    if await next_char() == "]":
+        return
+
+    while True:
+        row += 1
+        await next_char()  # raw_decode не пропускает пробелы перед значением
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer) or eof:
+                    break
+            except ValueError as e:
+                if eof or len(buffer) - pos > MAX_RECORD_CHARS:
+                    # структура массива сломана — продолжить разбор невозможно
+                    yield row, None, f"некорректный JSON: {e}"
+                    return
+            await fill()
+
+        pos = end
+        yield row, value, None
+
+        separator = await next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            yield row + 1, None, "ожидалась ',' или ']' между элементами массива"
+            return
+        pos += 1
+
+
+PARSERS = {
+    "application/json": parse_json_array,
+    "application/x-ndjson": parse_ndjson,
+    "application/jsonl": parse_ndjson,
+    "text/csv": parse_csv,
+}
+
+
+# ------------------- Проверка и вставка -------------------
+
+def validate_row(data) -> tuple[MovieAddCustomSchema | None, str | None]:
+    if not isinstance(data, dict):
+        return None, "запись должна быть объектом"
+
+    try:
+        movie = MovieAddCustomSchema.model_validate(data)
+    except ValidationError as e:
+        return None, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+    if movie.rating is not None and not (0 <= movie.rating <= 5):
+        return None, "Рейтинг должен быть от 0 до 5"
+
+    return movie, None
+
+
+async def insert_chunk(session: AsyncSession, user_id: int,
+                       chunk: list[tuple[int, dict]]) -> list[tuple[int, str]]:
+    """Кладёт пачку на полку целиком; если база её отвергла — построчно, чтобы найти виновные строки"""
+    try:
+        async with session.begin_nested():
+            await add_to_shelf(session, user_id, [values for _, values in chunk])
+        return []
+    except DBAPIError:
+        pass
+
+    errors = []
+    for row, values in chunk:
+        try:
+            async with session.begin_nested():
+                await add_to_shelf(session, user_id, [values])
+        except DBAPIError as e:
+            errors.append((row, str(e.orig).splitlines()[0]))
+    return errors
+
+
+async def import_movies(session: AsyncSession, rows: AsyncIterator[ParsedRow], user_id: int,
+                        chunk_size: int, max_rows: int, max_errors: int) -> dict:
+    inserted = 0
+    failed = 0
+    errors: list[dict] = []
+    chunk: list[tuple[int, dict]] = []
+
+    def add_error(row: int, error: str):
+        nonlocal failed
+        failed += 1
+        if len(errors) < max_errors:
+            errors.append({"row": row, "error": error})
+
+    async def flush():
+        nonlocal inserted
+        chunk_errors = await insert_chunk(session, user_id, chunk)
+        invalidate_user_stats(user_id, session)
+        await job_queue.commit(session)
+        for row, error in chunk_errors:
+            add_error(row, error)
+        inserted += len(chunk) - len(chunk_errors)
+        chunk.clear()
+
+    async for row, data, error in rows:
+        if row > max_rows:
+            add_error(row, f"превышен лимит в {max_rows} строк, остаток файла пропущен")
+            break
+
+        if error is None:
+            movie, error = validate_row(data)
+        if error is not None:
+            add_error(row, error)
+            continue
+
+        chunk.append((row, {
+            "title": movie.title,
+            "genre": movie.genre,
+            "description": movie.description,
+            "rating": movie.rating or 0.0,
+        }))
+        if len(chunk) >= chunk_size:
+            await flush()
+
+    if chunk:
+        await flush()
+
+    return {"inserted": inserted, "failed": failed, "errors": errors}
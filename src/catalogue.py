@@ -0,0 +1,168 @@
+from fastapi import HTTPException
+from sqlalchemy import select, delete, update, exists, values, column, text, Integer, String
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models import Movie, ShelfEntry, canonical_key_of
+from src.tmdb import TmdbMovie
+
+
+# ------------------- Каталог и полки -------------------
+#
+# Добавление фильма — это поиск или создание строки каталога (INSERT ... ON
+# CONFLICT DO NOTHING: строку фильма никто не блокирует на запись) и строка полки
+# пользователя с личной оценкой. Повторное добавление того же фильма на свою
+# полку ничего не меняет.
+#
+# Ключ поиска зависит от происхождения фильма:
+#   - свои фильмы (tmdb_id IS NULL) дедуплицируются по canonical_key — название и жанр;
+#   - фильмы TMDB — только по tmdb_id: ремейк с тем же названием или чей-то свой
+#     фильм с тем же названием и жанром — другая строка каталога.
+#
+# Фильм, снятый с последней полки, уходит из каталога: ему ставится deleted_at,
+# а строку и отзывы потом пачками удаляет MoviePurger (см. src/movie_purge.py).
+# Уникальные индексы и поиск видят только живые фильмы.
+
+CUSTOM_KEY_WHERE = Movie.deleted_at.is_(None) & Movie.tmdb_id.is_(None)  # = предикат uq_movies_canonical_key
+TMDB_KEY_WHERE = Movie.deleted_at.is_(None)                              # = предикат uq_movies_tmdb_id
+
+
+def _order_key(movie: dict) -> tuple[str, str]:
+    # приближение canonical_key: параллельные импорты вставляют новые фильмы в одном
+    # порядке и не ловят взаимоблокировку на уникальном индексе
+    return " ".join(movie["title"].split()).lower(), (movie["genre"] or "").strip().lower()
+
+
+CREATE_ATTEMPTS = 3
+
+
+async def _find_or_create(count: int, insert_missing, find) -> list[int]:
+    """INSERT ... ON CONFLICT DO NOTHING и поиск по тому же ключу для позиций 0..count-1.
+
+    Найденные строки блокируются FOR KEY SHARE (как проверка внешнего ключа): с ней
+    конфликтует только FOR UPDATE из remove_from_shelf — он дождётся коммита, когда фильм
+    уже на полке, и из каталога его не уберёт; обновление рейтинга при этом не ждёт.
+    Если строку, на которой сработал конфликт, успели удалить из каталога до поиска,
+    позиция вставляется заново (частичный уникальный индекс её уже не держит)"""
+    found: dict[int, int] = {}
+    missing = list(range(count))
+    for _ in range(CREATE_ATTEMPTS):
+        await insert_missing(missing)
+        found.update(await find(missing))
+        missing = [i for i in missing if i not in found]
+        if not missing:
+            return [found[i] for i in range(count)]
+    raise HTTPException(status_code=409, detail="Фильм одновременно изменяется в каталоге, повторите запрос")
+
+
+async def find_or_create_movies(session: AsyncSession, movies: list[dict]) -> list[int]:
+    """Свои фильмы: movies — [{"title", "genre", "description"}]; возвращает id фильмов
+    каталога в том же порядке"""
+
+    async def insert_missing(positions: list[int]):
+        await session.execute(
+            insert(Movie).on_conflict_do_nothing(index_elements=[Movie.canonical_key], index_where=CUSTOM_KEY_WHERE),
+            [{"title": movie["title"], "genre": movie["genre"], "description": movie["description"]}
+             for movie in sorted((movies[i] for i in positions), key=_order_key)]
+        )
+
+    async def find(positions: list[int]) -> dict[int, int]:
+        # id и новых, и уже бывших в каталоге фильмов — одним запросом по уникальному индексу
+        rows = values(column("position", Integer), column("title", String), column("genre", String),
+                      name="input").data([(i, movies[i]["title"], movies[i]["genre"]) for i in positions])
+        return dict((await session.execute(
+            select(rows.c.position, Movie.id)
+            .select_from(rows)
+            .join(Movie, Movie.canonical_key == canonical_key_of(rows.c.title, rows.c.genre))
+            .where(CUSTOM_KEY_WHERE)
+            .order_by(Movie.id)
+            .with_for_update(read=True, key_share=True, of=Movie)
+        )).all())
+
+    return await _find_or_create(len(movies), insert_missing, find) if movies else []
+
+
+async def find_or_create_tmdb_movies(session: AsyncSession, movies: list[TmdbMovie]) -> list[int]:
+    """Фильмы TMDB по tmdb_id (название в TMDB могло измениться); id в том же порядке"""
+
+    async def insert_missing(positions: list[int]):
+        await session.execute(
+            insert(Movie).on_conflict_do_nothing(index_elements=[Movie.tmdb_id], index_where=TMDB_KEY_WHERE),
+            [{"title": movie.title, "genre": movie.genre, "description": movie.description,
+              "tmdb_id": movie.tmdb_id}
+             for movie in sorted((movies[i] for i in positions), key=lambda movie: movie.tmdb_id)]
+        )
+
+    async def find(positions: list[int]) -> dict[int, int]:
+        rows = values(column("position", Integer), column("tmdb_id", Integer),
+                      name="input").data([(i, movies[i].tmdb_id) for i in positions])
+        return dict((await session.execute(
+            select(rows.c.position, Movie.id)
+            .select_from(rows)
+            .join(Movie, Movie.tmdb_id == rows.c.tmdb_id)
+            .where(TMDB_KEY_WHERE)
+            .order_by(Movie.id)
+            .with_for_update(read=True, key_share=True, of=Movie)
+        )).all())
+
+    return await _find_or_create(len(movies), insert_missing, find) if movies else []
+
+
+async def shelve(session: AsyncSession, user_id: int, movie_ids: list[int], ratings: list[float | None]):
+    if movie_ids:
+        await session.execute(
+            insert(ShelfEntry).on_conflict_do_nothing(index_elements=[ShelfEntry.user_id, ShelfEntry.movie_id]),
+            [{"user_id": user_id, "movie_id": movie_id, "rating": rating}
+             for movie_id, rating in zip(movie_ids, ratings)]
+        )
+
+
+async def add_to_shelf(session: AsyncSession, user_id: int, movies: list[dict]) -> list[int]:
+    """movies — [{"title", "genre", "description", "rating"}]; возвращает id фильмов
+    каталога в том же порядке. Коммит — за вызывающим"""
+    movie_ids = await find_or_create_movies(session, movies)
+    await shelve(session, user_id, movie_ids, [movie["rating"] for movie in movies])
+    return movie_ids
+
+
+async def add_tmdb_to_shelf(session: AsyncSession, user_id: int, movies: list[TmdbMovie]) -> list[int]:
+    """Фильмы TMDB на полку без личной оценки; возвращает id фильмов каталога в том же порядке"""
+    movie_ids = await find_or_create_tmdb_movies(session, movies)
+    await shelve(session, user_id, movie_ids, [None] * len(movie_ids))
+    return movie_ids
+
+
+async def remove_from_shelf(session: AsyncSession, user_id: int,
+                            movie_ids: list[int]) -> tuple[list[int], list[int]]:
+    """Снимает фильмы с полки пользователя. Возвращает (снятые, удалённые из каталога):
+    фильм удаляется, если ни на одной полке его не осталось. Три запроса на любое число
+    фильмов и отзывов — сами строки удалит MoviePurger. Коммит — за вызывающим"""
+    removed = list((await session.scalars(
+        delete(ShelfEntry)
+        .where(ShelfEntry.user_id == user_id, ShelfEntry.movie_id.in_(movie_ids))
+        .returning(ShelfEntry.movie_id)
+    )).all())
+    if not removed:
+        return [], []
+
+    # FOR UPDATE — отдельным запросом, в порядке id (как в src/ratings.py). Эта блокировка
+    # конфликтует с FOR KEY SHARE, которую берёт проверка внешнего ключа при вставке строки
+    # полки: незакоммиченное добавление того же фильма на другую полку дождётся, и UPDATE
+    # ниже (новый снимок) увидит его строку. Добавление, начатое после блокировки, всё же
+    # может попасть на удалённый фильм — такой фильм MoviePurger возвращает в каталог
+    locked = list((await session.scalars(
+        select(Movie.id)
+        .where(Movie.id.in_(removed), Movie.deleted_at.is_(None))
+        .order_by(Movie.id)
+        .with_for_update()
+    )).all())
+    if not locked:
+        return removed, []
+
+    retired = list((await session.scalars(
+        update(Movie)
+        .where(Movie.id.in_(locked), ~exists().where(ShelfEntry.movie_id == Movie.id))
+        .values(deleted_at=text("TIMEZONE('utc', now())"))
+        .returning(Movie.id)
+        .execution_options(synchronize_session=False)
+    )).all())
+    return removed, retired
@@ -1,15 +1,9 @@
+from typing import Optional
+from pydantic import model_validator
 from pydantic_settings import SettingsConfigDict, BaseSettings
 from pathlib import Path
-from dotenv import load_dotenv
-import os
 
 
-load_dotenv()
-
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
-
 class Settings(BaseSettings):
     DB_HOST: str
     DB_PORT: str
@@ -17,18 +11,142 @@ class Settings(BaseSettings):
     DB_PASS: str
     DB_NAME: str
 
+    # Пул соединений и движок (см. src/database.py)
+    DB_ECHO: bool = False             # полный лог SQL — только для отладки
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 10.0     # секунд ожидания свободного соединения
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 500  # кэш подготовленных выражений asyncpg на соединение
+    DB_JIT: bool = False              # JIT Postgres только мешает коротким OLTP-запросам
+    DB_SLOW_QUERY_MS: int = 200       # запросы дольше порога пишутся в лог
+    DB_WARMUP_CONNECTIONS: int = 4    # сколько соединений пула открыть при старте воркера
+
+    # Продакшен-запуск (см. src/server.py)
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0                         # 0 — по числу ядер
+    SERVER_BACKLOG: int = 2048
+    SERVER_FORWARDED_ALLOW_IPS: str = "127.0.0.1"   # адреса балансировщиков, которым верим X-Forwarded-For
+    SERVER_GRACEFUL_SHUTDOWN_SECONDS: int = 30
+    SERVER_ACCESS_LOG: bool = False                 # задержки и так видны в /metrics
+
+    # Метрики запросов (см. src/request_metrics.py): HTTP-запросы дольше порога пишутся в лог
+    SLOW_REQUEST_MS: int = 500
+
+    # Реплики для чтения: "host1:5432,host2:5432" (те же пользователь, пароль и база)
+    DB_REPLICA_HOSTS: str = ""
+    DB_REPLICA_HEALTH_INTERVAL: float = 5.0  # как часто перепроверять реплику, секунд
+    DB_REPLICA_STICKY_SECONDS: int = 5       # сколько после записи читать с primary
+
     SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
-    ALGORITHM: str = "H256"
+    ALGORITHM: str = "HS256"
+
+    # Кэш проверенных токенов (см. src/token_cache.py)
+    AUTH_CACHE_SIZE: int = 10_000
+    AUTH_CACHE_TTL_SECONDS: int = 300   # столько удалённый пользователь ещё проходит проверку токена
+
+    # Хеширование паролей (см. src/password_hashing.py)
+    BCRYPT_ROUNDS: int = 12
+    BCRYPT_WORKERS: int = 4
+    BCRYPT_MAX_PENDING: int = 64  # сверх этого — 503 вместо ожидания в очереди
+
+    # Ограничение частоты запросов (см. src/rate_limit.py): ведро токенов на IP или пользователя,
+    # *_PER_MINUTE — скорость пополнения, *_BURST — сколько запросов можно сделать подряд
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_MAX_KEYS: int = 100_000  # вёдер в памяти процесса
+    RATE_LIMIT_SHARDS: int = 16
+    RATE_LIMIT_LOGIN_PER_MINUTE: int = 10        # на IP
+    RATE_LIMIT_LOGIN_BURST: int = 5
+    RATE_LIMIT_REGISTER_PER_MINUTE: int = 5      # на IP
+    RATE_LIMIT_REGISTER_BURST: int = 3
+    RATE_LIMIT_WRITE_PER_MINUTE: int = 120       # на пользователя: отзывы и свои фильмы
+    RATE_LIMIT_WRITE_BURST: int = 30
+    RATE_LIMIT_BULK_PER_MINUTE: int = 6          # на пользователя: пачки отзывов и импорт
+    RATE_LIMIT_BULK_BURST: int = 3
+
+    # Агрегаты рейтинга (см. src/ratings.py): отложенный режим убирает строку фильма
+    # с пути записи отзыва — рейтинг пересчитывает фоновая задача. Не задано — отложенный
+    # при JOBS_DURABLE, иначе в транзакции отзыва; true без JOBS_DURABLE — ошибка старта
+    RATING_UPDATES_DEFERRED: Optional[bool] = None
+
+    # Фоновые задачи после записи (см. src/jobs.py)
+    JOBS_DURABLE: bool = False            # true — задачи в таблице jobs, переживают рестарт
+    JOBS_MAX_PENDING: int = 10_000        # ключей в очереди процесса, дальше запись ждёт воркер
+    JOBS_BATCH_SIZE: int = 500
+    JOBS_POLL_INTERVAL_SECONDS: float = 1.0
+    JOBS_DRAIN_TIMEOUT_SECONDS: float = 10.0
+
+    # Лучшие фильмы (GET /movies/top, см. src/leaderboard.py)
+    LEADERBOARD_REFRESH_INTERVAL_SECONDS: float = 300.0
+    LEADERBOARD_REFRESH_AFTER_WRITES: int = 1000  # изменений отзывов в процессе — обновить раньше таймера
+
+    # Похожие фильмы и рекомендации (см. src/recommendations.py, сборка — src/recommendations_build.py)
+    RECOMMENDATIONS_DIR: str = "recommendations"
+    RECOMMENDATIONS_RELOAD_SECONDS: float = 30.0  # как часто воркер проверяет, нет ли новой версии
+    RECOMMENDATIONS_TOP_K: int = 50                # соседей на фильм
+    RECOMMENDATIONS_SHRINKAGE: float = 10.0        # сходство по n общим зрителям * n / (n + shrinkage)
+    RECOMMENDATIONS_BATCH_SIZE: int = 1024         # фильмов в одном разреженном произведении
+    RECOMMENDATIONS_FULL_REBUILD_SHARE: float = 0.2  # изменилась большая доля фильмов — сборка заново
+
+    # Удаление фильмов из каталога (см. src/movie_purge.py)
+    PURGE_BATCH_SIZE: int = 1000           # отзывов в одной транзакции очистки
+    PURGE_INTERVAL_SECONDS: float = 60.0   # как часто искать удалённые фильмы, когда очищать нечего
+    PURGE_PAUSE_SECONDS: float = 0.1       # пауза между пачками — место обычным запросам и репликам
+
+    # Быстрый режим ответов: orjson и списки без ORM-объектов и pydantic-валидации
+    FAST_JSON_RESPONSES: bool = False
+
+    # Постраничная выдача списков
+    PAGE_DEFAULT_LIMIT: int = 50
+    PAGE_MAX_LIMIT: int = 500
+
+    # Кэш ответов GET /reviews/get/{movie_id} (см. src/response_cache.py)
+    RESPONSE_CACHE_SIZE: int = 2048
+    RESPONSE_CACHE_TTL_SECONDS: float = 60.0
+
+    # Массовый импорт фильмов (POST /movies/bulk)
+    BULK_IMPORT_CHUNK_SIZE: int = 1000
+    BULK_IMPORT_MAX_ROWS: int = 200_000
+    BULK_IMPORT_MAX_ERRORS: int = 1000  # сколько ошибок вернуть подробно
+
+    # Импорт из TMDB (см. src/tmdb.py)
+    TMDB_API_KEY: str = ""                # ключ API v3 (параметр api_key)
+    TMDB_ACCESS_API_KEY: str = ""         # токен чтения API (Bearer), если задан — вместо ключа
+    TMDB_BASE_URL: str = "https://api.themoviedb.org/3"
+    TMDB_LANGUAGE: str = "ru-RU"
+    TMDB_TIMEOUT_SECONDS: float = 10.0
+    TMDB_MAX_CONNECTIONS: int = 10        # keep-alive соединений с TMDB на процесс
+    TMDB_CONCURRENCY: int = 8             # одновременных запросов к TMDB на процесс
+    TMDB_CACHE_PATH: str = "tmdb_cache.sqlite3"
+    TMDB_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    TMDB_CACHE_MAX_ENTRIES: int = 100_000
+
+    @model_validator(mode="after")
+    def _resolve_rating_updates(self):
+        if self.RATING_UPDATES_DEFERRED is None:
+            self.RATING_UPDATES_DEFERRED = self.JOBS_DURABLE
+        elif self.RATING_UPDATES_DEFERRED and not self.JOBS_DURABLE:
+            # очередь в памяти теряет дельты уже закоммиченных отзывов при падении процесса
+            raise ValueError("RATING_UPDATES_DEFERRED=true требует JOBS_DURABLE=true")
+        return self
 
     @property
     def DATABASE_URL_asyncpg(self):
         # URL для асинхронного подключения через asyncpg
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
+    @property
+    def REPLICA_URLS_asyncpg(self) -> list[str]:
+        return [f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{host.strip()}/{self.DB_NAME}"
+                for host in self.DB_REPLICA_HOSTS.split(",") if host.strip()]
+
 
-    # Загрузка переменных из .env, который лежит на уровень выше текущего файла
-    model_config = SettingsConfigDict(env_file=Path(__file__).resolve().parent / ".env")
+    # Переменные из .env в корне проекта и в src/ (второй важнее); переменные окружения важнее обоих
+    model_config = SettingsConfigDict(env_file=(Path(__file__).resolve().parent.parent / ".env",
+                                                Path(__file__).resolve().parent / ".env"))
 
 
 # Инициализация настроек при старте приложения
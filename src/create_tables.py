@@ -1,15 +1,19 @@
-import asyncio
-from database import async_engine, Base
-from models import *
+from pathlib import Path
+from alembic import command
+from alembic.config import Config
 
 
+# Схема базы теперь ведётся миграциями Alembic (каталог migrations/).
+# Скрипт доводит базу до последней ревизии и ничего не удаляет.
+# Запуск: python -m src.create_tables   (то же самое: alembic upgrade head)
 
-async def create_tables():
-    async with async_engine.begin() as conn:
-        print("Создаем таблицы!")
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
-        print("Таблицы созданы!")
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+
+def create_tables():
+    print("Применяем миграции!")
+    command.upgrade(Config(str(ALEMBIC_INI)), "head")
+    print("База в актуальном состоянии!")
 
 if __name__ == '__main__':
-    asyncio.run(create_tables())
\ No newline at end of file
+    create_tables()
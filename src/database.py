@@ -1,26 +1,190 @@
+import asyncio
+import contextlib
+import logging
+import time
 from typing import Annotated
-from fastapi import Depends
+from fastapi import Depends, Request, Response
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, Session
 from src.config import settings
+from src.db_metrics import InstrumentedPool, install_slow_query_log
+from src.request_metrics import install_query_tracking
+
+
+logger = logging.getLogger("movieshelf.database")
 
 
 # --- Создание асинхронного движка для асинхронного подключения к БД ---
 
-async_engine = create_async_engine(
-    settings.DATABASE_URL_asyncpg,
-    echo=True
-)
+def create_engine_from_settings(url: str):
+    engine = create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        poolclass=InstrumentedPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {"jit": "on" if settings.DB_JIT else "off"},
+        }
+    )
+    install_slow_query_log(engine.sync_engine, settings.DB_SLOW_QUERY_MS)
+    install_query_tracking(engine.sync_engine)
+    return engine
+
+async_engine = create_engine_from_settings(settings.DATABASE_URL_asyncpg)
 
 # --- Фабрика сессий ---
 
-new_async_session = async_sessionmaker(async_engine, expire_on_commit=False)
+class PrimarySession(Session):
+    """Сессия primary: помечает запись, чтобы после коммита включить чтение с primary"""
 
-async def get_session():
+
+new_async_session = async_sessionmaker(async_engine, expire_on_commit=False, sync_session_class=PrimarySession)
+
+async def get_session(response: Response):
     async with new_async_session() as session:
+        session.info["response"] = response
         yield session
 
 SessionDep = Annotated[AsyncSession, Depends(get_session)]
 
+
+# --- Read-your-writes: после своей записи клиент какое-то время читает с primary ---
+
+STICKY_COOKIE = "primary_until"
+
+
+@event.listens_for(PrimarySession, "after_flush")
+def _mark_orm_write(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(PrimarySession, "do_orm_execute")
+def _mark_dml_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(PrimarySession, "after_commit")
+def _set_sticky_cookie(session):
+    response = session.info.get("response")
+    if session.info.pop("wrote", False) and response is not None:
+        response.set_cookie(STICKY_COOKIE, str(time.time() + settings.DB_REPLICA_STICKY_SECONDS),
+                            max_age=settings.DB_REPLICA_STICKY_SECONDS, httponly=True)
+
+
+@event.listens_for(PrimarySession, "after_rollback")
+def _forget_write(session):
+    session.info.pop("wrote", None)
+
+
+def wrote_recently(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+# --- Реплики для чтения ---
+
+async def ping(engine, timeout: float = 1) -> bool:
+    """SELECT 1 с таймаутом: отвечает ли база"""
+    try:
+        async with asyncio.timeout(timeout):
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
+
+
+class ReplicaSet:
+    """Раздаёт сессии реплик по кругу, пропуская реплики, не ответившие на проверку"""
+
+    def __init__(self, urls: list[str], health_interval: float):
+        self.engines = [create_engine_from_settings(url) for url in urls]
+        self._session_makers = [async_sessionmaker(engine, expire_on_commit=False) for engine in self.engines]
+        self._healthy = [True] * len(self.engines)
+        self._checked_at = [0.0] * len(self.engines)
+        self._health_interval = health_interval
+        self._next = 0
+
+    async def _is_healthy(self, index: int) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at[index] < self._health_interval:
+            return self._healthy[index]
+
+        self._checked_at[index] = now
+        self._healthy[index] = await ping(self.engines[index])
+        return self._healthy[index]
+
+    async def pick(self) -> async_sessionmaker | None:
+        for _ in range(len(self.engines)):
+            index = self._next
+            self._next = (index + 1) % len(self.engines)
+            if await self._is_healthy(index):
+                return self._session_makers[index]
+
+        return None  # живых реплик нет — читаем с primary
+
+
+replica_set = ReplicaSet(settings.REPLICA_URLS_asyncpg, settings.DB_REPLICA_HEALTH_INTERVAL)
+
+
+def is_primary(session: AsyncSession) -> bool:
+    return session.bind is async_engine
+
+
+async def read_sessionmaker(request: Request) -> async_sessionmaker:
+    if wrote_recently(request):
+        return new_async_session
+
+    return await replica_set.pick() or new_async_session
+
+async def get_read_session(request: Request):
+    session_maker = await read_sessionmaker(request)
+    async with session_maker() as session:
+        yield session
+
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_session)]
+
+
+# --- Прогрев и закрытие пулов (lifespan приложения) ---
+
+async def warm_up_pool(engine, connections: int, queries) -> int:
+    """Заранее открыть connections соединений и выполнить на каждом горячие запросы
+    (queries — функции от сессии, как в ручках):
+    первые запросы к воркеру не ждут подключения к базе, а asyncpg уже держит
+    подготовленные выражения в кэше соединения. Возвращает число прогретых соединений"""
+    connections = min(connections, engine.pool.size())
+
+    async def warm_one(stack: contextlib.AsyncExitStack):
+        # соединения держим до конца прогрева, иначе пул отдаст одно и то же
+        conn = await stack.enter_async_context(engine.connect())
+        async with AsyncSession(conn) as session:
+            for query in queries:
+                await query(session)
+
+    try:
+        async with contextlib.AsyncExitStack() as stack:
+            await asyncio.gather(*(warm_one(stack) for _ in range(connections)))
+    except Exception:
+        # база может подняться позже: воркер стартует, соединения откроются по первым запросам
+        logger.exception("Прогрев пула %s не удался", engine.url.render_as_string())
+        return 0
+    return connections
+
+
+async def dispose_engines():
+    """Закрыть соединения primary и реплик — последним шагом остановки воркера"""
+    for engine in [async_engine, *replica_set.engines]:
+        await engine.dispose()
+
+
 class Base(DeclarativeBase):
-    pass
\ No newline at end of file
+    pass
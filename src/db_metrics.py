@@ -0,0 +1,91 @@
+import json
+import logging
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+slow_query_logger = logging.getLogger("movieshelf.slow_query")
+
+
+# ------------------- Метрики пула соединений -------------------
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Очередь соединений, которая считает время ожидания свободного соединения"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - start)
+
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    status = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status.update({
+            "checkouts_total": stats.checkouts,
+            "checkout_timeouts_total": stats.timeouts,
+            "checkout_wait_seconds_total": round(stats.wait_seconds_total, 6),
+            "checkout_wait_seconds_max": round(stats.wait_seconds_max, 6),
+        })
+
+    return status
+
+
+# ------------------- Лог медленных запросов -------------------
+
+def install_slow_query_log(sync_engine: Engine, threshold_ms: int):
+    """Пишет в лог одну JSON-строку на каждый запрос дольше threshold_ms (вместо echo всего SQL)"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _log_if_slow(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+        if elapsed_ms >= threshold_ms:
+            slow_query_logger.warning(json.dumps({
+                "event": "slow_query",
+                "duration_ms": round(elapsed_ms, 2),
+                "statement": " ".join(statement.split()),
+                "executemany": executemany,
+                "rowcount": cursor.rowcount,
+            }, ensure_ascii=False))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _drop_timer(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
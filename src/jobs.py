@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+from sqlalchemy import select, delete, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import settings
+from src.database import PrimarySession, new_async_session
+from src.models import Job
+
+
+logger = logging.getLogger("movieshelf.jobs")
+
+
+# ------------------- Фоновые задачи после записи -------------------
+#
+# Производная работа (агрегаты рейтинга, сброс кэша ответов) не выполняется
+# в запросе. Обработчик ставит задачу enqueue(session, kind, key, payload) и
+# коммитит через job_queue.commit(session), а выполняет её фоновый воркер.
+# Задачи одного вида с одним ключом схлопываются: payload объединяются функцией
+# merge вида (для рейтинга — сумма дельт), и воркер получает их пачкой
+# {key: payload} — сотня отзывов к одному фильму даёт одно обновление его строки.
+#
+# Память (по умолчанию): задачи попадают в очередь процесса после коммита.
+# Очередь ограничена JOBS_MAX_PENDING ключами; когда она полна, commit ждёт,
+# пока воркер освободит место. При падении процесса невыполненные задачи
+# теряются, поэтому отложенный рейтинг (RATING_UPDATES_DEFERRED) — только с JOBS_DURABLE
+# (там он и включён по умолчанию).
+#
+# Postgres (JOBS_DURABLE=true): задача пишется строкой в jobs в той же транзакции,
+# что и сама запись, и не теряется. Воркеры всех процессов забирают пачки через
+# FOR UPDATE SKIP LOCKED и удаляют их в транзакции выполнения — задача либо
+# выполнена, либо осталась в таблице. Виды с local=True (сброс кэша в памяти
+# процесса) и в этом режиме идут через очередь процесса.
+#
+# Виды с inline=True (сброс версий кэша ответов) выполняются прямо в commit(),
+# сразу после коммита и до ответа клиенту: следующий запрос того же клиента уже
+# не получит из кэша страницу до записи. Если обработчик упал, задача уходит в
+# очередь процесса и повторяется воркером.
+
+JobHandler = Callable[[AsyncSession, dict[int, Any]], Awaitable[None]]
+
+
+def keep_last(old, new):
+    return new
+
+
+@dataclass
+class JobKind:
+    handler: JobHandler
+    merge: Callable[[Any, Any], Any]
+    local: bool
+    inline: bool
+
+
+class JobQueue:
+
+    def __init__(self, durable: bool, max_pending: int, batch_size: int,
+                 poll_interval: float, drain_timeout: float):
+        self.durable = durable
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.drain_timeout = drain_timeout
+        self.kinds: dict[str, JobKind] = {}
+        self._pending: OrderedDict[tuple[str, int], Any] = OrderedDict()
+        self._has_work = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+
+    def register(self, kind: str, handler: JobHandler, merge=keep_last, local: bool = False,
+                 inline: bool = False):
+        self.kinds[kind] = JobKind(handler, merge, local or inline, inline)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # ------------------- Постановка -------------------
+
+    def enqueue(self, session: AsyncSession, kind: str, key: int, payload: Any = None):
+        """Задача выполнится, только если транзакция session закоммитится через commit()"""
+        if self.durable and not self.kinds[kind].local:
+            session.add(Job(kind=kind, key=key, payload=payload))
+        else:
+            session.info.setdefault("jobs", []).append((kind, key, payload))
+
+    async def commit(self, session: AsyncSession):
+        await session.commit()
+        jobs = session.info.pop("jobs", [])
+        for kind, items in self._merge([job for job in jobs if self.kinds[job[0]].inline]).items():
+            try:
+                await self.kinds[kind].handler(session, items)
+            except Exception:
+                logger.exception("Задача %s не выполнена после коммита, повтор в фоне", kind)
+                for key, payload in items.items():
+                    await self._put(kind, key, payload)
+        for kind, key, payload in jobs:
+            if not self.kinds[kind].inline:
+                await self._put(kind, key, payload)
+        self._has_work.set()
+
+    async def _put(self, kind: str, key: int, payload: Any):
+        pending_key = (kind, key)
+        while pending_key not in self._pending and len(self._pending) >= self.max_pending:
+            if self._task is None:
+                await self.run_once()  # воркер не запущен (скрипт, тест) — разгребаем сами
+                continue
+            self._has_space.clear()
+            await self._has_space.wait()
+
+        if pending_key in self._pending:
+            self._pending[pending_key] = self.kinds[kind].merge(self._pending[pending_key], payload)
+        else:
+            self._pending[pending_key] = payload
+
+    # ------------------- Выполнение -------------------
+
+    def _merge(self, jobs) -> dict[str, dict[int, Any]]:
+        grouped: dict[str, dict[int, Any]] = {}
+        for kind, key, payload in jobs:
+            if kind not in self.kinds:
+                logger.error("Неизвестный вид задачи %r, задача отброшена", kind)
+                continue
+            items = grouped.setdefault(kind, {})
+            items[key] = self.kinds[kind].merge(items[key], payload) if key in items else payload
+        return grouped
+
+    def _requeue(self, kind: str, items: dict[int, Any]):
+        # при повторе задачи схлопнутся с новыми задачами тех же ключей
+        merge = self.kinds[kind].merge
+        for key, payload in items.items():
+            pending_key = (kind, key)
+            if pending_key in self._pending:
+                self._pending[pending_key] = merge(payload, self._pending[pending_key])
+            else:
+                self._pending[pending_key] = payload
+
+    async def _run_memory_batch(self) -> int:
+        jobs = []
+        while self._pending and len(jobs) < self.batch_size:
+            (kind, key), payload = self._pending.popitem(last=False)
+            jobs.append((kind, key, payload))
+        if not jobs:
+            return 0
+        self._has_space.set()
+
+        # каждый вид в своей транзакции: ошибка рейтинга не задерживает сброс кэша
+        error = None
+        for kind, items in self._merge(jobs).items():
+            try:
+                async with new_async_session() as session:
+                    await self.kinds[kind].handler(session, items)
+                    await session.commit()
+            except Exception as exc:
+                self._requeue(kind, items)
+                error = error or exc
+        if error is not None:
+            raise error
+        return len(jobs)
+
+    async def _run_durable_batch(self) -> int:
+        async with new_async_session() as session:
+            claimed = (
+                select(Job.id).order_by(Job.id).limit(self.batch_size).with_for_update(skip_locked=True)
+            )
+            jobs = (await session.execute(
+                delete(Job).where(Job.id.in_(claimed)).returning(Job.kind, Job.key, Job.payload)
+            )).all()
+            if not jobs:
+                return 0
+
+            for kind, items in self._merge(jobs).items():
+                await self.kinds[kind].handler(session, items)
+            await session.commit()
+        return len(jobs)
+
+    async def run_once(self) -> int:
+        """Одна пачка из памяти и одна из таблицы; возвращает, сколько задач выполнено"""
+        done = await self._run_memory_batch()
+        if self.durable and not self._stopping:
+            done += await self._run_durable_batch()
+        return done
+
+    async def _run(self):
+        while True:
+            self._has_work.clear()
+            try:
+                done = await self.run_once()
+            except Exception:
+                logger.exception("Фоновые задачи не выполнены, повтор через %s с", self.poll_interval)
+                if self._stopping:
+                    return
+                done = 0
+
+            if self._stopping and not self._pending:
+                return
+            if not done:
+                # в режиме Postgres задачи других процессов видны только опросом таблицы
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self._has_work.wait(), self.poll_interval)
+
+    # ------------------- Запуск и остановка -------------------
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Доделать задачи из памяти (не дольше drain_timeout); строки jobs останутся другим процессам"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._has_work.set()
+        try:
+            await asyncio.wait_for(self._task, self.drain_timeout)
+        except TimeoutError:
+            logger.error("Остановка без завершения: потеряно задач из памяти — %s", len(self._pending))
+        self._task = None
+
+
+@event.listens_for(PrimarySession, "after_rollback")
+def _drop_jobs(session):
+    session.info.pop("jobs", None)
+
+
+job_queue = JobQueue(settings.JOBS_DURABLE, settings.JOBS_MAX_PENDING, settings.JOBS_BATCH_SIZE,
+                     settings.JOBS_POLL_INTERVAL_SECONDS, settings.JOBS_DRAIN_TIMEOUT_SECONDS)
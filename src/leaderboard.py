@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+import logging
+import time
+from sqlalchemy import Select, select, table, column, and_, text, Integer, Float, String
+from src.config import settings
+from src.database import async_engine
+from src.models import Movie, ShelfEntry
+from src.pagination import paginate
+
+
+logger = logging.getLogger("movieshelf.leaderboard")
+
+
+# ------------------- Лучшие фильмы -------------------
+#
+# GET /movies/top читает материализованное представление movie_leaderboard
+# (миграция 0009): байесовская оценка каждого фильма с отзывами посчитана
+# заранее, а индексы (score, movie_id) и (genre_key, score, movie_id) отдают
+# верх списка без сортировки всего каталога.
+#
+# Представление обновляется REFRESH ... CONCURRENTLY — чтение при этом не
+# блокируется. Обновляет LeaderboardRefresher: раз в
+# LEADERBOARD_REFRESH_INTERVAL_SECONDS или раньше, если процесс записал
+# LEADERBOARD_REFRESH_AFTER_WRITES изменений отзывов. Счётчик и таймер у каждого
+# воркера свои; одновременно обновляет только один (advisory-блокировка),
+# остальные пропускают свой раз.
+
+leaderboard = table(
+    "movie_leaderboard",
+    column("movie_id", Integer),
+    column("genre_key", String),
+    column("review_count", Integer),
+    column("avg_score", Float),
+    column("score", Float),
+)
+
+REFRESH_LOCK_KEY = 0x4D4C42  # pg_try_advisory_xact_lock: один REFRESH на все воркеры
+
+
+def build_top_query(columns: tuple, user_id: int, genre: str | None, min_reviews: int,
+                    cursor: str | None, limit: int) -> Select:
+    """Фильмы по убыванию score, keyset-пагинация по (score, movie_id); полка — слева, как в поиске"""
+    shelf = and_(ShelfEntry.movie_id == Movie.id, ShelfEntry.user_id == user_id)
+    query = (
+        select(*columns, leaderboard.c.score)
+        .select_from(leaderboard)
+        .join(Movie, Movie.id == leaderboard.c.movie_id)
+        .join(ShelfEntry, shelf, isouter=True)
+        .where(Movie.deleted_at.is_(None))  # в представлении — до очистки и следующего обновления
+    )
+    if genre:
+        query = query.where(leaderboard.c.genre_key == genre.lower())
+    if min_reviews > 1:
+        query = query.where(leaderboard.c.review_count >= min_reviews)
+
+    return paginate(query, leaderboard.c.movie_id, leaderboard.c.score, "score", True, cursor, limit)
+
+
+# ------------------- Обновление представления -------------------
+
+class LeaderboardRefresher:
+
+    def __init__(self, interval: float, after_writes: int):
+        self.interval = interval
+        self.after_writes = after_writes
+        self._writes = 0
+        self._due = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def note_writes(self, count: int):
+        """Учесть изменения отзывов; после after_writes представление обновится раньше таймера"""
+        self._writes += count
+        if self._writes >= self.after_writes:
+            self._due.set()
+
+    async def refresh(self) -> bool:
+        """REFRESH CONCURRENTLY; False — представление сейчас обновляет другой воркер"""
+        self._writes = 0
+        started = time.perf_counter()
+        async with async_engine.connect() as conn:
+            locked = (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"),
+                                         {"key": REFRESH_LOCK_KEY})).scalar_one()
+            if not locked:
+                return False
+            await conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY movie_leaderboard"))
+            await conn.commit()
+        logger.info("movie_leaderboard обновлено за %.0f мс", (time.perf_counter() - started) * 1000)
+        return True
+
+    async def _run(self):
+        while True:
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._due.wait(), self.interval)
+            self._due.clear()
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("movie_leaderboard не обновлено, повтор через %s с", self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+
+leaderboard_refresher = LeaderboardRefresher(settings.LEADERBOARD_REFRESH_INTERVAL_SECONDS,
+                                             settings.LEADERBOARD_REFRESH_AFTER_WRITES)
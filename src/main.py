@@ -1,11 +1,70 @@
+from src.server import startup  # первым: отсчёт времени импорта приложения
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy import select
+from src.config import settings
+from src.database import async_engine, replica_set, warm_up_pool, ping, dispose_engines
+from src.models import User, Movie
 from src.routers.auth_router import router as auth_router
 from src.routers.movies_router import router as movies_router
 from src.routers.reviews_router import router as reviews_router
+from src.routers.health_router import router as health_router, metrics_router
+from src.request_metrics import RequestMetricsMiddleware
+from src.jobs import job_queue
+from src.tmdb import tmdb_client
+from src.password_hashing import password_hasher
+from src.leaderboard import leaderboard_refresher
+from src.movie_purge import movie_purger
 
 
-app = FastAPI()
+# Запросы горячих путей для прогрева пула: SQL совпадает с ручками,
+# поэтому asyncpg находит их в кэше подготовленных выражений соединения
+WARM_UP_QUERIES = (
+    lambda session: session.get(User, 0),                                    # пользователь токена
+    lambda session: session.execute(select(User).where(User.email == "")),   # логин
+    lambda session: session.execute(                                         # новый отзыв
+        select(Movie).where(Movie.id == 0, Movie.deleted_at.is_(None))),
+    lambda session: session.execute(                                         # страница отзывов
+        select(Movie.id).where(Movie.id == 0, Movie.deleted_at.is_(None))),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmed = await warm_up_pool(async_engine, settings.DB_WARMUP_CONNECTIONS, WARM_UP_QUERIES)
+    # прогрев глотает ошибки базы (и при DB_WARMUP_CONNECTIONS=0 ничего не открывает):
+    # без ответа primary воркер не готов, балансировщик не шлёт ему запросы
+    database_ready = warmed > 0 or await ping(async_engine)
+    for engine in replica_set.engines:
+        warmed += await warm_up_pool(engine, settings.DB_WARMUP_CONNECTIONS, WARM_UP_QUERIES)
+    startup.mark("warmup")
+
+    job_queue.start()
+    leaderboard_refresher.start()
+    movie_purger.start()
+    startup.finish(ready=database_ready, warmed_connections=warmed)
+
+    yield
+
+    startup.stopping = True
+    startup.ready = False  # /health/ready отвечает 503, балансировщик снимает воркер
+    await leaderboard_refresher.stop()
+    await movie_purger.stop()
+    await job_queue.stop()  # доделать задачи из памяти до закрытия соединений
+    await tmdb_client.aclose()
+    password_hasher.shutdown()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan,
+              default_response_class=ORJSONResponse if settings.FAST_JSON_RESPONSES else JSONResponse)
 app.include_router(auth_router)
 app.include_router(movies_router)
 app.include_router(reviews_router)
+app.include_router(health_router)
+app.include_router(metrics_router)
+
+app.add_middleware(RequestMetricsMiddleware)
 
+startup.mark("import")
@@ -1,6 +1,8 @@
 import datetime
 from typing import Annotated, Optional
-from sqlalchemy import String, text, Integer, CheckConstraint, ForeignKey, Float
+from sqlalchemy import (String, Text, text, func, literal_column, Integer, BigInteger, CheckConstraint,
+                        ForeignKey, Float, Index, Computed)
+from sqlalchemy.dialects.postgresql import TSVECTOR, JSONB
 from src.database import Base
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -8,6 +10,22 @@ from sqlalchemy.orm import Mapped, mapped_column, relationship
 intpk = Annotated[int, mapped_column(primary_key=True)]
 created_at = Annotated[datetime.datetime, mapped_column(server_default=text("TIMEZONE('utc', now())"))]
 
+# конфигурация 'simple': без стемминга, одинаково работает для русских и английских названий
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(genre, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'C')"
+)
+
+
+def canonical_key_of(title, genre):
+    """Ключ дедупликации каталога: название и жанр без регистра и лишних пробелов.
+    Им же вычисляется колонка movies.canonical_key, поэтому ключ для любых
+    (title, genre) — например, из VALUES при импорте — совпадёт с сохранённым"""
+    return (func.lower(func.regexp_replace(func.btrim(title), "[[:space:]]+", " ", "g"))
+            + "|" + func.lower(func.coalesce(func.btrim(genre), "")))
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -16,39 +34,106 @@ class User(Base):
     password_hash: Mapped[str] = mapped_column(String(250), nullable=False)
     created_at: Mapped[created_at]
 
-    # связь "один ко многим"
-    movies: Mapped[list["Movie"]] = relationship(back_populates="owner")
 
+# Каталог: один фильм на название и жанр, общий для всех пользователей. Отзывы
+# и их агрегаты привязаны к нему, а у пользователя — только строка полки
+# ShelfEntry с личной оценкой. Популярный фильм — одна строка movies и сколько
+# угодно узких строк shelf_entries, а не сто тысяч копий с разбросанными отзывами.
 
 class Movie(Base):
     __tablename__ = "movies"
-    __table_args__ = (CheckConstraint("rating >= 0.0 AND rating <= 5.0", name="rating_range"),)
+    __table_args__ = (
+        CheckConstraint("rating >= 0.0 AND rating <= 5.0", name="rating_range"),
+        # rating не индексируем: он меняется на каждый отзыв, индекс отключил бы HOT-обновления
+        # уникальны только живые фильмы: удалённый, но ещё не очищенный не мешает добавить тот же снова.
+        # По названию и жанру дедуплицируются только свои фильмы, фильмы TMDB — по tmdb_id
+        Index("uq_movies_canonical_key", "canonical_key", unique=True,
+              postgresql_where=text("deleted_at IS NULL AND tmdb_id IS NULL")),
+        Index("uq_movies_tmdb_id", "tmdb_id", unique=True, postgresql_where=text("deleted_at IS NULL")),
+        # очередь очистки: в индексе только удалённые фильмы
+        Index("ix_movies_deleted_at", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+        # поиск: полнотекстовый по search_vector и нечёткий (pg_trgm) по названию
+        Index("ix_movies_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_movies_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(100), nullable=False)
     genre: Mapped[str] = mapped_column(String(100))
     description: Mapped[Optional[str]]
-    rating: Mapped[float] = mapped_column(Float, server_default="0.0")  # средний рейтинг
+    rating: Mapped[float] = mapped_column(Float, server_default="0.0")  # средняя оценка по отзывам
+    tmdb_id: Mapped[Optional[int]]  # у фильмов, импортированных из TMDB
+    deleted_at: Mapped[Optional[datetime.datetime]]  # удалён из каталога, ждёт очистки (см. src/movie_purge.py)
+
+    # Агрегаты отзывов — сдвигаются на дельту каждого отзыва (см. src/ratings.py)
+    review_count: Mapped[int] = mapped_column(Integer, server_default="0", nullable=False)
+    score_sum: Mapped[float] = mapped_column(Float, server_default="0.0", nullable=False)
+    created_at: Mapped[created_at]
+
+    # Вычисляется самой базой; deferred — чтобы обычные SELECT не тянули tsvector
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(SEARCH_VECTOR_SQL, persisted=True),
+        deferred=True
+    )
+    canonical_key: Mapped[str] = mapped_column(
+        Text,
+        Computed(canonical_key_of(literal_column("title"), literal_column("genre")), persisted=True),
+        deferred=True
+    )
 
-    #Внешний ключ
-    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    owner: Mapped["User"] = relationship(back_populates="movies")
+    # lazy="raise": под async неявная подгрузка невозможна, отзывы грузятся только явно.
+    # Фильмы удаляются не через ORM, а пачками SQL (см. src/movie_purge.py)
     reviews: Mapped[list["Review"]] = relationship(
         back_populates="movie",
         cascade="all, delete-orphan",
-        passive_deletes=True
+        passive_deletes=True,
+        lazy="raise"
     )
 
 
 class Review(Base):
     __tablename__ = "reviews"
+    __table_args__ = (
+        Index("ix_reviews_movie_id_id", "movie_id", "id"),  # отзывы фильма + keyset
+        Index("ix_reviews_user_id_id", "user_id", "id"),    # отзывы пользователя
+    )
 
     id: Mapped[intpk]
     text: Mapped[Optional[str]]
     score: Mapped[float] = mapped_column(Float, nullable=False)
     movie_id: Mapped[int] = mapped_column(ForeignKey("movies.id", ondelete="CASCADE"), nullable=False) # внешний ключ к фильму
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))   # внешний ключ к пользователю
+    created_at: Mapped[created_at]
 
     movie: Mapped["Movie"] = relationship(back_populates="reviews")
     user: Mapped["User"] = relationship()
 
+
+class ShelfEntry(Base):
+    """Фильм на полке пользователя"""
+    __tablename__ = "shelf_entries"
+    __table_args__ = (
+        CheckConstraint("rating >= 0.0 AND rating <= 5.0", name="shelf_rating_range"),
+        # /movies/my: первичный ключ (user_id, movie_id) — keyset по id, эти два — по дате и оценке
+        Index("ix_shelf_entries_user_id_created_at_movie_id", "user_id", "created_at", "movie_id"),
+        # личная оценка может быть NULL: сортировка и индекс — по coalesce(rating, -1.0)
+        Index("ix_shelf_entries_user_id_rating_movie_id", "user_id", text("coalesce(rating, -1.0)"), "movie_id"),
+        Index("ix_shelf_entries_movie_id", "movie_id"),
+    )
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    movie_id: Mapped[int] = mapped_column(ForeignKey("movies.id", ondelete="CASCADE"), primary_key=True)
+    rating: Mapped[Optional[float]] = mapped_column(Float)  # личная оценка
+    created_at: Mapped[created_at]  # когда фильм добавлен на полку
+
+
+class Job(Base):
+    """Фоновая задача в режиме JOBS_DURABLE (см. src/jobs.py)"""
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)
+    key: Mapped[int] = mapped_column(BigInteger, nullable=False)   # id сущности, по нему задачи схлопываются
+    payload: Mapped[Optional[dict]] = mapped_column(JSONB)
+    created_at: Mapped[created_at]
@@ -0,0 +1,151 @@
+import asyncio
+import contextlib
+import logging
+from sqlalchemy import select, delete, update, literal, or_, and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from src.config import settings
+from src.database import new_async_session
+from src.jobs import job_queue
+from src.models import Movie, Review, ShelfEntry
+from src.user_stats import invalidate_user_stats
+
+
+logger = logging.getLogger("movieshelf.movie_purge")
+
+
+# ------------------- Очистка удалённых фильмов -------------------
+#
+# Фильм, снятый с последней полки, помечается deleted_at (src/catalogue.py) и
+# сразу пропадает из всех чтений. Ручка удаления при этом не трогает отзывы:
+# у популярного фильма их сотни тысяч, и каскад одним DELETE держал бы запрос
+# и блокировки столько, сколько удаляются все строки.
+#
+# Отзывы удаляет MoviePurger: пачками по PURGE_BATCH_SIZE, каждая пачка — своя
+# короткая транзакция, между пачками пауза PURGE_PAUSE_SECONDS. Когда отзывов
+# не осталось, удаляется сама строка movies. Воркеры берут фильм FOR UPDATE
+# SKIP LOCKED — каждый чистит свой, никто никого не ждёт.
+#
+# Фильм, который успели добавить на полку, пока его удаляли, не чистится, а
+# возвращается в каталог (см. _restore): под блокировкой строки новые строки
+# полок появиться не могут, и ON DELETE CASCADE ничью полку не заденет.
+#
+# Статистика авторов отзывов (GET /movies/my/stats) догоняет очистку: её кэш
+# сбрасывается для тех, чьи отзывы удалены пачкой.
+
+
+class MoviePurger:
+
+    def __init__(self, batch_size: int, interval: float, pause: float):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+        self._due = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def note_deleted(self):
+        """Фильмы удалены из каталога — начать очистку, не дожидаясь таймера"""
+        self._due.set()
+
+    async def purge_batch(self) -> int:
+        """Одна пачка очистки одного фильма; 0 — удалённых фильмов нет или их уже чистят другие"""
+        async with new_async_session() as session:
+            movie_id = (await session.execute(
+                select(Movie.id)
+                .where(Movie.deleted_at.is_not(None))
+                .order_by(Movie.deleted_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )).scalar_one_or_none()
+            if movie_id is None:
+                return 0
+
+            owners = list((await session.scalars(
+                select(ShelfEntry.user_id).where(ShelfEntry.movie_id == movie_id)
+            )).all())
+            if owners:
+                restored = await self._restore(session, movie_id)
+                for user_id in owners:
+                    invalidate_user_stats(user_id, session)
+                if restored:
+                    await job_queue.commit(session)
+                    logger.info("Фильм %s снова на полке, возвращён в каталог", movie_id)
+                    return 1
+
+            batch = select(Review.id).where(Review.movie_id == movie_id).limit(self.batch_size)
+            authors = list((await session.scalars(
+                delete(Review).where(Review.id.in_(batch.scalar_subquery())).returning(Review.user_id)
+            )).all())
+
+            if len(authors) < self.batch_size:
+                await session.execute(delete(Movie).where(Movie.id == movie_id))
+                logger.info("Фильм %s удалён из каталога", movie_id)
+
+            for user_id in set(authors):
+                invalidate_user_stats(user_id, session)
+            await job_queue.commit(session)
+            return len(authors) + 1
+
+    @staticmethod
+    async def _restore(session: AsyncSession, movie_id: int) -> bool:
+        """Возвращает фильм в каталог; False — тот же фильм уже добавлен новой строкой
+        (уникальные индексы по живым фильмам), тогда полки переезжают на неё, а старая
+        строка чистится дальше как обычно"""
+        try:
+            async with session.begin_nested():
+                await session.execute(update(Movie).where(Movie.id == movie_id).values(deleted_at=None))
+            return True
+        except IntegrityError:
+            pass
+
+        old = aliased(Movie)
+        live_id = (await session.execute(
+            select(Movie.id)
+            .join(old, or_(and_(Movie.canonical_key == old.canonical_key,
+                                Movie.tmdb_id.is_(None), old.tmdb_id.is_(None)),
+                           Movie.tmdb_id == old.tmdb_id))
+            .where(old.id == movie_id, Movie.deleted_at.is_(None))
+            .limit(1)
+        )).scalar_one()
+        await session.execute(
+            insert(ShelfEntry).from_select(
+                ["user_id", "movie_id", "rating", "created_at"],
+                select(ShelfEntry.user_id, literal(live_id), ShelfEntry.rating, ShelfEntry.created_at)
+                .where(ShelfEntry.movie_id == movie_id)
+            ).on_conflict_do_nothing(index_elements=[ShelfEntry.user_id, ShelfEntry.movie_id])
+        )
+        await session.execute(delete(ShelfEntry).where(ShelfEntry.movie_id == movie_id))
+        return False
+
+    async def _run(self):
+        while True:
+            try:
+                purged = await self.purge_batch()
+            except Exception:
+                logger.exception("Очистка удалённых фильмов не удалась, повтор через %s с", self.interval)
+                purged = 0
+
+            if purged:
+                await asyncio.sleep(self.pause)
+                continue
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._due.wait(), self.interval)
+            self._due.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+
+movie_purger = MoviePurger(settings.PURGE_BATCH_SIZE, settings.PURGE_INTERVAL_SECONDS,
+                           settings.PURGE_PAUSE_SECONDS)
@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+# ------------------- Потоковая выгрузка в NDJSON -------------------
+
+STREAM_BATCH_SIZE = 1000
+
+
+async def stream_ndjson(query: Select, schema: type[BaseModel], session_maker: async_sessionmaker):
+    """Отдаёт результат запроса построчно (одна JSON-строка на запись) через серверный курсор.
+
+    Сессия открывается внутри генератора: она живёт ровно столько, сколько идёт
+    отправка ответа, а в памяти одновременно находится не больше одной пачки строк.
+    """
+    async with session_maker() as session:
+        result = await session.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+        async for rows in result.mappings().partitions(STREAM_BATCH_SIZE):
+            yield "".join(schema.model_validate(dict(row)).model_dump_json() + "\n" for row in rows)
@@ -0,0 +1,85 @@
+import base64
+import datetime
+import json
+from typing import Literal
+from fastapi import HTTPException
+from sqlalchemy import Select, tuple_
+
+
+# ------------------- Keyset-пагинация -------------------
+#
+# Страница выбирается условием "(sort_col, id) > последняя строка прошлой страницы",
+# поэтому стоимость запроса не зависит от номера страницы (в отличие от OFFSET).
+# Курсор непрозрачен для клиента: base64 от JSON [sort, desc, value, id].
+
+SortField = Literal["id", "rating", "created_at"]
+
+
+def encode_cursor(sort: str, desc: bool, value, last_id: int) -> str:
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, desc, value, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value) -> bool:
+    return _is_int(value) or isinstance(value, float)
+
+
+def decode_cursor(cursor: str, sort: str, desc: bool) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, cursor_desc, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        # значения уходят в SQL параметрами: чужой тип дал бы 500 из драйвера, а не 400
+        if not _is_int(last_id):
+            raise ValueError("id курсора")
+        if sort == "created_at":
+            value = datetime.datetime.fromisoformat(value)
+        elif sort == "id":
+            if not _is_int(value):
+                raise ValueError("id курсора")
+        elif not _is_number(value):  # rating, score, relevance
+            raise ValueError("значение курсора")
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+    if cursor_sort != sort or cursor_desc != desc:
+        raise HTTPException(status_code=400, detail="Курсор получен с другой сортировкой")
+
+    return value, last_id
+
+
+def paginate(query: Select, id_col, sort_col, sort: str, desc: bool,
+             cursor: str | None, limit: int) -> Select:
+    """Добавляет к запросу сортировку, условие курсора и LIMIT (+1 строка для проверки следующей страницы)"""
+    if sort == "id":
+        keys = [id_col]
+    else:
+        keys = [sort_col, id_col]
+
+    if cursor is not None:
+        value, last_id = decode_cursor(cursor, sort, desc)
+        left = id_col if sort == "id" else tuple_(sort_col, id_col)
+        right = last_id if sort == "id" else tuple_(value, last_id)
+        query = query.where(left < right if desc else left > right)
+
+    order = [key.desc() if desc else key.asc() for key in keys]
+    return query.order_by(*order).limit(limit + 1)
+
+
+def next_cursor(rows: list, sort: str, desc: bool, limit: int, sort_attr: str,
+                null_value=None) -> str | None:
+    """Отрезает лишнюю строку и возвращает курсор следующей страницы (или None).
+    null_value — чем сортировка заменяет NULL (coalesce): в курсор идёт то же значение,
+    иначе условие (NULL, id) < (...) не совпадёт ни с одной строкой"""
+    if len(rows) <= limit:
+        return None
+
+    del rows[limit:]
+    last = rows[-1]
+    value = getattr(last, sort_attr)
+    return encode_cursor(sort, desc, null_value if value is None else value, last.id)
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from passlib.hash import bcrypt
+from src.config import settings
+from src.request_metrics import span
+
+
+# ------------------- Хеширование паролей вне event loop -------------------
+#
+# bcrypt занимает сотни миллисекунд CPU и отпускает GIL, поэтому его выполняют
+# в отдельном пуле потоков ограниченного размера. Если в очереди уже слишком
+# много запросов, новый сразу получает 503 — так всплеск логинов не копится
+# бесконечной очередью и не держит остальные запросы.
+
+class PasswordHasher:
+
+    def __init__(self, workers: int, max_pending: int, rounds: int):
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._bcrypt = bcrypt.using(rounds=rounds)
+
+    async def _run(self, span_name: str, func, *args):
+        if self._pending >= self.max_pending:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Сервер перегружен, повторите попытку позже",
+                                headers={"Retry-After": "1"})
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # вместе с ожиданием свободного потока — столько bcrypt стоит запросу
+            with span(span_name):
+                return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        # формат bcrypt: $2b$<cost>$<salt+hash>
+        try:
+            return int(password_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _verify_and_rehash(self, password: str, password_hash: str) -> tuple[bool, str | None]:
+        if not self._bcrypt.verify(password, password_hash):
+            return False, None
+
+        if self.needs_rehash(password_hash):
+            return True, self._bcrypt.hash(password)
+
+        return True, None
+
+    async def hash(self, password: str) -> str:
+        return await self._run("bcrypt_hash", self._bcrypt.hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> tuple[bool, str | None]:
+        """Проверяет пароль; вторым элементом — новый хеш, если сменилась стоимость bcrypt"""
+        return await self._run("bcrypt_verify", self._verify_and_rehash, password, password_hash)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(settings.BCRYPT_WORKERS, settings.BCRYPT_MAX_PENDING, settings.BCRYPT_ROUNDS)
@@ -0,0 +1,171 @@
+import logging
+import math
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Protocol
+from fastapi import Depends, HTTPException, Request, Response, status
+from src.config import settings
+
+
+logger = logging.getLogger("movieshelf.rate_limit")
+
+
+# ------------------- Ограничение частоты запросов -------------------
+#
+# Ведро токенов на ключ (IP или пользователь) и политику ручки: ведро вмещает
+# burst токенов и пополняется со скоростью per_minute в минуту, каждый запрос
+# забирает токен. Пустое ведро — 429 с Retry-After, иначе запрос проходит,
+# а в ответ добавляются заголовки RateLimit-* (draft-ietf-httpapi-ratelimit-headers).
+#
+# Логин и регистрация ограничиваются по IP: пользователя ещё нет, а bcrypt
+# дорог. Запись — по пользователю, чтобы клиенты за одним NAT не делили лимит.
+# IP берётся из request.client: за балансировщиком uvicorn должен быть запущен
+# с --proxy-headers и --forwarded-allow-ips, иначе все клиенты — это один IP прокси.
+#
+# По умолчанию вёдра живут в памяти процесса — у каждого воркера свои, и
+# реальный лимит в N раз выше. Для нескольких воркеров подключается общее
+# хранилище (например, Redis со скриптом на Lua) через use_backend().
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    name: str
+    per_minute: float  # скорость пополнения
+    burst: int         # ёмкость ведра: столько запросов можно сделать подряд
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60
+
+    @property
+    def window(self) -> int:
+        """За сколько секунд пустое ведро наполняется целиком"""
+        return math.ceil(self.burst / self.rate)
+
+
+@dataclass
+class RateLimitState:
+    allowed: bool
+    remaining: int        # сколько запросов ещё можно сделать сразу
+    retry_after: float    # через сколько секунд появится токен (0, если запрос прошёл)
+    reset_after: float    # через сколько секунд ведро снова будет полным
+
+
+class RateLimitBackend(Protocol):
+    """Хранилище вёдер. Списание должно быть атомарным: два воркера не могут
+    забрать один и тот же последний токен."""
+
+    async def take(self, key: str, rate: float, burst: int, cost: int = 1) -> RateLimitState: ...
+
+
+def _refill(tokens: float, elapsed: float, rate: float, burst: int, cost: int) -> tuple[float, RateLimitState]:
+    tokens = min(float(burst), tokens + elapsed * rate)
+    allowed = tokens >= cost
+    if allowed:
+        tokens -= cost
+    return tokens, RateLimitState(
+        allowed=allowed,
+        remaining=int(tokens),
+        retry_after=0.0 if allowed else (cost - tokens) / rate,
+        reset_after=(burst - tokens) / rate,
+    )
+
+
+class _Shard:
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.lock = Lock()
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # ключ -> (токены, время)
+
+
+class InMemoryRateLimitBackend:
+    """Вёдра в памяти процесса. Ключи разложены по шардам со своими блокировками,
+    чтобы обращения к разным ключам из потоков не ждали друг друга."""
+
+    def __init__(self, max_keys: int, shards: int):
+        self._shards = [_Shard(max(1, max_keys // shards)) for _ in range(shards)]
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+
+    async def take(self, key: str, rate: float, burst: int, cost: int = 1) -> RateLimitState:
+        shard = self._shard(key)
+        now = time.monotonic()
+
+        with shard.lock:
+            tokens, updated = shard.buckets.get(key, (float(burst), now))
+            tokens, state = _refill(tokens, now - updated, rate, burst, cost)
+            shard.buckets[key] = (tokens, now)
+            shard.buckets.move_to_end(key)
+
+            # вытесняется давно не обращавшийся ключ — его ведро и так почти наверняка полное
+            while len(shard.buckets) > shard.max_keys:
+                shard.buckets.popitem(last=False)
+
+        return state
+
+
+class RateLimiter:
+
+    def __init__(self, backend: RateLimitBackend, enabled: bool):
+        self.backend = backend
+        self.enabled = enabled
+
+    async def hit(self, policy: RateLimitPolicy, identity: str, response: Response):
+        """Списать токен; при пустом ведре — 429, иначе заголовки RateLimit-* в ответ"""
+        if not self.enabled:
+            return
+
+        try:
+            state = await self.backend.take(f"{policy.name}:{identity}", policy.rate, policy.burst)
+        except Exception:
+            # общее хранилище недоступно — лучше пропустить запрос, чем уронить ручку
+            logger.exception("Хранилище лимитов недоступно, запрос пропущен без проверки")
+            return
+
+        headers = {
+            "RateLimit-Limit": str(policy.burst),
+            "RateLimit-Remaining": str(state.remaining),
+            "RateLimit-Reset": str(math.ceil(state.reset_after)),
+            "RateLimit-Policy": f"{policy.burst};w={policy.window}",
+        }
+        if not state.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(state.retry_after)))
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail="Слишком много запросов, повторите позже",
+                                headers=headers)
+        response.headers.update(headers)
+
+
+rate_limiter = RateLimiter(InMemoryRateLimitBackend(settings.RATE_LIMIT_MAX_KEYS, settings.RATE_LIMIT_SHARDS),
+                           settings.RATE_LIMIT_ENABLED)
+
+
+def use_backend(backend: RateLimitBackend):
+    """Подключить общее хранилище вёдер (вызывать при старте приложения)"""
+    rate_limiter.backend = backend
+
+
+# ------------------- Политики ручек -------------------
+
+LOGIN_LIMIT = RateLimitPolicy("login", settings.RATE_LIMIT_LOGIN_PER_MINUTE, settings.RATE_LIMIT_LOGIN_BURST)
+REGISTER_LIMIT = RateLimitPolicy("register", settings.RATE_LIMIT_REGISTER_PER_MINUTE,
+                                 settings.RATE_LIMIT_REGISTER_BURST)
+WRITE_LIMIT = RateLimitPolicy("write", settings.RATE_LIMIT_WRITE_PER_MINUTE, settings.RATE_LIMIT_WRITE_BURST)
+BULK_LIMIT = RateLimitPolicy("bulk", settings.RATE_LIMIT_BULK_PER_MINUTE, settings.RATE_LIMIT_BULK_BURST)
+
+
+def limit_by_ip(policy: RateLimitPolicy):
+    """Зависимость для dependencies=[...] ручки: лимит на IP клиента"""
+
+    async def dependency(request: Request, response: Response):
+        client_ip = request.client.host if request.client else "unknown"
+        await rate_limiter.hit(policy, f"ip:{client_ip}", response)
+
+    return Depends(dependency)
+
+# Лимит на пользователя — limit_by_user() в src/routers/auth_router.py, рядом с CurrentUserDep
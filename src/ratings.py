@@ -0,0 +1,98 @@
+import logging
+from sqlalchemy import select, update, case, func, values, column, Integer, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import settings
+from src.jobs import job_queue
+from src.leaderboard import leaderboard_refresher
+from src.models import Movie
+
+
+logger = logging.getLogger("movieshelf.ratings")
+
+
+# ------------------- Агрегаты рейтинга фильма -------------------
+#
+# movies.review_count / score_sum / rating меняются только сдвигом на дельту,
+# таблица reviews при этом не читается.
+#
+# Немедленный режим (по умолчанию без JOBS_DURABLE): дельта применяется UPDATE'ом
+# в транзакции отзыва. Это атомарно, но строка фильма заблокирована до коммита, и все
+# отзывы к популярному фильму выстраиваются в очередь за этой блокировкой.
+#
+# Отложенный режим (по умолчанию с JOBS_DURABLE): транзакция отзыва только ставит
+# задачу RATING_JOB (см. src/jobs.py). Дельты одного фильма схлопываются в очереди,
+# и воркер применяет пачку одним UPDATE — сотня отзывов к одному фильму
+# становится одним обновлением его строки, а рейтинг догоняет отзывы с небольшой задержкой.
+# Только вместе с JOBS_DURABLE=true: задача пишется в jobs в транзакции отзыва, то есть
+# атомарно с ним. В очереди памяти дельты уже закоммиченных отзывов пропадали бы при
+# падении процесса, поэтому RATING_UPDATES_DEFERRED=true без неё не проходит проверку настроек.
+
+RATING_JOB = "movie_rating"
+
+
+def rating_values(count_delta, score_delta) -> dict:
+    new_count = Movie.review_count + count_delta
+    new_sum = Movie.score_sum + score_delta
+
+    return dict(
+        review_count=new_count,
+        # когда отзывов не осталось, сбрасываем сумму, чтобы не копить ошибку округления
+        score_sum=case((new_count > 0, new_sum), else_=0.0),
+        rating=case(
+            (new_count > 0, func.least(func.greatest(new_sum / new_count, 0.0), 5.0)),
+            else_=0.0
+        )
+    )
+
+
+async def apply_rating_deltas(deltas: dict[int, tuple[int, float]], session: AsyncSession):
+    """Сразу сдвигает агрегаты: {movie_id: (count_delta, score_delta)} — один UPDATE ... FROM (VALUES ...)"""
+    if not deltas:
+        return
+
+    delta_rows = values(
+        column("movie_id", Integer), column("count_delta", Integer), column("score_delta", Float),
+        name="deltas"
+    ).data([(movie_id, count, score) for movie_id, (count, score) in sorted(deltas.items())])
+
+    await session.execute(
+        update(Movie)
+        .where(Movie.id == delta_rows.c.movie_id)
+        .values(**rating_values(delta_rows.c.count_delta, delta_rows.c.score_delta))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def record_rating_deltas(deltas: dict[int, tuple[int, float]], session: AsyncSession):
+    """Учесть изменение отзывов в рейтинге — в транзакции самого отзыва"""
+    leaderboard_refresher.note_writes(sum(abs(count) or 1 for count, _ in deltas.values()))
+    if not settings.RATING_UPDATES_DEFERRED:
+        await apply_rating_deltas(deltas, session)
+        return
+
+    for movie_id, (count, score) in sorted(deltas.items()):
+        job_queue.enqueue(session, RATING_JOB, movie_id, {"count": count, "score": score})
+
+
+async def record_rating_delta(movie_id: int, count_delta: int, score_delta: float, session: AsyncSession):
+    await record_rating_deltas({movie_id: (count_delta, score_delta)}, session)
+
+
+# ------------------- Фоновое применение -------------------
+
+def _sum_deltas(old: dict, new: dict) -> dict:
+    return {"count": old["count"] + new["count"], "score": old["score"] + new["score"]}
+
+
+async def _apply_rating_job(session: AsyncSession, items: dict[int, dict]):
+    # строки фильмов блокируются в порядке id: воркеры разных процессов с пересекающимися
+    # пачками не ловят взаимоблокировку (UPDATE ... FROM обходит строки в любом порядке)
+    await session.execute(
+        select(Movie.id).where(Movie.id.in_(items)).order_by(Movie.id).with_for_update(key_share=True)
+    )
+    await apply_rating_deltas({movie_id: (delta["count"], delta["score"]) for movie_id, delta in items.items()},
+                              session)
+    logger.debug("Применены дельты рейтинга для %s фильмов", len(items))
+
+
+job_queue.register(RATING_JOB, _apply_rating_job, merge=_sum_deltas)
@@ -0,0 +1,67 @@
+import asyncio
+from sqlalchemy import select, update, delete, func, or_, exists, text
+from src.database import async_engine
+from src.models import Movie, Review, Job
+from src.ratings import RATING_JOB
+
+
+# Ремонт агрегатов рейтинга: пересобирает review_count/score_sum/rating из таблицы reviews
+# одним проходом GROUP BY и трогает только разошедшиеся строки.
+# Неприменённые задачи рейтинга из таблицы jobs (src/jobs.py) уже учтены в reviews,
+# поэтому они удаляются в той же транзакции, иначе воркер применил бы их второй раз.
+# Задачи в памяти работающих процессов отсюда не видны: при JOBS_DURABLE=false
+# запускать при остановленном приложении.
+# Запуск: python -m src.rebuild_ratings
+
+async def rebuild_ratings():
+    totals = (
+        select(
+            Review.movie_id,
+            func.count().label("cnt"),
+            func.sum(Review.score).label("total")
+        )
+        .group_by(Review.movie_id)
+        .subquery()
+    )
+
+    async with async_engine.begin() as conn:
+        print("Пересчитываем агрегаты рейтинга...")
+
+        # EXCLUSIVE ждёт транзакции, успевшие записать задачи, и не пускает новые до коммита:
+        # всё, что они добавили в reviews, видно следующим запросам этой транзакции
+        await conn.execute(text("LOCK TABLE jobs IN EXCLUSIVE MODE"))
+        dropped = await conn.execute(delete(Job).where(Job.kind == RATING_JOB))
+
+        # rating сверяется отдельно: он мог разойтись при верных count и sum
+        # (ручной UPDATE, NULL) — его пересчёт тоже ремонт
+        rating = func.least(func.greatest(totals.c.total / totals.c.cnt, 0.0), 5.0)
+        fixed = await conn.execute(
+            update(Movie)
+            .where(Movie.id == totals.c.movie_id)
+            .where(or_(
+                Movie.review_count != totals.c.cnt,
+                func.abs(Movie.score_sum - totals.c.total) > 1e-6,
+                Movie.rating.is_distinct_from(rating)
+            ))
+            .values(review_count=totals.c.cnt, score_sum=totals.c.total, rating=rating)
+        )
+
+        # Фильмы, у которых отзывов больше нет, но агрегат остался ненулевым
+        emptied = await conn.execute(
+            update(Movie)
+            .where(or_(
+                Movie.review_count != 0,
+                Movie.score_sum != 0.0,
+                Movie.rating.is_distinct_from(0.0)
+            ))
+            .where(~exists().where(Review.movie_id == Movie.id))
+            .values(review_count=0, score_sum=0.0, rating=0.0)
+        )
+
+        print(f"Отброшено задач рейтинга: {dropped.rowcount}")
+        print(f"Исправлено фильмов: {fixed.rowcount + emptied.rowcount}")
+
+    await async_engine.dispose()
+
+if __name__ == '__main__':
+    asyncio.run(rebuild_ratings())
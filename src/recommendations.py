@@ -0,0 +1,153 @@
+import json
+import logging
+import time
+from pathlib import Path
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import settings
+from src.models import Review, ShelfEntry
+
+
+logger = logging.getLogger("movieshelf.recommendations")
+
+
+# ------------------- Похожие фильмы и рекомендации -------------------
+#
+# Индекс строит отдельный процесс — python -m src.recommendations_build (по cron):
+# item-item косинусное сходство по оценкам отзывов, top-K соседей на фильм.
+# Каждая сборка — каталог RECOMMENDATIONS_DIR/<версия>/ с массивами .npy,
+# файл RECOMMENDATIONS_DIR/current указывает на действующую версию.
+#
+# Воркер открывает массивы через mmap: страницы общие для всех воркеров машины
+# (page cache), и ответ не читает ни reviews, ни movies — только детали
+# нескольких найденных фильмов по первичному ключу. Новую версию воркер
+# подхватывает сам, проверяя current не чаще раза в RECOMMENDATIONS_RELOAD_SECONDS.
+#
+# Массивы версии:
+#   movie_ids (M,)      — id фильмов по возрастанию, строка индекса = позиция id
+#   neighbors (M, K)    — id соседей по убыванию сходства, -1 — пусто
+#   scores    (M, K)    — сходство соседей (float32)
+#   norms, review_count, score_sum (M,) — для инкрементальной пересборки
+
+CURRENT_FILE = "current"
+ARRAYS = ("movie_ids", "neighbors", "scores", "norms", "review_count", "score_sum")
+
+
+def read_version(directory: Path) -> str | None:
+    try:
+        return (directory / CURRENT_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_arrays(directory: Path, version: str, mmap: bool = True) -> dict[str, np.ndarray]:
+    return {name: np.load(directory / version / f"{name}.npy", mmap_mode="r" if mmap else None)
+            for name in ARRAYS}
+
+
+def load_meta(directory: Path, version: str) -> dict:
+    return json.loads((directory / version / "meta.json").read_text())
+
+
+def index_positions(index_ids: np.ndarray, movie_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Позиции movie_ids в отсортированном index_ids и маска тех, что там есть"""
+    positions = np.searchsorted(index_ids, movie_ids)
+    positions[positions >= len(index_ids)] = 0
+    found = index_ids[positions] == movie_ids if len(index_ids) else np.zeros(len(movie_ids), dtype=bool)
+    return positions, found
+
+
+class RecommendationIndex:
+
+    def __init__(self, directory: str, reload_interval: float):
+        self.directory = Path(directory)
+        self.reload_interval = reload_interval
+        self.version: str | None = None
+        self._arrays: dict[str, np.ndarray] | None = None
+        self._checked_at: float | None = None
+
+    def _current(self) -> dict[str, np.ndarray] | None:
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.reload_interval:
+            self._checked_at = now
+            version = read_version(self.directory)
+            if version is not None and version != self.version:
+                try:
+                    self._arrays = load_arrays(self.directory, version)
+                    self.version = version
+                    logger.info("Загружен индекс рекомендаций %s: %s фильмов",
+                                version, len(self._arrays["movie_ids"]))
+                except (OSError, ValueError):
+                    logger.exception("Индекс рекомендаций %s не загружен, остаётся %s", version, self.version)
+        return self._arrays
+
+    @property
+    def ready(self) -> bool:
+        return self._current() is not None
+
+    def similar(self, movie_id: int, limit: int) -> list[tuple[int, float]]:
+        arrays = self._current()
+        if arrays is None:
+            return []
+        rows, found = index_positions(arrays["movie_ids"], np.array([movie_id], dtype=np.int64))
+        if not found[0]:
+            return []
+
+        neighbors = arrays["neighbors"][rows[0], :limit]
+        scores = arrays["scores"][rows[0], :limit]
+        keep = neighbors >= 0
+        return list(zip(neighbors[keep].tolist(), scores[keep].tolist()))
+
+    def recommend(self, seeds: dict[int, float], limit: int) -> list[tuple[int, float]]:
+        """seeds — {movie_id: вес} (понравилось > 0, не понравилось < 0). Оценка кандидата —
+        сумма вес * сходство по всем фильмам-затравкам; сами затравки не рекомендуются"""
+        arrays = self._current()
+        if arrays is None or not seeds:
+            return []
+
+        seed_ids = np.fromiter(seeds, dtype=np.int64, count=len(seeds))
+        weights = np.fromiter(seeds.values(), dtype=np.float32, count=len(seeds))
+        rows, found = index_positions(arrays["movie_ids"], seed_ids)
+        rows, weights = rows[found], weights[found]
+        if not len(rows):
+            return []
+
+        # (затравки × K) соседей одним обращением к mmap, дальше — сложение по кандидатам
+        neighbors = arrays["neighbors"][rows].ravel()
+        contributions = (arrays["scores"][rows] * weights[:, None]).ravel()
+        keep = (neighbors >= 0) & ~np.isin(neighbors, seed_ids)
+        candidates, inverse = np.unique(neighbors[keep], return_inverse=True)
+        totals = np.bincount(inverse, weights=contributions[keep], minlength=len(candidates))
+
+        positive = np.flatnonzero(totals > 0)
+        best = positive[np.argsort(-totals[positive], kind="stable")[:limit]]
+        return list(zip(candidates[best].tolist(), totals[best].tolist()))
+
+
+recommendation_index = RecommendationIndex(settings.RECOMMENDATIONS_DIR, settings.RECOMMENDATIONS_RELOAD_SECONDS)
+
+
+# ------------------- Вкус пользователя -------------------
+
+UNRATED_WEIGHT = 0.5  # фильм на полке без оценки — скорее понравился
+
+
+def taste_weight(score: float | None) -> float:
+    """Оценка 0..5 -> вес -1..1: ниже середины шкалы — «похожих не надо»"""
+    return UNRATED_WEIGHT if score is None else (score - 2.5) / 2.5
+
+
+async def load_seeds(session: AsyncSession, user_id: int) -> dict[int, float]:
+    """Фильмы полки и отзывов пользователя с весами — по индексам на user_id, без обхода таблиц"""
+    shelf = (await session.execute(
+        select(ShelfEntry.movie_id, ShelfEntry.rating).where(ShelfEntry.user_id == user_id)
+    )).all()
+    reviewed = (await session.execute(
+        select(Review.movie_id, func.avg(Review.score)).where(Review.user_id == user_id).group_by(Review.movie_id)
+    )).all()
+
+    seeds = {movie_id: taste_weight(rating) for movie_id, rating in shelf}
+    # оценка в отзыве важнее оценки на полке
+    seeds.update((movie_id, taste_weight(score)) for movie_id, score in reviewed)
+    return seeds
@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+import numpy as np
+from scipy import sparse
+from sqlalchemy import text
+from src.config import settings
+from src.database import async_engine
+from src.recommendations import ARRAYS, read_version, load_arrays, load_meta, index_positions
+
+
+# ------------------- Сборка индекса рекомендаций -------------------
+#
+#   python -m src.recommendations_build            # инкрементально, если есть прошлая версия
+#   python -m src.recommendations_build --full     # всё заново
+#
+# Матрица пользователь × фильм из средних оценок отзывов (scipy.sparse), оценки
+# центрируются по среднему пользователя (adjusted cosine: «выше своего обычного»).
+# Сходство столбцов считается пачками по RECOMMENDATIONS_BATCH_SIZE фильмов:
+# S = Xᵀ[пачка] · X — разреженное произведение, ненулевые только у фильмов
+# с общими зрителями. Сходство по n общим зрителям умножается на
+# n / (n + RECOMMENDATIONS_SHRINKAGE): пара с одним общим зрителем не становится
+# «идеально похожей». Остаются top-K соседей с положительным сходством.
+#
+# Инкрементальная сборка: изменившиеся фильмы находятся сравнением
+# movies.review_count / score_sum с прошлой версией. Читаются отзывы только
+# пользователей, оценивших эти фильмы; строки изменившихся фильмов считаются
+# заново, а их новое сходство вливается в списки остальных. Нормы прочих фильмов
+# и средние пользователей берутся прошлые — накопленную неточность убирает
+# периодическая --full сборка (и автоматически, если изменилось больше
+# RECOMMENDATIONS_FULL_REBUILD_SHARE фильмов).
+
+KEEP_VERSIONS = 2  # старые версии удаляются, последние — на случай отката
+FETCH_ROWS = 100_000
+
+USER_MOVIE_SCORES_SQL = """
+    SELECT user_id, movie_id, avg(score) AS score
+    FROM reviews
+    {where}
+    GROUP BY user_id, movie_id
+"""
+
+FINGERPRINTS_SQL = text("""
+    SELECT id, review_count, score_sum FROM movies WHERE review_count > 0 ORDER BY id
+""")
+
+
+async def fetch_scores(where: str = "", params: dict | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(user_id, movie_id, средняя оценка) — потоком с сервера, без списка строк в памяти"""
+    parts = []
+    async with async_engine.connect() as conn:
+        result = await conn.stream(text(USER_MOVIE_SCORES_SQL.format(where=where)), params or {})
+        async for rows in result.partitions(FETCH_ROWS):
+            parts.append(np.array(rows, dtype=np.float64))
+    data = np.concatenate(parts) if parts else np.empty((0, 3))
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+
+async def fetch_fingerprints() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    async with async_engine.connect() as conn:
+        rows = (await conn.execute(FINGERPRINTS_SQL)).all()
+    data = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int32), data[:, 2]
+
+
+# ------------------- Матрица и сходство -------------------
+
+def centered_matrix(users: np.ndarray, movies: np.ndarray, scores: np.ndarray,
+                    movie_ids: np.ndarray) -> tuple[sparse.csr_matrix, sparse.csr_matrix]:
+    """Центрированные оценки и матрица «оценил ли» (пользователи × movie_ids)"""
+    _, rows = np.unique(users, return_inverse=True)
+    cols = np.searchsorted(movie_ids, movies)
+    user_mean = np.bincount(rows, weights=scores) / np.bincount(rows)
+    shape = (rows.max() + 1 if len(rows) else 0, len(movie_ids))
+    centered = sparse.csr_matrix((scores - user_mean[rows], (rows, cols)), shape=shape, dtype=np.float32)
+    rated = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+    return centered, rated
+
+
+def column_norms(matrix: sparse.csr_matrix) -> np.ndarray:
+    return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()).astype(np.float32)
+
+
+def normalize(centered: sparse.csr_matrix, rated: sparse.csr_matrix,
+              norms: np.ndarray) -> tuple[sparse.csc_matrix, sparse.csc_matrix]:
+    """Столбцы единичной длины; CSC — пачка столбцов вырезается без копирования всей матрицы"""
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return (centered @ sparse.diags(inverse)).tocsc(), rated.tocsc()
+
+
+def similarity_rows(normalized: sparse.csc_matrix, rated: sparse.csc_matrix,
+                    columns: np.ndarray, shrinkage: float) -> sparse.csr_matrix:
+    """Сходство фильмов columns со всеми фильмами: строка на фильм из columns"""
+    dot = (normalized[:, columns].T @ normalized).tocsr()
+    common = (rated[:, columns].T @ rated).tocsr()
+    common.data = common.data / (common.data + shrinkage)
+    return dot.multiply(common).tocsr()
+
+
+def top_k(similarity: sparse.csr_matrix, own_ids: np.ndarray, movie_ids: np.ndarray,
+          k: int) -> tuple[np.ndarray, np.ndarray]:
+    """top-K положительных соседей каждой строки, без самого фильма"""
+    neighbors = np.full((similarity.shape[0], k), -1, dtype=np.int64)
+    scores = np.zeros((similarity.shape[0], k), dtype=np.float32)
+    for row in range(similarity.shape[0]):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        ids = movie_ids[similarity.indices[start:end]]
+        values = similarity.data[start:end]
+        keep = (values > 0) & (ids != own_ids[row])
+        ids, values = ids[keep], values[keep]
+        if len(values) > k:
+            part = np.argpartition(-values, k - 1)[:k]
+            ids, values = ids[part], values[part]
+        order = np.argsort(-values, kind="stable")
+        neighbors[row, :len(order)] = ids[order]
+        scores[row, :len(order)] = values[order]
+    return neighbors, scores
+
+
+# ------------------- Полная и инкрементальная сборка -------------------
+
+Fingerprints = tuple[np.ndarray, np.ndarray, np.ndarray]  # id фильмов с отзывами, review_count, score_sum
+
+
+def merge_candidates(neighbors: np.ndarray, similar: np.ndarray, candidates: sparse.csr_matrix,
+                     candidate_ids: np.ndarray, movie_ids: np.ndarray, skip: np.ndarray, k: int):
+    """Влить в списки фильмов новое сходство с candidate_ids (строка candidates — фильм movie_ids)"""
+    for row in np.flatnonzero(np.diff(candidates.indptr)):
+        if skip[row]:
+            continue
+        start, end = candidates.indptr[row], candidates.indptr[row + 1]
+        ids = candidate_ids[candidates.indices[start:end]]
+        values = candidates.data[start:end]
+        keep = (values > 0) & (ids != movie_ids[row])
+        ids = np.concatenate([neighbors[row], ids[keep]])
+        values = np.concatenate([similar[row], values[keep]])
+        valid = ids >= 0
+        ids, values = ids[valid], values[valid]
+        order = np.argsort(-values, kind="stable")[:k]
+        neighbors[row] = -1
+        similar[row] = 0
+        neighbors[row, :len(order)] = ids[order]
+        similar[row, :len(order)] = values[order]
+
+
+def diff_fingerprints(previous: dict[str, np.ndarray], fingerprints: Fingerprints) -> tuple[np.ndarray, np.ndarray]:
+    """Фильмы, чьи отзывы изменились с прошлой сборки (и новые), и фильмы, оставшиеся без отзывов"""
+    movie_ids, review_count, score_sum = fingerprints
+    positions, found = index_positions(previous["movie_ids"], movie_ids)
+    same = (found
+            & (previous["review_count"][positions] == review_count)
+            & np.isclose(previous["score_sum"][positions], score_sum))
+    return movie_ids[~same], np.setdiff1d(previous["movie_ids"], movie_ids)
+
+
+async def build_full(fingerprints: Fingerprints, k: int, shrinkage: float,
+                     batch_size: int) -> dict[str, np.ndarray]:
+    movie_ids, review_count, score_sum = fingerprints
+    users, movies, scores = await fetch_scores()
+    # фильм, получивший первый отзыв уже после снимка movies, попадёт в следующую сборку
+    keep = np.isin(movies, movie_ids)
+    centered, rated = centered_matrix(users[keep], movies[keep], scores[keep], movie_ids)
+    norms = column_norms(centered)
+    normalized, rated = normalize(centered, rated, norms)
+
+    neighbors = np.full((len(movie_ids), k), -1, dtype=np.int64)
+    similar = np.zeros((len(movie_ids), k), dtype=np.float32)
+    for start in range(0, len(movie_ids), batch_size):
+        columns = np.arange(start, min(start + batch_size, len(movie_ids)))
+        batch = similarity_rows(normalized, rated, columns, shrinkage)
+        neighbors[columns], similar[columns] = top_k(batch, movie_ids[columns], movie_ids, k)
+
+    return {"movie_ids": movie_ids, "neighbors": neighbors, "scores": similar, "norms": norms,
+            "review_count": review_count, "score_sum": score_sum}
+
+
+async def build_incremental(previous: dict[str, np.ndarray], fingerprints: Fingerprints,
+                            changed: np.ndarray, removed: np.ndarray, k: int, shrinkage: float,
+                            batch_size: int) -> dict[str, np.ndarray]:
+    movie_ids, review_count, score_sum = fingerprints
+    # все зрители изменившихся фильмов: их оценки нужны и для норм, и для сходства
+    users, movies, scores = await fetch_scores(
+        "WHERE user_id IN (SELECT user_id FROM reviews WHERE movie_id = ANY(:changed))",
+        {"changed": changed.tolist()},
+    )
+    keep = np.isin(movies, movie_ids)
+    centered, rated = centered_matrix(users[keep], movies[keep], scores[keep], movie_ids)
+
+    old_positions, in_old = index_positions(previous["movie_ids"], movie_ids)
+    changed_rows = np.searchsorted(movie_ids, changed)
+    norms = np.zeros(len(movie_ids), dtype=np.float32)
+    norms[in_old] = previous["norms"][old_positions[in_old]]
+    norms[changed_rows] = column_norms(centered)[changed_rows]
+
+    # прошлые списки без ссылок на изменившиеся и удалённые фильмы
+    neighbors = np.full((len(movie_ids), k), -1, dtype=np.int64)
+    similar = np.zeros((len(movie_ids), k), dtype=np.float32)
+    neighbors[in_old] = previous["neighbors"][old_positions[in_old]]
+    similar[in_old] = previous["scores"][old_positions[in_old]]
+    stale = np.isin(neighbors, np.concatenate([changed, removed]))
+    neighbors[stale] = -1
+    similar[stale] = 0
+
+    normalized, rated = normalize(centered, rated, norms)
+    skip = np.zeros(len(movie_ids), dtype=bool)
+    skip[changed_rows] = True  # их строки считаются целиком
+    for start in range(0, len(changed_rows), batch_size):
+        rows = changed_rows[start:start + batch_size]
+        batch = similarity_rows(normalized, rated, rows, shrinkage)
+        neighbors[rows], similar[rows] = top_k(batch, movie_ids[rows], movie_ids, k)
+        # сходство симметрично: столбцы пачки — кандидаты в списки остальных фильмов
+        merge_candidates(neighbors, similar, batch.T.tocsr(), movie_ids[rows], movie_ids, skip, k)
+
+    return {"movie_ids": movie_ids, "neighbors": neighbors, "scores": similar, "norms": norms,
+            "review_count": review_count, "score_sum": score_sum}
+
+
+# ------------------- Сохранение версии -------------------
+
+def save_version(directory: Path, arrays: dict[str, np.ndarray], meta: dict) -> str:
+    """Пишет версию во временный каталог, переименовывает и переключает current"""
+    now = time.time()
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f"{int(now * 1000) % 1000:03d}-{os.getpid()}"
+    staging = directory / f".{version}.tmp"
+    staging.mkdir(parents=True)
+    for name in ARRAYS:
+        np.save(staging / f"{name}.npy", arrays[name])
+    (staging / "meta.json").write_text(json.dumps({"version": version, **meta}, ensure_ascii=False))
+    os.replace(staging, directory / version)
+
+    pointer = directory / ".current.tmp"
+    pointer.write_text(version)
+    os.replace(pointer, directory / "current")
+
+    # воркеры с открытым mmap удалённой версии дочитают её: файлы живут, пока открыты
+    versions = sorted(path for path in directory.iterdir() if path.is_dir() and not path.name.startswith("."))
+    for path in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(path, ignore_errors=True)
+    return version
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Сборка индекса похожих фильмов")
+    parser.add_argument("--full", action="store_true", help="пересчитать всё, а не только изменившиеся фильмы")
+    args = parser.parse_args()
+
+    k = settings.RECOMMENDATIONS_TOP_K
+    shrinkage = settings.RECOMMENDATIONS_SHRINKAGE
+    batch_size = settings.RECOMMENDATIONS_BATCH_SIZE
+    directory = Path(settings.RECOMMENDATIONS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    started = time.perf_counter()
+    # снимок movies — до чтения отзывов: отзыв, записанный во время сборки,
+    # изменит review_count / score_sum и попадёт в следующую инкрементальную
+    fingerprints = await fetch_fingerprints()
+    previous_version = read_version(directory)
+    incremental = (previous_version is not None and not args.full
+                   and load_meta(directory, previous_version).get("k") == k)
+
+    try:
+        if incremental:
+            previous = load_arrays(directory, previous_version, mmap=False)
+            changed, removed = diff_fingerprints(previous, fingerprints)
+            if not len(changed) and not len(removed):
+                print(json.dumps({"version": previous_version, "mode": "unchanged"}))
+                return
+            if len(changed) > settings.RECOMMENDATIONS_FULL_REBUILD_SHARE * len(fingerprints[0]):
+                incremental = False
+
+        if incremental:
+            arrays = await build_incremental(previous, fingerprints, changed, removed, k, shrinkage, batch_size)
+        else:
+            changed = fingerprints[0]
+            arrays = await build_full(fingerprints, k, shrinkage, batch_size)
+    finally:
+        await async_engine.dispose()
+
+    meta = {
+        "mode": "incremental" if incremental else "full",
+        "built_at": time.time(),
+        "movies": len(arrays["movie_ids"]),
+        "recomputed": len(changed),
+        "seconds": round(time.perf_counter() - started, 3),
+        "k": k,
+        "shrinkage": shrinkage,
+    }
+    version = save_version(directory, arrays, meta)
+    print(json.dumps({"version": version, **meta}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,256 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import re
+import time
+from contextlib import contextmanager
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src.config import settings
+
+
+slow_request_logger = logging.getLogger("movieshelf.slow_request")
+
+
+# ------------------- Метрики запросов -------------------
+#
+# Middleware заводит на каждый HTTP-запрос объект RequestTrace в contextvar.
+# В него складываются SQL-запросы (через события движка), время bcrypt и JWT
+# (через span()) и время сериализации ответа. По окончании запроса трасса
+# попадает в гистограммы для /metrics (формат Prometheus), а медленные запросы
+# пишутся в лог одной JSON-строкой со списком отпечатков SQL — N+1 видно
+# как один отпечаток с большим count.
+#
+# Гистограммы живут в памяти процесса: у каждого воркера свои, Prometheus
+# собирает их с каждого воркера отдельно.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+UNMATCHED_ROUTE = "<unmatched>"  # 404 не плодят отдельную серию на каждый путь
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs: list[tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # значения меток -> [счётчики корзин..., сумма, количество]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            pairs = list(zip(self.labels, label_values))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', str(bound))])} {count}")
+            lines.append(f"{self.name}_bucket{_labels(pairs + [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {series[-1]}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("movieshelf_http_request_duration_seconds",
+                            "Время обработки HTTP-запроса", ("method", "route", "status"), LATENCY_BUCKETS)
+REQUEST_DB_QUERIES = Histogram("movieshelf_http_request_db_queries",
+                               "Число SQL-запросов на один HTTP-запрос", ("method", "route"), QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("movieshelf_http_request_db_seconds",
+                               "Суммарное время SQL за один HTTP-запрос", ("method", "route"), LATENCY_BUCKETS)
+SPAN_SECONDS = Histogram("movieshelf_span_duration_seconds",
+                         "Время этапов запроса: bcrypt, JWT, обработчик, сериализация", ("span",), LATENCY_BUCKETS)
+
+HISTOGRAMS = (REQUEST_SECONDS, REQUEST_DB_QUERIES, REQUEST_DB_SECONDS, SPAN_SECONDS)
+
+
+def render_metrics(pools: dict[str, dict]) -> str:
+    """Текст для /metrics; pools — pool_status() каждого движка по имени"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+
+    for key in next(iter(pools.values()), {}):
+        name = f"movieshelf_db_pool_{key}"
+        lines.append(f"# TYPE {name} {'counter' if key.endswith('_total') else 'gauge'}")
+        for engine, status in pools.items():
+            lines.append(f"{name}{_labels([('engine', engine)])} {status[key]}")
+
+    return "\n".join(lines) + "\n"
+
+
+# ------------------- Трасса запроса -------------------
+
+class RequestTrace:
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.queries: list[tuple[str, float]] = []  # (отпечаток SQL, секунды)
+        self.spans: dict[str, float] = {}
+        self.handler_done: float | None = None
+
+    def add_span(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def sql_summary(self, limit: int = 50) -> list[dict]:
+        grouped: dict[str, list] = {}
+        for fingerprint, seconds in self.queries:
+            item = grouped.setdefault(fingerprint, [0, 0.0])
+            item[0] += 1
+            item[1] += seconds
+        ordered = sorted(grouped.items(), key=lambda item: (-item[1][0], -item[1][1]))
+        return [{"fingerprint": fingerprint, "count": count, "total_ms": round(seconds * 1000, 2)}
+                for fingerprint, (count, seconds) in ordered[:limit]]
+
+
+current_trace: contextvars.ContextVar[RequestTrace | None] = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Замерить этап запроса: попадает и в гистограмму, и в трассу текущего запроса"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.observe(elapsed, name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span(name, elapsed)
+
+
+# ------------------- Отпечатки SQL -------------------
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|\?|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\?(?:, \?)+")
+_ROWS = re.compile(r"\((\?|\?, \.\.\.)\)(?:, \(\1\))+")
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """SQL без значений: IN-списки и многострочные VALUES разной длины дают один отпечаток"""
+    sql = " ".join(statement.split())
+    sql = _LITERALS.sub("?", sql)
+    sql = _LISTS.sub("?, ...", sql)
+    return _ROWS.sub("(...), ...", sql)
+
+
+def install_query_tracking(sync_engine: Engine):
+    """Каждый SQL-запрос движка записывается в трассу текущего HTTP-запроса (если она есть)"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._trace_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _record_query(conn, cursor, statement, parameters, context, executemany):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.queries.append((fingerprint(statement), time.perf_counter() - context._trace_start))
+
+
+# ------------------- Обработчик и сериализация -------------------
+
+class TimedRoute(APIRoute):
+    """Маршрут, который отмечает конец обработчика: всё после него до отправки
+    заголовков — валидация response_model и сериализация ответа"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            endpoint = self._timed(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    @staticmethod
+    def _timed(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            with span("handler"):
+                result = await endpoint(*args, **kwargs)
+            trace = current_trace.get()
+            if trace is not None:
+                trace.handler_done = time.perf_counter()
+            return result
+        return wrapper
+
+
+# ------------------- Middleware -------------------
+
+class RequestMetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = current_trace.set(trace)
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace.handler_done is not None:
+                    elapsed = time.perf_counter() - trace.handler_done
+                    SPAN_SECONDS.observe(elapsed, "serialization")
+                    trace.add_span("serialization", elapsed)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_trace.reset(token)
+            route = scope.get("route")
+            self.finish(trace, route.path if route is not None else UNMATCHED_ROUTE, status)
+
+    @staticmethod
+    def finish(trace: RequestTrace, route: str, status: int):
+        duration = time.perf_counter() - trace.started
+        db_seconds = sum(seconds for _, seconds in trace.queries)
+
+        REQUEST_SECONDS.observe(duration, trace.method, route, str(status))
+        REQUEST_DB_QUERIES.observe(len(trace.queries), trace.method, route)
+        REQUEST_DB_SECONDS.observe(db_seconds, trace.method, route)
+
+        if duration * 1000 >= settings.SLOW_REQUEST_MS:
+            slow_request_logger.warning(json.dumps({
+                "event": "slow_request",
+                "method": trace.method,
+                "route": route,
+                "path": trace.path,
+                "status": status,
+                "duration_ms": round(duration * 1000, 2),
+                "db_queries": len(trace.queries),
+                "db_ms": round(db_seconds * 1000, 2),
+                "spans_ms": {name: round(seconds * 1000, 2) for name, seconds in trace.spans.items()},
+                "sql": trace.sql_summary(),
+            }, ensure_ascii=False))
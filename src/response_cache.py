@@ -0,0 +1,125 @@
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
+from typing import Protocol
+from src.config import settings
+
+
+# ------------------- Кэш готовых ответов -------------------
+#
+# Ответ кэшируется уже сериализованным (bytes) под ключом, в который входит
+# версия пространства имён, например "reviews:42". Запись в отзывы фильма 42
+# увеличивает версию — старые ключи просто перестают запрашиваться и вытесняются LRU.
+# Та же версия входит в ETag, поэтому If-None-Match проверяется без обращения к базе.
+#
+# Версия растёт сразу после коммита записи, а реплика может ещё отставать: страница,
+# прочитанная с реплики вскоре после сброса, попала бы в кэш под новой версией.
+# Поэтому процесс помнит, когда сам сбрасывал пространство имён, и такие страницы
+# не кэширует (см. fresh_enough).
+
+class CacheBackend(Protocol):
+    """Хранилище кэша. По умолчанию — память процесса; для нескольких воркеров
+    подключается общее (например, Redis) через use_backend()."""
+
+    # Метка хранилища в ETag: у памяти процесса своя у каждого воркера, у общего — одна
+    epoch: str
+
+    async def get(self, key: str) -> bytes | None: ...
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None: ...
+
+    async def get_version(self, namespace: str) -> int: ...
+
+    async def bump_version(self, namespace: str) -> int: ...
+
+
+class InMemoryCacheBackend:
+
+    def __init__(self, max_entries: int):
+        self.epoch = secrets.token_hex(4)
+        self.max_entries = max_entries
+        self._items: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        # версии не вытесняются: сброс версии в 0 снова открыл бы доступ к старым записям
+        self._versions: dict[str, int] = {}
+
+    async def get(self, key: str) -> bytes | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[0] <= time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return item[1]
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._items[key] = (time.monotonic() + ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    async def get_version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    async def bump_version(self, namespace: str) -> int:
+        self._versions[namespace] = self._versions.get(namespace, 0) + 1
+        return self._versions[namespace]
+
+
+class ResponseCache:
+
+    def __init__(self, backend: CacheBackend, ttl: float, max_tracked: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_tracked = max_tracked
+        self._invalidated_at: OrderedDict[str, float] = OrderedDict()
+
+    async def version(self, namespace: str) -> int:
+        return await self.backend.get_version(namespace)
+
+    async def invalidate(self, namespace: str):
+        """Вызывать после коммита: иначе параллельный запрос закэширует старые данные под новой версией"""
+        await self.backend.bump_version(namespace)
+        self._invalidated_at[namespace] = time.monotonic()
+        self._invalidated_at.move_to_end(namespace)
+        while len(self._invalidated_at) > self.max_tracked:
+            self._invalidated_at.popitem(last=False)
+
+    def fresh_enough(self, namespace: str, from_primary: bool, wrote_recently: bool, lag: float) -> bool:
+        """Можно ли кэшировать страницу: с реплики — только если клиент сам недавно не писал
+        и пространство имён не сбрасывалось в последние lag секунд (реплика могла не догнать)"""
+        if from_primary:
+            return True
+        if wrote_recently:
+            return False
+        invalidated_at = self._invalidated_at.get(namespace)
+        return invalidated_at is None or time.monotonic() - invalidated_at >= lag
+
+    def etag(self, namespace: str, version: int, variant: str = "") -> str:
+        variant_hash = hashlib.blake2s(variant.encode(), digest_size=6).hexdigest()
+        return f'"{namespace}-{self.backend.epoch}-{version}-{variant_hash}"'
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.backend.get(key)
+
+    async def set(self, key: str, body: bytes):
+        # TTL ограничивает устаревание, если данные пришли с отстающей реплики
+        await self.backend.set(key, body, self.ttl)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+response_cache = ResponseCache(InMemoryCacheBackend(settings.RESPONSE_CACHE_SIZE), settings.RESPONSE_CACHE_TTL_SECONDS,
+                               settings.RESPONSE_CACHE_SIZE)
+
+
+def use_backend(backend: CacheBackend):
+    """Подключить общее хранилище кэша (вызывать при старте приложения)"""
+    response_cache.backend = backend
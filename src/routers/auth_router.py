@@ -1,18 +1,23 @@
+from typing import Annotated
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from passlib.hash import bcrypt
 from jose import jwt, JWTError
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Response, status
 from sqlalchemy import select
 from datetime import datetime, timedelta, UTC
 from src.schemas import UserReadSchema, UserCreateSchema, TokenSchema, LoginSchema
-from src.database import SessionDep
+from src.database import SessionDep, ReadSessionDep
 from src.models import User
-from src.config import settings, ALGORITHM
+from src.config import settings
+from src.token_cache import token_cache
+from src.password_hashing import password_hasher
+from src.request_metrics import TimedRoute, span
+from src.rate_limit import RateLimitPolicy, LOGIN_LIMIT, REGISTER_LIMIT, limit_by_ip, rate_limiter
 
 
 router = APIRouter(
     prefix="/auth",
-    tags=["Auth"]
+    tags=["Auth"],
+    route_class=TimedRoute
 )
 
 
@@ -22,13 +27,14 @@ def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(UTC) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
+    with span("jwt_encode"):
+        encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
 
 # --------------------------- Регистрация ------------------------
 
-@router.post("/register", response_model=UserReadSchema)
+@router.post("/register", response_model=UserReadSchema, dependencies=[limit_by_ip(REGISTER_LIMIT)])
 async def register_user(user_data: UserCreateSchema, session: SessionDep):
     query = select(User).where(User.email == user_data.email)
     result = await session.execute(query)
@@ -36,7 +42,7 @@ async def register_user(user_data: UserCreateSchema, session: SessionDep):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email уже зарегистрирован")
     else:
-        hashed_password = bcrypt.hash(user_data.password[:72])
+        hashed_password = await password_hasher.hash(user_data.password[:72])
         user = User(email=user_data.email, password_hash=hashed_password)
         session.add(user)
         await session.commit()
@@ -45,7 +51,7 @@ async def register_user(user_data: UserCreateSchema, session: SessionDep):
 
 # ---------------------- Авторизация ----------------------------
 
-@router.post("/login", response_model=TokenSchema)
+@router.post("/login", response_model=TokenSchema, dependencies=[limit_by_ip(LOGIN_LIMIT)])
 async def login_user(session: SessionDep, form_data: LoginSchema):
     query = select(User).where(User.email == form_data.username)
     result = await session.execute(query)
@@ -55,11 +61,18 @@ async def login_user(session: SessionDep, form_data: LoginSchema):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Неверный email или пароль")
 
-    if not bcrypt.verify(form_data.password, user.password_hash):
+    password_ok, new_hash = await password_hasher.verify(form_data.password, user.password_hash)
+    if not password_ok:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Неверный email или пароль")
 
-    payload = {"sub": user.email}
+    # стоимость bcrypt в настройках изменилась — незаметно перехешируем пароль
+    if new_hash is not None:
+        user.password_hash = new_hash
+        await session.commit()
+
+    # sub — id пользователя: при промахе кэша это поиск по первичному ключу
+    payload = {"sub": str(user.id), "email": user.email}
     token = create_access_token(payload)
 
     return {
@@ -72,27 +85,39 @@ async def login_user(session: SessionDep, form_data: LoginSchema):
 
 oauth2_scheme = HTTPBearer()
 
-async def get_current_user_from_token(token: str, session: SessionDep):
+async def get_current_user_from_token(token: str, session: SessionDep) -> UserReadSchema | None:
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+        with span("jwt_decode"):
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
 
-        email: str = payload.get("sub")
-        if email is None:
+        sub: str = payload.get("sub")
+        if sub is None:
             return None
 
     except JWTError:
         return None
 
-    stmt = select(User).where(User.email == email)
-    result = await session.execute(stmt)
-    user = result.scalar_one_or_none()
+    if sub.isdigit():
+        user = await session.get(User, int(sub))
+    else:
+        # токены, выданные до перехода на id в sub, содержат email
+        stmt = select(User).where(User.email == sub)
+        user = (await session.execute(stmt)).scalar_one_or_none()
 
-    return user
+    if user is None:
+        return None
 
+    user_data = UserReadSchema.model_validate(user)
+    token_cache.put(token, user_data, payload.get("exp", 0))
 
-@router.get("/me", response_model=UserReadSchema)
-async def get_me(session: SessionDep, credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
-    token = credentials.credentials
+    return user_data
+
+
+async def _require_user(token: str, session) -> UserReadSchema:
     user = await get_current_user_from_token(token, session)
 
     if user is None:
@@ -101,3 +126,30 @@ async def get_me(session: SessionDep, credentials: HTTPAuthorizationCredentials
     return user
 
 
+async def get_current_user(session: SessionDep,
+                           credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> UserReadSchema:
+    return await _require_user(credentials.credentials, session)
+
+
+async def get_current_user_read(session: ReadSessionDep,
+                                credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> UserReadSchema:
+    # то же самое, но промах кэша идёт в реплику — для чисто читающих ручек
+    return await _require_user(credentials.credentials, session)
+
+CurrentUserDep = Annotated[UserReadSchema, Depends(get_current_user)]
+CurrentUserReadDep = Annotated[UserReadSchema, Depends(get_current_user_read)]
+
+
+def limit_by_user(policy: RateLimitPolicy):
+    """Зависимость для dependencies=[...] ручки: лимит на пользователя (см. src/rate_limit.py).
+    Пользователь кэшируется FastAPI в пределах запроса — токен проверяется один раз"""
+
+    async def dependency(response: Response, user: CurrentUserDep):
+        await rate_limiter.hit(policy, f"user:{user.id}", response)
+
+    return Depends(dependency)
+
+
+@router.get("/me", response_model=UserReadSchema)
+async def get_me(user: CurrentUserReadDep):
+    return user
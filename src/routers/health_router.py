@@ -0,0 +1,51 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+from src.database import async_engine, replica_set, ping
+from src.db_metrics import pool_status
+from src.request_metrics import render_metrics
+from src.server import startup
+
+
+router = APIRouter(
+    prefix="/health",
+    tags=["Health"]
+)
+
+
+# ------------------- Готовность воркера -------------------
+
+@router.get("/ready")
+async def readiness():
+    # 503 до конца прогрева и после начала остановки — балансировщик не шлёт сюда запросы
+    if startup.stopping or startup.report is None:
+        return JSONResponse({"status": "stopping" if startup.stopping else "starting"}, status_code=503)
+    # при старте primary не ответил — готовы, как только ответит
+    if not startup.ready:
+        if not await ping(async_engine):
+            return JSONResponse({"status": "database_unavailable"}, status_code=503)
+        startup.ready = True
+    return {"status": "ready", "startup": startup.report}
+
+
+# ------------------- Состояние пула соединений -------------------
+
+@router.get("/db")
+async def db_pool_status():
+    return {
+        "primary": pool_status(async_engine),
+        "replicas": [pool_status(engine) for engine in replica_set.engines],
+    }
+
+
+# ------------------- Метрики в формате Prometheus -------------------
+
+metrics_router = APIRouter(tags=["Health"])
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    pools = {"primary": pool_status(async_engine)}
+    for i, engine in enumerate(replica_set.engines):
+        pools[f"replica{i}"] = pool_status(engine)
+
+    return PlainTextResponse(render_metrics(pools), media_type="text/plain; version=0.0.4")
@@ -1,119 +1,368 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy import select
-
-from src.schemas import MovieReadSchema, RatingUpdateSchema, MovieAddCustomSchema
-from src.database import SessionDep
-from src.routers.auth_router import get_current_user_from_token
-from src.models import Movie
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Path, Query, Request, Response
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from sqlalchemy import select, update, and_, func, literal_column
+
+from src.schemas import (MovieSummarySchema, RatingUpdateSchema, MovieAddCustomSchema,
+                         MoviePageSchema, BulkImportResultSchema, TmdbImportSchema, TopMoviePageSchema,
+                         UserStatsSchema, SimilarMovieSchema, RecommendedMovieSchema,
+                         MovieIdsSchema, MovieDeleteResultSchema)
+from src.database import SessionDep, ReadSessionDep, read_sessionmaker, is_primary, wrote_recently
+from src.config import settings
+from src.pagination import SortField, paginate, next_cursor, encode_cursor
+from src.search import build_search_query
+from src.leaderboard import build_top_query
+from src.recommendations import recommendation_index, load_seeds
+from src.bulk_import import PARSERS, decode_utf8, import_movies
+from src.catalogue import add_to_shelf, add_tmdb_to_shelf, remove_from_shelf
+from src.movie_purge import movie_purger
+from src.jobs import job_queue
+from src.user_stats import load_user_stats, invalidate_user_stats, user_stats_namespace
+from src.response_cache import response_cache, etag_matches
+from src.tmdb import tmdb_client, TmdbError, TmdbNotFound
+from src.routers.reviews_router import load_latest_reviews, invalidate_reviews_cache
+from src.rate_limit import WRITE_LIMIT, BULK_LIMIT
+from src.ndjson import stream_ndjson
+from src.routers.auth_router import CurrentUserDep, CurrentUserReadDep, limit_by_user
+from src.models import Movie, ShelfEntry
+from src.request_metrics import TimedRoute
 
 router = APIRouter(
     prefix="/movies",
-    tags=["Movies"]
+    tags=["Movies"],
+    route_class=TimedRoute
 )
 
-oauth2_scheme = HTTPBearer()
+# /movies/my сортируется по полке: rating — личная оценка, created_at — когда фильм добавлен.
+# Фильмы без личной оценки (импорт из TMDB и т. п.) идут как оценка -1 — ниже любой;
+# выражение совпадает с индексом ix_shelf_entries_user_id_rating_movie_id (миграция 0011)
+UNRATED = -1.0
+SORT_COLUMNS = {"id": ShelfEntry.movie_id,
+                "rating": func.coalesce(ShelfEntry.rating, literal_column("-1.0")),
+                "created_at": ShelfEntry.created_at}
+SORT_ATTRS = {"id": "id", "rating": "my_rating", "created_at": "added_at"}
+
+# Колонки для выгрузки и быстрого режима — без ORM-объектов и связей.
+# Фильм из каталога + строка полки текущего пользователя
+READ_COLUMNS = (Movie.id, Movie.title, Movie.genre, Movie.description, Movie.rating,
+                Movie.review_count, Movie.created_at, Movie.tmdb_id,
+                ShelfEntry.rating.label("my_rating"), ShelfEntry.created_at.label("added_at"))
+
+
+def shelf_query(user_id: int):
+    """Фильмы полки пользователя — через join, копий фильмов у пользователей нет"""
+    return (
+        select(*READ_COLUMNS)
+        .select_from(ShelfEntry)
+        .join(Movie, Movie.id == ShelfEntry.movie_id)
+        .where(ShelfEntry.user_id == user_id, Movie.deleted_at.is_(None))
+    )
 
 
-# ------------------- Добавить собственный фильм -------------------
+async def load_shelf_item(session, user_id: int, movie_id: int) -> dict | None:
+    row = (await session.execute(shelf_query(user_id).where(ShelfEntry.movie_id == movie_id))).one_or_none()
+    return row._asdict() if row is not None else None
 
-@router.post("/add-custom", response_model=MovieReadSchema)
-async def add_movie_custom(movie_data: MovieAddCustomSchema,
-                           session: SessionDep,
-                           credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
-
-    token = credentials.credentials
-    user = await get_current_user_from_token(token, session)
-    if not user:
-        raise HTTPException(status_code=401, detail="Недействительный или просроченный токен")
-
-    if movie_data.rating is not None and not (0 <= movie_data.rating <= 5):
-        raise HTTPException(status_code=400, detail="Рейтинг должен быть от 0 до 5")
 
-    new_movie = Movie(
-        title=movie_data.title,
-        genre=movie_data.genre,
-        description=movie_data.description,
-        rating=movie_data.rating or 0.0,
-        owner_id=user.id
+async def load_movies(session, user_id: int, movie_ids: list[int]) -> dict[int, dict]:
+    """Фильмы каталога по id с полкой пользователя (если фильм на ней)"""
+    shelf = and_(ShelfEntry.movie_id == Movie.id, ShelfEntry.user_id == user_id)
+    rows = await session.execute(
+        select(*READ_COLUMNS).select_from(Movie).join(ShelfEntry, shelf, isouter=True)
+        .where(Movie.id.in_(movie_ids), Movie.deleted_at.is_(None))
     )
+    return {row.id: row._asdict() for row in rows}
 
-    session.add(new_movie)
-    await session.commit()
-    await session.refresh(new_movie)
 
-    return new_movie
+async def movies_response(items: list[dict], cursor_next: str | None,
+                          include_reviews: bool, reviews_limit: int, session):
+    """Собирает страницу фильмов; отзывы — одним дополнительным запросом на всю страницу"""
+    if include_reviews:
+        latest = await load_latest_reviews([item["id"] for item in items], reviews_limit, session)
+        for item in items:
+            item["reviews"] = latest[item["id"]]
 
+    page = {"items": items, "next_cursor": cursor_next}
+    if settings.FAST_JSON_RESPONSES:
+        return ORJSONResponse(page)
+    return page
 
-# ------------------- Получить фильм пользователя -------------------
-
-@router.get("/my", response_model=List[MovieReadSchema])
-async def get_my_movies(session: SessionDep, credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
-    token = credentials.credentials
-    user = await get_current_user_from_token(token, session)
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Недействительный или просроченный токен")
+# ------------------- Добавить собственный фильм -------------------
 
-    query = select(Movie).where(Movie.owner_id == user.id)
-    result = await session.execute(query)
-    movies = result.scalars().all()
+@router.post("/add-custom", response_model=MovieSummarySchema, dependencies=[limit_by_user(WRITE_LIMIT)])
+async def add_movie_custom(movie_data: MovieAddCustomSchema,
+                           session: SessionDep,
+                           user: CurrentUserDep):
 
-    return movies
+    if movie_data.rating is not None and not (0 <= movie_data.rating <= 5):
+        raise HTTPException(status_code=400, detail="Рейтинг должен быть от 0 до 5")
 
+    # фильм уже есть в каталоге (то же название и жанр) — на полку ложится он, а не копия
+    [movie_id] = await add_to_shelf(session, user.id, [movie_data.model_dump()])
+    invalidate_user_stats(user.id, session)
+    await job_queue.commit(session)
+
+    return await load_shelf_item(session, user.id, movie_id)
+
+
+# ------------------- Импорт из TMDB -------------------
+
+@router.post("/add-tmdb/{tmdb_id}", response_model=MovieSummarySchema, dependencies=[limit_by_user(WRITE_LIMIT)])
+async def add_movie_tmdb(session: SessionDep, user: CurrentUserDep, tmdb_id: int = Path(gt=0)):
+    # соединение пула, взятое под проверку токена, не держим, пока ждём TMDB
+    await session.close()
+    try:
+        movie = await tmdb_client.get_movie(tmdb_id)
+    except TmdbNotFound:
+        raise HTTPException(status_code=404, detail="Фильм не найден в TMDB")
+    except TmdbError:
+        raise HTTPException(status_code=502, detail="TMDB недоступен, повторите позже")
+
+    [movie_id] = await add_tmdb_to_shelf(session, user.id, [movie])
+    invalidate_user_stats(user.id, session)
+    await job_queue.commit(session)
+
+    return await load_shelf_item(session, user.id, movie_id)
+
+
+@router.post("/add-tmdb", response_model=BulkImportResultSchema, dependencies=[limit_by_user(BULK_LIMIT)])
+async def add_movies_tmdb(data: TmdbImportSchema, session: SessionDep, user: CurrentUserDep):
+    await session.close()
+    # загрузки идут параллельно; сколько из них одновременно в сети — решает tmdb_client
+    results = await asyncio.gather(*(tmdb_client.get_movie(tmdb_id) for tmdb_id in data.ids),
+                                   return_exceptions=True)
+
+    movies, errors = [], []
+    for row, (tmdb_id, result) in enumerate(zip(data.ids, results), start=1):
+        if isinstance(result, TmdbNotFound):
+            errors.append({"row": row, "error": f"Фильм {tmdb_id} не найден в TMDB"})
+        elif isinstance(result, TmdbError):
+            errors.append({"row": row, "error": f"TMDB недоступен: {result}"})
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            movies.append(result)
+
+    movie_ids = await add_tmdb_to_shelf(session, user.id, movies)
+    invalidate_user_stats(user.id, session)
+    await job_queue.commit(session)
+
+    return {"inserted": len(set(movie_ids)), "failed": len(errors), "errors": errors}
+
+
+# ------------------- Массовый импорт фильмов -------------------
+
+@router.post("/bulk", response_model=BulkImportResultSchema, dependencies=[limit_by_user(BULK_LIMIT)],
+             openapi_extra={"requestBody": {"required": True, "content": {
+                 "application/json": {"schema": {"type": "array", "items": {"type": "object"}}},
+                 "application/x-ndjson": {"schema": {"type": "string"}},
+                 "text/csv": {"schema": {"type": "string"}},
+             }}})
+async def add_movies_bulk(request: Request, session: SessionDep, user: CurrentUserDep):
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    parser = PARSERS.get(content_type)
+    if parser is None:
+        raise HTTPException(status_code=415,
+                            detail="Поддерживаются application/json, application/x-ndjson и text/csv")
+
+    try:
+        return await import_movies(session, parser(decode_utf8(request.stream())), user.id,
+                                   settings.BULK_IMPORT_CHUNK_SIZE, settings.BULK_IMPORT_MAX_ROWS,
+                                   settings.BULK_IMPORT_MAX_ERRORS)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Файл должен быть в кодировке UTF-8")
 
-# --------------------------- Удалить фильм -------------------------
 
-@router.delete("/delete/{movie_id}")
-async def delete_movie(movie_id: int, session: SessionDep, credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
-    token = credentials.credentials
-    user = await get_current_user_from_token(token, session)
+# ------------------- Получить фильм пользователя -------------------
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Недействительный или просроченный токен")
+@router.get("/my", response_model=MoviePageSchema)
+async def get_my_movies(session: ReadSessionDep, user: CurrentUserReadDep,
+                        cursor: Optional[str] = None,
+                        limit: int = Query(settings.PAGE_DEFAULT_LIMIT, ge=1, le=settings.PAGE_MAX_LIMIT),
+                        sort: SortField = "id",
+                        desc: bool = False,
+                        include_reviews: bool = False,
+                        reviews_limit: int = Query(5, ge=1, le=50)):
+    # строки колонок вместо ORM-объектов: без identity map и без ленивой подгрузки связей
+    query = paginate(shelf_query(user.id), ShelfEntry.movie_id, SORT_COLUMNS[sort], sort, desc, cursor, limit)
+    rows = list((await session.execute(query)).all())
+    cursor_next = next_cursor(rows, sort, desc, limit, SORT_ATTRS[sort], null_value=UNRATED)
+
+    return await movies_response([row._asdict() for row in rows], cursor_next,
+                                 include_reviews, reviews_limit, session)
+
+
+# ------------------- Выгрузить все фильмы пользователя (NDJSON) -------------------
+
+@router.get("/my/export")
+async def export_my_movies(request: Request, user: CurrentUserReadDep):
+    query = shelf_query(user.id).order_by(ShelfEntry.movie_id)
+    session_maker = await read_sessionmaker(request)
+    return StreamingResponse(stream_ndjson(query, MovieSummarySchema, session_maker),
+                             media_type="application/x-ndjson")
+
+
+# ------------------- Статистика полки и отзывов -------------------
+
+@router.get("/my/stats", response_model=UserStatsSchema)
+async def get_my_stats(request: Request, session: ReadSessionDep, user: CurrentUserReadDep):
+    namespace = user_stats_namespace(user.id)
+    version = await response_cache.version(namespace)
+    etag = response_cache.etag(namespace, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    cache_key = f"{namespace}:{version}"
+    body = await response_cache.get(cache_key)
+    if body is None:
+        body = UserStatsSchema(**await load_user_stats(session, user.id)).model_dump_json().encode()
+        if response_cache.fresh_enough(namespace, is_primary(session), wrote_recently(request),
+                                       settings.DB_REPLICA_STICKY_SECONDS):
+            await response_cache.set(cache_key, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# ------------------- Поиск фильмов -------------------
+
+@router.get("/search", response_model=MoviePageSchema)
+async def search_movies(session: ReadSessionDep, user: CurrentUserReadDep,
+                        q: Optional[str] = Query(None, min_length=1, max_length=200),
+                        genre: Optional[str] = None,
+                        min_rating: Optional[float] = Query(None, ge=0, le=5),
+                        max_rating: Optional[float] = Query(None, ge=0, le=5),
+                        mine: bool = False,
+                        cursor: Optional[str] = None,
+                        limit: int = Query(settings.PAGE_DEFAULT_LIMIT, ge=1, le=settings.PAGE_MAX_LIMIT),
+                        include_reviews: bool = False,
+                        reviews_limit: int = Query(5, ge=1, le=50)):
+    query = build_search_query(READ_COLUMNS, q, genre, min_rating, max_rating,
+                               user.id, mine, cursor, limit)
+    rows = list((await session.execute(query)).all())
+
+    cursor_next = None
+    if len(rows) > limit:
+        del rows[limit:]
+        last = rows[-1]
+        if q:
+            cursor_next = encode_cursor("relevance", True, last.relevance, last.id)
+        else:
+            cursor_next = encode_cursor("id", False, last.id, last.id)
+
+    items = []
+    for row in rows:
+        item = row._asdict()
+        del item["relevance"]
+        items.append(item)
+
+    return await movies_response(items, cursor_next, include_reviews, reviews_limit, session)
+
+
+# ------------------- Лучшие фильмы -------------------
+
+@router.get("/top", response_model=TopMoviePageSchema)
+async def get_top_movies(session: ReadSessionDep, user: CurrentUserReadDep,
+                         genre: Optional[str] = None,
+                         min_reviews: int = Query(1, ge=1),
+                         cursor: Optional[str] = None,
+                         limit: int = Query(settings.PAGE_DEFAULT_LIMIT, ge=1, le=settings.PAGE_MAX_LIMIT),
+                         include_reviews: bool = False,
+                         reviews_limit: int = Query(5, ge=1, le=50)):
+    # порядок и score — из movie_leaderboard, остальные колонки фильма — актуальные
+    query = build_top_query(READ_COLUMNS, user.id, genre, min_reviews, cursor, limit)
+    rows = list((await session.execute(query)).all())
+    cursor_next = next_cursor(rows, "score", True, limit, "score")
+
+    return await movies_response([row._asdict() for row in rows], cursor_next,
+                                 include_reviews, reviews_limit, session)
 
-    query = select(Movie).where(Movie.owner_id == user.id,
-                                Movie.id == movie_id)
 
-    result = await session.execute(query)
-    movie = result.scalar_one_or_none()
+# --------------------------- Удалить фильм -------------------------
 
-    if not movie:
+async def remove_movies(session, user_id: int, movie_ids: list[int]) -> list[int]:
+    """Снимает фильмы с полки; фильмы, которых больше ни у кого нет, уходят из каталога,
+    их отзывы в фоне удалит movie_purger. Время ответа не зависит от числа отзывов"""
+    removed, retired = await remove_from_shelf(session, user_id, movie_ids)
+    if removed:
+        invalidate_user_stats(user_id, session)
+    for movie_id in retired:
+        invalidate_reviews_cache(movie_id, session)
+    await job_queue.commit(session)
+
+    if retired:
+        movie_purger.note_deleted()
+    return removed
+
+
+@router.delete("/delete/{movie_id}", dependencies=[limit_by_user(WRITE_LIMIT)])
+async def delete_movie(movie_id: int, session: SessionDep, user: CurrentUserDep):
+    # с полки; из каталога — только если фильма не осталось ни на одной полке
+    if not await remove_movies(session, user.id, [movie_id]):
         raise HTTPException(status_code=404, detail="Фильм не найден")
 
-    await session.delete(movie)
-    await session.commit()
-
     return {"status": "success", "message": "Movie deleted"}
 
 
+@router.delete("", response_model=MovieDeleteResultSchema, dependencies=[limit_by_user(BULK_LIMIT)])
+async def delete_movies(data: MovieIdsSchema, session: SessionDep, user: CurrentUserDep):
+    # два запроса на всю пачку, сколько бы отзывов ни было у фильмов
+    removed = set(await remove_movies(session, user.id, data.ids))
+    return {"deleted": len(removed), "not_found": sorted(set(data.ids) - removed)}
+
+
 # -------------------------- Обновить локальный рейтинг --------------------------
 
-@router.patch("/{movie_id}/rate", response_model=MovieReadSchema)
+@router.patch("/{movie_id}/rate", response_model=MovieSummarySchema, dependencies=[limit_by_user(WRITE_LIMIT)])
 async def update_rating(movie_id: int, body: RatingUpdateSchema,
                         session: SessionDep,
-                        credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
-    token = credentials.credentials
-    user = await get_current_user_from_token(token, session)
+                        user: CurrentUserDep):
+    new_rating = body.rating
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Недействительный или просроченный токен")
+    if not (0 <= new_rating <= 5):
+        raise HTTPException(status_code=400, detail="Рейтинг должен быть от 0 до 5")
 
-    query = select(Movie).where(Movie.id == movie_id, Movie.owner_id == user.id)
-    result = await session.execute(query)
-    movie = result.scalar_one_or_none()
+    # личная оценка на полке; средняя по отзывам (movies.rating) считается отдельно
+    result = await session.execute(
+        update(ShelfEntry)
+        .where(ShelfEntry.user_id == user.id, ShelfEntry.movie_id == movie_id)
+        .values(rating=new_rating)
+    )
 
-    if not movie:
+    if not result.rowcount:
         raise HTTPException(status_code=404, detail="Фильм не найден")
 
-    new_rating = body.rating
+    invalidate_user_stats(user.id, session)
+    await job_queue.commit(session)
 
-    if not (0 <= new_rating <= 5):
-        raise HTTPException(status_code=400, detail="Рейтинг должен быть от 0 до 5")
+    return await load_shelf_item(session, user.id, movie_id)
+
+
+# -------------------------- Похожие фильмы и рекомендации --------------------------
+
+def require_recommendations():
+    if not recommendation_index.ready:
+        raise HTTPException(status_code=503, detail="Рекомендации ещё не построены, повторите позже")
+
+
+@router.get("/recommendations", response_model=list[RecommendedMovieSchema])
+async def get_recommendations(session: ReadSessionDep, user: CurrentUserReadDep,
+                              limit: int = Query(20, ge=1, le=100)):
+    require_recommendations()
+    picks = recommendation_index.recommend(await load_seeds(session, user.id), limit)
+    movies = await load_movies(session, user.id, [movie_id for movie_id, _ in picks])
+    return [{**movies[movie_id], "score": score} for movie_id, score in picks if movie_id in movies]
 
-    movie.rating = new_rating
-    await session.commit()
-    await session.refresh(movie)
 
-    return movie
+@router.get("/{movie_id}/similar", response_model=list[SimilarMovieSchema])
+async def get_similar_movies(movie_id: int, session: ReadSessionDep, user: CurrentUserReadDep,
+                             limit: int = Query(10, ge=1, le=settings.RECOMMENDATIONS_TOP_K)):
+    require_recommendations()
+    neighbors = recommendation_index.similar(movie_id, limit)
+    movies = await load_movies(session, user.id, [neighbor_id for neighbor_id, _ in neighbors])
+    # фильм, удалённый после сборки индекса, просто пропускается
+    return [{**movies[neighbor_id], "similarity": similarity}
+            for neighbor_id, similarity in neighbors if neighbor_id in movies]
@@ -1,56 +1,94 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy import select, update
+from typing import Optional
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, insert, values, column, true, Integer
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.routers.auth_router import get_current_user_from_token
+from src.routers.auth_router import CurrentUserDep, limit_by_user
 from src.models import Movie, Review
-from src.schemas import ReviewReadSchema, ReviewCreateSchema
-from src.database import SessionDep
-
-oauth2_scheme = HTTPBearer()
+from src.schemas import ReviewReadSchema, ReviewCreateSchema, ReviewPageSchema, ReviewBatchSchema
+from src.database import SessionDep, ReadSessionDep, read_sessionmaker, is_primary, wrote_recently
+from src.config import settings
+from src.pagination import SortField, paginate, next_cursor
+from src.ndjson import stream_ndjson
+from src.response_cache import response_cache, etag_matches
+from src.request_metrics import TimedRoute
+from src.ratings import record_rating_delta, record_rating_deltas
+from src.jobs import job_queue
+from src.user_stats import invalidate_user_stats
+from src.rate_limit import WRITE_LIMIT, BULK_LIMIT
 
 router = APIRouter(
     prefix="/reviews",
-    tags=["Reviews"]
+    tags=["Reviews"],
+    route_class=TimedRoute
 )
 
-# -------------------- Вспомогательная функция ----------------------
+# для отзывов "rating" — это оценка score
+SORT_COLUMNS = {"id": Review.id, "rating": Review.score, "created_at": Review.created_at}
+SORT_ATTRS = {"id": "id", "rating": "score", "created_at": "created_at"}
+
+READ_COLUMNS = (Review.id, Review.user_id, Review.movie_id, Review.score, Review.text, Review.created_at)
+
+
+def reviews_cache_namespace(movie_id: int) -> str:
+    return f"reviews:{movie_id}"
+
+
+# Сброс кэша страниц отзывов — задача после коммита. inline: версия растёт в самом
+# job_queue.commit(), до ответа — следующий GET автора записи не получит старую страницу
+# и 304 по старому ETag (кэш в памяти процесса, поэтому и не воркер из таблицы jobs)
+REVIEWS_CACHE_JOB = "reviews_cache"
+
+
+async def _invalidate_reviews_cache(session: AsyncSession, items: dict[int, None]):
+    for movie_id in items:
+        await response_cache.invalidate(reviews_cache_namespace(movie_id))
 
-async def recalc_movie_rating(movie_id: int, session: AsyncSession):
-    """Пересчитывает средний рейтинг фильма по всем отзывам"""
-    query_scores = select(Review.score).where(Review.movie_id == movie_id)
-    result = await session.execute(query_scores)
-    scores = result.scalars().all()
+job_queue.register(REVIEWS_CACHE_JOB, _invalidate_reviews_cache, inline=True)
 
-    new_rating = sum(scores) / len(scores) if scores else 0.0
 
-    await session.execute(
-        update(Movie)
-        .where(Movie.id == movie_id)
-        .values(rating=new_rating)
+def invalidate_reviews_cache(movie_id: int, session: AsyncSession):
+    job_queue.enqueue(session, REVIEWS_CACHE_JOB, movie_id)
+
+# -------------------- Вспомогательная функция ----------------------
+
+async def load_latest_reviews(movie_ids: list[int], per_movie: int, session: AsyncSession) -> dict[int, list[dict]]:
+    """Последние per_movie отзывов для каждого фильма одним запросом (LATERAL по индексу (movie_id, id))"""
+    if not movie_ids:
+        return {}
+
+    ids = values(column("movie_id", Integer), name="ids").data([(movie_id,) for movie_id in movie_ids])
+    latest = (
+        select(*READ_COLUMNS)
+        .where(Review.movie_id == ids.c.movie_id)
+        .order_by(Review.id.desc())
+        .limit(per_movie)
+        .lateral("latest")
     )
+    rows = (await session.execute(select(latest).select_from(ids).join(latest, true()))).all()
+
+    grouped: dict[int, list[dict]] = {movie_id: [] for movie_id in movie_ids}
+    for row in rows:
+        grouped[row.movie_id].append(row._asdict())
+    return grouped
 
 
 # -------------------- Добавить отзыв ----------------------
 
-@router.post("/add", response_model=ReviewReadSchema)
+@router.post("/add", response_model=ReviewReadSchema, dependencies=[limit_by_user(WRITE_LIMIT)])
 async def add_review(
     review_data: ReviewCreateSchema,
     session: SessionDep,
-    credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)
+    user: CurrentUserDep
 ):
-    token = credentials.credentials
-    user = await get_current_user_from_token(token, session)
-    if not user:
-        raise HTTPException(status_code=401, detail="Недействительный токен")
-
     # VALIDATION -----
     if not 0 <= review_data.score <= 5:
         raise HTTPException(status_code=400, detail="Оценка должна быть от 0 до 5")
 
     movie = (await session.execute(
-        select(Movie).where(Movie.id == review_data.movie_id)
+        select(Movie).where(Movie.id == review_data.movie_id, Movie.deleted_at.is_(None))
     )).scalar_one_or_none()
 
     if not movie:
@@ -69,9 +107,11 @@ async def add_review(
         # Коммитим отзыв + пересчёт рейтинга в одной транзакции
         await session.flush()  # добавили, но без коммита
 
-        await recalc_movie_rating(movie.id, session)
+        await record_rating_delta(movie.id, 1, review.score, session)
+        invalidate_reviews_cache(movie.id, session)
+        invalidate_user_stats(user.id, session)
 
-        await session.commit()  # коммитим ВСЁ сразу
+        await job_queue.commit(session)  # коммитим ВСЁ сразу, производная работа — в фоне
         await session.refresh(review)
 
         return review
@@ -81,53 +121,165 @@ async def add_review(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# -------------------- Добавить пачку отзывов ----------------------
+
+@router.post("/batch", response_model=list[ReviewReadSchema], dependencies=[limit_by_user(BULK_LIMIT)])
+async def add_reviews_batch(
+    batch: ReviewBatchSchema,
+    session: SessionDep,
+    user: CurrentUserDep
+):
+    # VALIDATION -----
+    bad_rows = [i for i, item in enumerate(batch.items) if not 0 <= item.score <= 5]
+    if bad_rows:
+        raise HTTPException(status_code=400, detail=f"Оценка должна быть от 0 до 5 (элементы {bad_rows})")
+
+    movie_ids = {item.movie_id for item in batch.items}
+
+    try:
+        # одна проверка существования на все фильмы
+        query = select(Movie.id).where(Movie.id.in_(movie_ids), Movie.deleted_at.is_(None)).order_by(Movie.id)
+        if not settings.RATING_UPDATES_DEFERRED:
+            # агрегаты обновятся в этой же транзакции: блокируем строки в порядке id,
+            # чтобы параллельные пачки с пересекающимися фильмами не ловили взаимоблокировку
+            query = query.with_for_update()
+        found = set((await session.execute(query)).scalars().all())
+
+        missing = sorted(movie_ids - found)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Фильмы не найдены: {missing}")
+
+        reviews = list((await session.scalars(
+            insert(Review).returning(Review),
+            [{"text": item.text, "score": item.score, "movie_id": item.movie_id, "user_id": user.id}
+             for item in batch.items]
+        )).all())
+
+        deltas: dict[int, tuple[int, float]] = {}
+        for item in batch.items:
+            count, total = deltas.get(item.movie_id, (0, 0.0))
+            deltas[item.movie_id] = (count + 1, total + item.score)
+
+        await record_rating_deltas(deltas, session)
+        for movie_id in deltas:
+            invalidate_reviews_cache(movie_id, session)
+        invalidate_user_stats(user.id, session)
+
+        await job_queue.commit(session)
+
+        return reviews
+
+    except HTTPException:
+        await session.rollback()
+        raise
+
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # -------------------- Получить все отзывы ----------------------
 
-@router.get("/get/{movie_id}", response_model=list[ReviewReadSchema])
-async def get_reviews(session: SessionDep, movie_id: int):
-    movie = (await session.execute(
-        select(Movie).where(Movie.id == movie_id)
+@router.get("/get/{movie_id}", response_model=ReviewPageSchema)
+async def get_reviews(request: Request, session: ReadSessionDep, movie_id: int,
+                      cursor: Optional[str] = None,
+                      limit: int = Query(settings.PAGE_DEFAULT_LIMIT, ge=1, le=settings.PAGE_MAX_LIMIT),
+                      sort: SortField = "id",
+                      desc: bool = False):
+    namespace = reviews_cache_namespace(movie_id)
+    version = await response_cache.version(namespace)
+    variant = f"{sort}:{desc}:{limit}:{cursor}"
+    etag = response_cache.etag(namespace, version, variant)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    # клиент уже видел эту версию — ни базы, ни сериализации
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    cache_key = f"{namespace}:{version}:{variant}"
+    body = await response_cache.get(cache_key)
+
+    if body is None:
+        movie_exists = (await session.execute(
+            select(Movie.id).where(Movie.id == movie_id, Movie.deleted_at.is_(None))
+        )).scalar_one_or_none()
+
+        if movie_exists is None:
+            raise HTTPException(status_code=404, detail="Фильм с таким ID не найден")
+
+        if settings.FAST_JSON_RESPONSES:
+            # строки колонок сразу в orjson — без ORM-объектов и валидации схемой
+            query = select(*READ_COLUMNS).where(Review.movie_id == movie_id)
+            query = paginate(query, Review.id, SORT_COLUMNS[sort], sort, desc, cursor, limit)
+            rows = list((await session.execute(query)).all())
+            cursor_next = next_cursor(rows, sort, desc, limit, SORT_ATTRS[sort])
+            body = orjson.dumps({"items": [row._asdict() for row in rows], "next_cursor": cursor_next})
+        else:
+            query = select(Review).where(Review.movie_id == movie_id)
+            query = paginate(query, Review.id, SORT_COLUMNS[sort], sort, desc, cursor, limit)
+            reviews = list((await session.execute(query)).scalars().all())
+
+            page = ReviewPageSchema(items=reviews,
+                                    next_cursor=next_cursor(reviews, sort, desc, limit, SORT_ATTRS[sort]))
+            body = page.model_dump_json().encode()
+        # страницу с отстающей реплики не кэшируем под только что выросшей версией
+        if response_cache.fresh_enough(namespace, is_primary(session), wrote_recently(request),
+                                       settings.DB_REPLICA_STICKY_SECONDS):
+            await response_cache.set(cache_key, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# -------------------- Выгрузить все отзывы (NDJSON) ----------------------
+
+@router.get("/get/{movie_id}/export")
+async def export_reviews(request: Request, session: ReadSessionDep, movie_id: int):
+    movie_exists = (await session.execute(
+        select(Movie.id).where(Movie.id == movie_id, Movie.deleted_at.is_(None))
     )).scalar_one_or_none()
 
-    if not movie:
+    if movie_exists is None:
         raise HTTPException(status_code=404, detail="Фильм с таким ID не найден")
 
-    reviews = (await session.execute(
-        select(Review).where(Review.movie_id == movie_id)
-    )).scalars().all()
-
-    return reviews
+    query = select(*READ_COLUMNS).where(Review.movie_id == movie_id).order_by(Review.id)
+    session_maker = await read_sessionmaker(request)
+    return StreamingResponse(stream_ndjson(query, ReviewReadSchema, session_maker),
+                             media_type="application/x-ndjson")
 
 
 # -------------------- Удалить отзыв ----------------------
 
-@router.delete("/delete/{review_id}")
+@router.delete("/delete/{review_id}", dependencies=[limit_by_user(WRITE_LIMIT)])
 async def delete_review(
     review_id: int,
     session: SessionDep,
-    credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)
+    user: CurrentUserDep
 ):
-    token = credentials.credentials
-    user = await get_current_user_from_token(token, session)
-    if not user:
-        raise HTTPException(status_code=401, detail="Недействительный токен")
-
+    # блокируем строку отзыва: иначе два параллельных изменения прочтут одну и ту же
+    # старую оценку и сдвинут агрегаты фильма на неверную дельту.
+    # Отзыв к удалённому фильму — как несуществующий: его удалит очистка (src/movie_purge.py)
     review = (await session.execute(
-        select(Review).where(Review.id == review_id, Review.user_id == user.id)
+        select(Review)
+        .join(Movie, Movie.id == Review.movie_id)
+        .where(Review.id == review_id, Review.user_id == user.id, Movie.deleted_at.is_(None))
+        .with_for_update(of=Review)
     )).scalar_one_or_none()
 
     if not review:
         raise HTTPException(status_code=404, detail="Отзыв не найден или не принадлежит вам")
 
     movie_id = review.movie_id
+    old_score = review.score
 
     try:
         await session.delete(review)
         await session.flush()
 
-        await recalc_movie_rating(movie_id, session)
+        await record_rating_delta(movie_id, -1, -old_score, session)
+        invalidate_reviews_cache(movie_id, session)
+        invalidate_user_stats(user.id, session)
 
-        await session.commit()
+        await job_queue.commit(session)
 
         return {"status": "success", "message": "Отзыв удалён"}
 
@@ -138,29 +290,32 @@ async def delete_review(
 
 # -------------------- Редактировать отзыв ----------------------
 
-@router.patch("/edit/{review_id}", response_model=ReviewReadSchema)
+@router.patch("/edit/{review_id}", response_model=ReviewReadSchema, dependencies=[limit_by_user(WRITE_LIMIT)])
 async def update_review(
     review_id: int,
     review_data: ReviewCreateSchema,
     session: SessionDep,
-    credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)
+    user: CurrentUserDep
 ):
-    token = credentials.credentials
-    user = await get_current_user_from_token(token, session)
-    if not user:
-        raise HTTPException(status_code=401, detail="Недействительный токен")
-
     # VALIDATION -----
     if not 0 <= review_data.score <= 5:
         raise HTTPException(status_code=400, detail="Оценка должна быть от 0 до 5")
 
+    # блокируем строку отзыва: иначе два параллельных изменения прочтут одну и ту же
+    # старую оценку и сдвинут агрегаты фильма на неверную дельту.
+    # Отзыв к удалённому фильму — как несуществующий: его удалит очистка (src/movie_purge.py)
     review = (await session.execute(
-        select(Review).where(Review.id == review_id, Review.user_id == user.id)
+        select(Review)
+        .join(Movie, Movie.id == Review.movie_id)
+        .where(Review.id == review_id, Review.user_id == user.id, Movie.deleted_at.is_(None))
+        .with_for_update(of=Review)
     )).scalar_one_or_none()
 
     if not review:
         raise HTTPException(status_code=404, detail="Отзыв не найден или не принадлежит вам")
 
+    old_score = review.score
+
     try:
         review.text = review_data.text
         review.score = review_data.score
@@ -168,9 +323,11 @@ async def update_review(
         session.add(review)
         await session.flush()
 
-        await recalc_movie_rating(review.movie_id, session)
+        await record_rating_delta(review.movie_id, 0, review.score - old_score, session)
+        invalidate_reviews_cache(review.movie_id, session)
+        invalidate_user_stats(user.id, session)
 
-        await session.commit()
+        await job_queue.commit(session)
         await session.refresh(review)
 
         return review
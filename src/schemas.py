@@ -1,6 +1,6 @@
 import datetime
 from typing import Optional
-from pydantic import BaseModel, EmailStr, constr
+from pydantic import BaseModel, EmailStr, constr, conlist
 
 
 # ------------------ User ------------------
@@ -30,17 +30,25 @@ class ReviewCreateSchema(BaseModel):
         "from_attributes": True
     }
 
+class ReviewBatchSchema(BaseModel):
+    items: conlist(ReviewCreateSchema, min_length=1, max_length=1000)
+
 class ReviewReadSchema(BaseModel):
     id: int
     user_id: int
     movie_id: int
     score: float
     text: Optional[str]
+    created_at: Optional[datetime.datetime] = None
 
     model_config = {
         "from_attributes": True
     }
 
+class ReviewPageSchema(BaseModel):
+    items: list[ReviewReadSchema]
+    next_cursor: Optional[str] = None  # None — страниц больше нет
+
 
 # ------------------ Movie ------------------
 
@@ -48,22 +56,86 @@ class MovieAddCustomSchema(BaseModel):
     title: str
     genre: Optional[str] = None
     description: Optional[str] = None
-    rating: Optional[float] = 0.0
+    rating: Optional[float] = 0.0  # личная оценка на полке
 
     model_config = {"from_attributes": True}
 
-class MovieReadSchema(BaseModel):
+class MovieSummarySchema(BaseModel):
     id: int
     title: str
     genre: Optional[str] = None
     description: Optional[str] = None
-    rating: float
-    owner_id: Optional[int] = None
-    reviews: list[ReviewReadSchema] = []  # просто пустой список
+    rating: float  # средняя оценка по отзывам
+    review_count: int = 0
+    created_at: Optional[datetime.datetime] = None
+    tmdb_id: Optional[int] = None  # у фильмов, импортированных из TMDB
+    # с полки текущего пользователя; None — фильма на его полке нет
+    my_rating: Optional[float] = None
+    added_at: Optional[datetime.datetime] = None
 
     model_config = {
         "from_attributes": True
-    }
+    } # читает только колонки — связь Movie.reviews не трогается
+
+class MovieReadSchema(MovieSummarySchema):
+    # None — отзывы не запрашивались; список — последние отзывы (?include_reviews=true)
+    reviews: Optional[list[ReviewReadSchema]] = None
+
+class MoviePageSchema(BaseModel):
+    items: list[MovieReadSchema]
+    next_cursor: Optional[str] = None  # None — страниц больше нет
+
+class MovieIdsSchema(BaseModel):
+    ids: conlist(int, min_length=1, max_length=1000)
+
+class MovieDeleteResultSchema(BaseModel):
+    deleted: int                 # снято с полки
+    not_found: list[int] = []    # id, которых на полке не было
+
+class SimilarMovieSchema(MovieSummarySchema):
+    similarity: float  # косинусное сходство по оценкам отзывов (см. src/recommendations.py)
+
+class RecommendedMovieSchema(MovieSummarySchema):
+    score: float  # сумма сходств с фильмами пользователя, взвешенных его оценками
+
+class TopMovieSchema(MovieReadSchema):
+    score: float  # байесовская оценка на момент обновления рейтинга (см. src/leaderboard.py)
+
+class TopMoviePageSchema(BaseModel):
+    items: list[TopMovieSchema]
+    next_cursor: Optional[str] = None
+
+
+# ------------------ Bulk import ------------------
+
+class BulkRowErrorSchema(BaseModel):
+    row: int  # номер записи в файле, начиная с 1
+    error: str
+
+class BulkImportResultSchema(BaseModel):
+    inserted: int
+    failed: int
+    errors: list[BulkRowErrorSchema] = []
+
+class GenreCountSchema(BaseModel):
+    genre: Optional[str] = None
+    count: int
+
+class ScoreBucketSchema(BaseModel):
+    score: int  # целая часть оценки отзыва
+    count: int
+
+class UserStatsSchema(BaseModel):
+    movie_count: int
+    rated_count: int                          # фильмов с личной оценкой
+    average_rating: Optional[float] = None    # средняя личная оценка
+    genres: list[GenreCountSchema]
+    review_count: int
+    average_review_score: Optional[float] = None
+    score_histogram: list[ScoreBucketSchema]
+
+class TmdbImportSchema(BaseModel):
+    ids: conlist(int, min_length=1, max_length=200)  # id фильмов в TMDB
 
 
 # ------------------ Update rating ------------------
@@ -0,0 +1,44 @@
+from sqlalchemy import Select, select, func, or_, and_, literal
+from src.models import Movie, ShelfEntry
+from src.pagination import paginate
+
+
+# ------------------- Поиск фильмов -------------------
+#
+# Совпадение — либо полнотекстовое (search_vector @@ запрос, GIN-индекс),
+# либо нечёткое по названию (title % запрос, триграммный GIN-индекс).
+# Релевантность — большее из ts_rank и триграммного сходства названия.
+# Выдача keyset-пагинируется по (relevance, id) по убыванию.
+# Ищем по каталогу; полка пользователя присоединяется слева (личная оценка
+# в выдаче), а с mine — обычным join, и остаются только фильмы с его полки.
+
+def build_search_query(columns: tuple, q: str | None, genre: str | None,
+                       min_rating: float | None, max_rating: float | None,
+                       user_id: int | None, mine: bool, cursor: str | None, limit: int) -> Select:
+    if q:
+        ts_query = func.websearch_to_tsquery("simple", q)
+        relevance = func.greatest(func.ts_rank(Movie.search_vector, ts_query),
+                                  func.similarity(Movie.title, q))
+        query = select(*columns, relevance.label("relevance")).where(
+            or_(Movie.search_vector.op("@@")(ts_query), Movie.title.op("%")(q))
+        )
+    else:
+        # без текста — просто фильтры, порядок по id
+        relevance = literal(0.0)
+        query = select(*columns, relevance.label("relevance"))
+
+    if user_id is not None:
+        shelf = and_(ShelfEntry.movie_id == Movie.id, ShelfEntry.user_id == user_id)
+        query = query.select_from(Movie).join(ShelfEntry, shelf, isouter=not mine)
+
+    query = query.where(Movie.deleted_at.is_(None))
+    if genre:
+        query = query.where(func.lower(Movie.genre) == genre.lower())
+    if min_rating is not None:
+        query = query.where(Movie.rating >= min_rating)
+    if max_rating is not None:
+        query = query.where(Movie.rating <= max_rating)
+
+    if q:
+        return paginate(query, Movie.id, relevance, "relevance", True, cursor, limit)
+    return paginate(query, Movie.id, Movie.id, "id", False, cursor, limit)
@@ -0,0 +1,129 @@
+import argparse
+import copy
+import importlib.util
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger("movieshelf.startup")
+
+
+# ------------------- Продакшен-запуск -------------------
+#
+#   python -m src.server                       # SERVER_WORKERS воркеров (0 — по числу ядер)
+#   python -m src.server --workers 4 --port 8080
+#
+# Мастер-процесс не импортирует приложение: uvicorn получает строку "src.main:app",
+# и FastAPI, SQLAlchemy и роутеры загружает только каждый воркер. Поэтому модуль
+# импортирует лишь стандартную библиотеку, а настройки и uvicorn — внутри main().
+#
+# Каждый воркер в lifespan прогревает пул и пишет в лог movieshelf.startup
+# JSON-строку со временем старта по этапам (см. StartupTimer). Пока прогрев
+# не закончен и после начала остановки, GET /health/ready отвечает 503. Если
+# при старте primary не ответил, воркер не готов, пока SELECT 1 из /health/ready
+# не пройдёт.
+#
+# Соединений с базой у сервера до workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# на primary — это должно помещаться в max_connections Postgres.
+
+LAUNCHED_AT_ENV = "MOVIESHELF_LAUNCHED_AT"
+
+
+# ------------------- Время старта воркера -------------------
+
+class StartupTimer:
+    """Этапы старта воркера: import — загрузка src.main, warmup — прогрев пулов.
+    since_launch_s считается от запуска python -m src.server и включает старт
+    интерпретатора и порождение воркера"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages: dict[str, float] = {}
+        self.report: dict | None = None
+        self.ready = False
+        self.stopping = False
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages[stage] = now - self._last
+        self._last = now
+
+    def finish(self, ready: bool = True, **details) -> dict:
+        """ready=False — база недоступна: воркер стартовал, но готовность подтвердит /health/ready"""
+        launched_at = os.environ.get(LAUNCHED_AT_ENV)
+        self.report = {
+            "event": "worker_ready",
+            "pid": os.getpid(),
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+            "ready_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "since_launch_ms": round((time.time() - float(launched_at)) * 1000, 1) if launched_at else None,
+            "database_ready": ready,
+            **details,
+        }
+        self.ready = ready
+        logger.info(json.dumps(self.report, ensure_ascii=False))
+        return self.report
+
+
+startup = StartupTimer()
+
+
+# ------------------- Запуск uvicorn -------------------
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _log_config() -> dict:
+    from uvicorn.config import LOGGING_CONFIG
+
+    # логгеры приложения (movieshelf.*) пишут через тот же обработчик, что и uvicorn
+    config = copy.deepcopy(LOGGING_CONFIG)
+    config["loggers"]["movieshelf"] = {"handlers": ["default"], "level": "INFO", "propagate": False}
+    return config
+
+
+def main():
+    from src.config import settings
+
+    parser = argparse.ArgumentParser(description="Запуск MovieShelf в нескольких воркерах uvicorn")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS, help="0 — по числу ядер")
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    loop = "uvloop" if _available("uvloop") else "asyncio"
+    http = "httptools" if _available("httptools") else "h11"
+    if loop != "uvloop" or http != "httptools":
+        print(f"uvloop/httptools не установлены, используются {loop}/{http}")
+
+    # воркеры наследуют окружение: по этой метке они считают время от запуска
+    os.environ[LAUNCHED_AT_ENV] = str(time.time())
+
+    import uvicorn
+
+    uvicorn.run(
+        "src.main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        lifespan="on",
+        backlog=settings.SERVER_BACKLOG,
+        # IP клиента из X-Forwarded-For только от своего балансировщика (см. src/rate_limit.py)
+        proxy_headers=True,
+        forwarded_allow_ips=settings.SERVER_FORWARDED_ALLOW_IPS,
+        # остановка ждёт запросы и lifespan: должно хватать на JOBS_DRAIN_TIMEOUT_SECONDS
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_SHUTDOWN_SECONDS,
+        access_log=settings.SERVER_ACCESS_LOG,
+        log_config=_log_config(),
+    )
+
+
+if __name__ == '__main__':
+    main()
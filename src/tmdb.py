@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, asdict
+import httpx
+from src.config import settings
+
+
+logger = logging.getLogger("movieshelf.tmdb")
+
+
+# ------------------- Метаданные фильмов из TMDB -------------------
+#
+# TmdbClient.get_movie(tmdb_id) отдаёт название, жанр и описание фильма:
+#   1. одновременные запросы одного id схлопываются в одну загрузку;
+#   2. загрузка сначала смотрит в кэш на диске (SQLite, TTL + вытеснение давно
+#      не читанных записей) — тёплый импорт вообще не ходит в сеть; 404 тоже
+#      кэшируется, но на NOT_FOUND_TTL: фильм может появиться в TMDB позже;
+#   3. промах идёт в TMDB через общий httpx-клиент с пулом keep-alive соединений,
+#      не больше TMDB_CONCURRENCY запросов одновременно; 429 и 5xx повторяются.
+#
+# Для тестов и бенчмарков есть локальная подмена TMDB — benchmarks/fake_tmdb.py.
+
+class TmdbError(Exception):
+    """TMDB недоступен или ответил ошибкой"""
+
+
+class TmdbNotFound(TmdbError):
+    """В TMDB нет фильма с таким id"""
+
+
+@dataclass
+class TmdbMovie:
+    tmdb_id: int
+    title: str
+    genre: str  # "" — у фильма в TMDB нет жанров (movies.genre NOT NULL)
+    description: str | None
+    release_date: str | None
+
+    @classmethod
+    def from_api(cls, data: dict) -> "TmdbMovie":
+        genres = data.get("genres") or []
+        return cls(
+            tmdb_id=data["id"],
+            title=(data.get("title") or data.get("original_title") or "")[:100],
+            genre=genres[0]["name"][:100] if genres else "",
+            description=data.get("overview") or None,
+            release_date=data.get("release_date") or None,
+        )
+
+
+# ------------------- Кэш на диске -------------------
+
+class MetadataCache:
+    """Кэш метаданных по tmdb_id в файле SQLite: переживает рестарт и общий
+    для воркеров одной машины. Запросы к файлу — в потоке, не в event loop"""
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")  # читатели не ждут писателя из другого воркера
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tmdb_movies (
+                    tmdb_id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_tmdb_movies_used_at ON tmdb_movies (used_at)")
+        return self._conn
+
+    def _get(self, tmdb_id: int) -> dict | None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT payload, expires_at, used_at FROM tmdb_movies WHERE tmdb_id = ?",
+                               (tmdb_id,)).fetchone()
+            if row is None:
+                return None
+            payload, expires_at, used_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM tmdb_movies WHERE tmdb_id = ?", (tmdb_id,))
+                return None
+            # время чтения обновляем не чаще раза в минуту — не превращать каждое чтение в запись
+            if now - used_at > 60:
+                conn.execute("UPDATE tmdb_movies SET used_at = ? WHERE tmdb_id = ?", (now, tmdb_id))
+        return json.loads(payload)
+
+    def _put(self, tmdb_id: int, payload: dict, ttl: float | None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO tmdb_movies (tmdb_id, payload, expires_at, used_at) "
+                         "VALUES (?, ?, ?, ?)", (tmdb_id, json.dumps(payload, ensure_ascii=False), expires_at, now))
+            excess = conn.execute("SELECT count(*) FROM tmdb_movies").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute("DELETE FROM tmdb_movies WHERE tmdb_id IN "
+                             "(SELECT tmdb_id FROM tmdb_movies ORDER BY used_at LIMIT ?)", (excess,))
+
+    async def get(self, tmdb_id: int) -> dict | None:
+        return await asyncio.to_thread(self._get, tmdb_id)
+
+    async def put(self, tmdb_id: int, payload: dict, ttl: float | None = None):
+        await asyncio.to_thread(self._put, tmdb_id, payload, ttl)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# ------------------- Клиент TMDB -------------------
+
+MAX_ATTEMPTS = 3
+MAX_RETRY_AFTER = 5.0  # дольше не ждём — пользователь ждёт ответа
+NOT_FOUND_TTL = 3600
+NOT_FOUND = {"not_found": True}
+
+
+class TmdbClient:
+
+    def __init__(self, cache: MetadataCache, base_url: str, api_key: str, access_token: str,
+                 language: str, timeout: float, max_connections: int, concurrency: int):
+        self.cache = cache
+        self.base_url = base_url
+        self.api_key = api_key
+        self.access_token = access_token
+        self.language = language
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.transport: httpx.AsyncBaseTransport | None = None
+        self.requests = 0  # запросов, ушедших в TMDB (для бенчмарка и отладки)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._inflight: dict[int, asyncio.Future] = {}
+        self._http: httpx.AsyncClient | None = None
+
+    def _client(self) -> httpx.AsyncClient:
+        # создаётся при первом запросе — уже внутри event loop воркера
+        if self._http is None:
+            headers = {"Accept": "application/json"}
+            params = {"language": self.language}
+            if self.access_token:
+                headers["Authorization"] = f"Bearer {self.access_token}"
+            elif self.api_key:
+                params["api_key"] = self.api_key
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url, headers=headers, params=params, timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                transport=self.transport,
+            )
+        return self._http
+
+    async def get_movie(self, tmdb_id: int) -> TmdbMovie:
+        future = self._inflight.get(tmdb_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load(tmdb_id))
+            self._inflight[tmdb_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(tmdb_id, None))
+        # отмена одного ожидающего (клиент отключился) не отменяет загрузку для остальных
+        return await asyncio.shield(future)
+
+    async def _load(self, tmdb_id: int) -> TmdbMovie:
+        cached = await self.cache.get(tmdb_id)
+        if cached == NOT_FOUND:
+            raise TmdbNotFound(f"Фильм {tmdb_id} не найден в TMDB")
+        if cached is not None:
+            return TmdbMovie(**cached)
+
+        try:
+            movie = TmdbMovie.from_api(await self._fetch(tmdb_id))
+        except TmdbNotFound:
+            await self.cache.put(tmdb_id, NOT_FOUND, NOT_FOUND_TTL)
+            raise
+        await self.cache.put(tmdb_id, asdict(movie))
+        return movie
+
+    async def _fetch(self, tmdb_id: int) -> dict:
+        async with self._semaphore:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                delay = 0.2 * 2 ** attempt
+                try:
+                    self.requests += 1
+                    response = await self._client().get(f"/movie/{tmdb_id}")
+                except httpx.TransportError as e:
+                    logger.warning("TMDB: %s при загрузке %s (попытка %s)", type(e).__name__, tmdb_id, attempt)
+                else:
+                    if response.status_code == 404:
+                        raise TmdbNotFound(f"Фильм {tmdb_id} не найден в TMDB")
+                    if response.status_code == 200:
+                        return response.json()
+                    if response.status_code != 429 and response.status_code < 500:
+                        raise TmdbError(f"TMDB ответил {response.status_code}")
+                    try:
+                        delay = min(float(response.headers.get("retry-after", delay)), MAX_RETRY_AFTER)
+                    except ValueError:
+                        pass
+                if attempt < MAX_ATTEMPTS:
+                    await asyncio.sleep(delay)
+
+        raise TmdbError("TMDB недоступен")
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        self.cache.close()
+
+
+tmdb_client = TmdbClient(
+    MetadataCache(settings.TMDB_CACHE_PATH, settings.TMDB_CACHE_TTL_SECONDS, settings.TMDB_CACHE_MAX_ENTRIES),
+    settings.TMDB_BASE_URL, settings.TMDB_API_KEY, settings.TMDB_ACCESS_API_KEY, settings.TMDB_LANGUAGE,
+    settings.TMDB_TIMEOUT_SECONDS, settings.TMDB_MAX_CONNECTIONS, settings.TMDB_CONCURRENCY,
+)
+
+
+def use_transport(transport: httpx.AsyncBaseTransport):
+    """Подменить транспорт HTTP (например, на benchmarks/fake_tmdb.py через httpx.ASGITransport).
+    Вызывать до первого запроса"""
+    tmdb_client.transport = transport
@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from src.schemas import UserReadSchema
+from src.config import settings
+
+
+# ------------------- Кэш проверенных токенов -------------------
+
+class TokenCache:
+    """LRU-кэш "токен -> пользователь" с ограниченным размером.
+
+    Запись живёт не дольше TTL и никогда не переживает exp самого токена.
+    Кэш свой в каждом воркере и токены пользователя не сбрасывает: TTL — граница,
+    сколько удалённый пользователь ещё проходит проверку уже выданным токеном.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items: OrderedDict[str, tuple[float, UserReadSchema]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, token: str) -> UserReadSchema | None:
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+
+            expires_at, user = item
+            if expires_at <= time.time():
+                del self._items[token]
+                return None
+
+            self._items.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: UserReadSchema, token_exp: float):
+        expires_at = min(token_exp, time.time() + self.ttl_seconds)
+
+        with self._lock:
+            self._items[token] = (expires_at, user)
+            self._items.move_to_end(token)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+token_cache = TokenCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL_SECONDS)
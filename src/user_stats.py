@@ -0,0 +1,74 @@
+import math
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.jobs import job_queue
+from src.models import Movie, Review, ShelfEntry
+from src.response_cache import response_cache
+
+
+# ------------------- Статистика пользователя -------------------
+#
+# GET /movies/my/stats — два GROUP BY: полка по жанрам (число фильмов, сумма и
+# число личных оценок) и отзывы пользователя по целой части оценки. Итоги
+# складываются из групп в Python, отдельных запросов на них нет.
+#
+# Готовый ответ кэшируется в response_cache под версией "stats:{user_id}";
+# ручки записи полки и отзывов сбрасывают версию задачей в job_queue.commit(), до
+# ответа, как кэш страниц отзывов (см. src/routers/reviews_router.py). Удалённые фильмы и
+# отзывы к ним не считаются; кэш авторов таких отзывов сбрасывает очистка
+# (src/movie_purge.py), до того — не дольше RESPONSE_CACHE_TTL_SECONDS.
+
+USER_STATS_CACHE_JOB = "user_stats_cache"
+
+SCORE_BUCKETS = range(6)  # оценки 0..5: корзина — целая часть, 5.0 попадает в 5
+
+
+def user_stats_namespace(user_id: int) -> str:
+    return f"stats:{user_id}"
+
+
+async def _invalidate_user_stats(session: AsyncSession, items: dict[int, None]):
+    for user_id in items:
+        await response_cache.invalidate(user_stats_namespace(user_id))
+
+job_queue.register(USER_STATS_CACHE_JOB, _invalidate_user_stats, inline=True)
+
+
+def invalidate_user_stats(user_id: int, session: AsyncSession):
+    job_queue.enqueue(session, USER_STATS_CACHE_JOB, user_id)
+
+
+async def load_user_stats(session: AsyncSession, user_id: int) -> dict:
+    genres = (await session.execute(
+        select(Movie.genre, func.count().label("movies"),
+               func.count(ShelfEntry.rating).label("rated"), func.sum(ShelfEntry.rating).label("rating_sum"))
+        .select_from(ShelfEntry)
+        .join(Movie, Movie.id == ShelfEntry.movie_id)
+        .where(ShelfEntry.user_id == user_id, Movie.deleted_at.is_(None))
+        .group_by(Movie.genre)
+        .order_by(func.count().desc(), Movie.genre)
+    )).all()
+
+    bucket = func.floor(Review.score).label("bucket")
+    scores = (await session.execute(
+        select(bucket, func.count().label("reviews"), func.sum(Review.score).label("score_sum"))
+        .join(Movie, Movie.id == Review.movie_id)
+        .where(Review.user_id == user_id, Movie.deleted_at.is_(None))
+        .group_by(bucket)
+    )).all()
+
+    rated = sum(row.rated for row in genres)
+    reviews = sum(row.reviews for row in scores)
+    histogram = dict.fromkeys(SCORE_BUCKETS, 0)
+    for row in scores:
+        histogram[min(int(row.bucket), SCORE_BUCKETS[-1])] += row.reviews
+
+    return {
+        "movie_count": sum(row.movies for row in genres),
+        "rated_count": rated,
+        "average_rating": math.fsum(row.rating_sum or 0 for row in genres) / rated if rated else None,
+        "genres": [{"genre": row.genre, "count": row.movies} for row in genres],
+        "review_count": reviews,
+        "average_review_score": math.fsum(row.score_sum for row in scores) / reviews if reviews else None,
+        "score_histogram": [{"score": score, "count": count} for score, count in histogram.items()],
+    }